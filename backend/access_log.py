@@ -0,0 +1,156 @@
+# 异步日志管线：请求线程只把日志记录放进有界队列，由单个后台线程写文件（含轮转检查）
+# 队列积压时优先丢弃访问日志、队列满时丢弃所有新记录并计数，之后汇总写一条告警，不阻塞请求
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from flask import request, g
+
+# 队列容量
+LOG_QUEUE_SIZE = 10000
+# 队列占用超过该比例时开始丢弃INFO级别的访问日志，为告警和错误日志留出空间
+ACCESS_DROP_RATIO = 0.8
+
+access_logger = logging.getLogger('access')
+
+def access_log_path(log_path):
+    """访问日志单独写入同目录下的 *.access.log（如 backend.log -> backend.access.log）"""
+    root, ext = os.path.splitext(log_path)
+    return f'{root}.access{ext or ".log"}'
+
+class AccessFilter(logging.Filter):
+    """include为True时只通过访问日志记录，为False时只通过其他记录"""
+
+    def __init__(self, include):
+        super().__init__()
+        self.include = include
+
+    def filter(self, record):
+        return (record.name == access_logger.name) == self.include
+
+class DroppingQueueHandler(QueueHandler):
+    """队列满时不阻塞，直接丢弃并计数"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self.dropped_lock = threading.Lock()
+
+    def enqueue(self, record):
+        q = self.queue
+        if record.levelno < logging.WARNING and q.qsize() >= q.maxsize * ACCESS_DROP_RATIO:
+            self._drop()
+            return
+        try:
+            q.put_nowait(record)
+        except queue.Full:
+            self._drop()
+
+    def _drop(self):
+        with self.dropped_lock:
+            self.dropped += 1
+
+    def take_dropped(self):
+        with self.dropped_lock:
+            count, self.dropped = self.dropped, 0
+        return count
+
+class AggregatingQueueListener(QueueListener):
+    """后台写日志线程，顺带把期间丢弃的日志数量汇总成一条告警"""
+
+    def __init__(self, log_queue, source, *handlers):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.source = source
+        self.total_dropped = 0
+
+    def handle(self, record):
+        super().handle(record)
+        dropped = self.source.take_dropped()
+        if dropped:
+            self.total_dropped += dropped
+            summary = logging.LogRecord('logging', logging.WARNING, __file__, 0,
+                                        f'[警告] 日志队列积压，已丢弃{dropped}条日志', None, None)
+            super().handle(summary)
+
+class LogPipeline:
+    def __init__(self):
+        self.queue = None
+        self.handler = None
+        self.listener = None
+
+    def start(self, log_path):
+        """将根日志器和werkzeug日志器接入异步队列，文件写入只在后台线程进行"""
+        if self.listener is not None:
+            return
+        self.queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        self.handler = DroppingQueueHandler(self.queue)
+        file_handler = RotatingFileHandler(log_path, maxBytes=5*1024*1024, backupCount=2, encoding='utf-8')
+        file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+        file_handler.addFilter(AccessFilter(False))
+        # 访问日志每行只有一个JSON对象（时间戳在对象内），可直接交给jq或日志采集程序
+        access_handler = RotatingFileHandler(access_log_path(log_path), maxBytes=5*1024*1024, backupCount=2, encoding='utf-8')
+        access_handler.setFormatter(logging.Formatter('%(message)s'))
+        access_handler.addFilter(AccessFilter(True))
+        self.listener = AggregatingQueueListener(self.queue, self.handler, file_handler, access_handler)
+        root = logging.getLogger()
+        root.setLevel(logging.INFO)
+        root.addHandler(self.handler)
+        # 访问日志由access日志器以JSON输出，werkzeug自带的请求行日志不再重复记录；
+        # werkzeug日志向上传播到根日志器，不再单独挂处理器
+        werkzeug_log = logging.getLogger('werkzeug')
+        werkzeug_log.setLevel(logging.WARNING)
+        werkzeug_log.propagate = True
+        self.listener.start()
+
+    def stop(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def stats(self):
+        if self.queue is None:
+            return {'enabled': False}
+        return {
+            'enabled': True,
+            'queue_depth': self.queue.qsize(),
+            'queue_capacity': self.queue.maxsize,
+            'dropped_pending': self.handler.dropped,
+            'dropped_total': self.listener.total_dropped if self.listener else 0
+        }
+
+log_pipeline = LogPipeline()
+
+def _before_request():
+    g.access_start = time.perf_counter()
+
+def _after_request(response):
+    start = g.get('access_start')
+    if start is None:
+        return response
+    ip = request.headers.get('X-Forwarded-For', request.remote_addr) or ''
+    if ',' in ip:
+        ip = ip.split(',')[0].strip()
+    entry = {
+        'time': datetime.now().astimezone().isoformat(timespec='milliseconds'),
+        'method': request.method,
+        'path': request.full_path.rstrip('?'),
+        'status': response.status_code,
+        'ip': ip,
+        'bytes': response.content_length
+    }
+
+    # 响应体发送完毕后记录，耗时包含传输时间
+    def on_close():
+        entry['latency_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        access_logger.info(json.dumps(entry, ensure_ascii=False))
+    response.call_on_close(on_close)
+    return response
+
+def init_access_log(app):
+    """在Flask应用上注册结构化访问日志钩子"""
+    app.before_request(_before_request)
+    app.after_request(_after_request)
@@ -0,0 +1,170 @@
+# 上传准入控制：在读取请求体之前做并发限制（按接口、按IP）和磁盘空间/配额预检
+# 超限请求快速失败，返回429/503和Retry-After，由前端排队后重试
+import os
+import shutil
+import threading
+import time
+from functools import wraps
+from flask import request, jsonify
+from config import config
+
+# multipart表单的边界、字段头等额外开销，Content-Length会略大于文件本身
+MULTIPART_OVERHEAD = 64 * 1024
+# 目录占用按上传完成的字节数累加，每隔多少秒（或有文件删除、压缩后）在后台重新遍历目录校准一次
+USAGE_REFRESH_SECONDS = 300
+
+def get_client_ip():
+    """获取客户端IP，与上传记录保持一致（优先X-Forwarded-For第一个地址）"""
+    ip = request.headers.get('X-Forwarded-For', request.remote_addr) or ''
+    if ',' in ip:
+        ip = ip.split(',')[0].strip()
+    return ip
+
+def folder_usage(folder):
+    """统计目录下所有文件的总字节数（包含子目录）"""
+    total = 0
+    for root, _, names in os.walk(folder):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+class UploadAdmission:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = {}        # 接口 -> 正在进行的上传数
+        self.active_ip = {}     # (接口, IP) -> 正在进行的上传数
+        self.reserved = {}      # 目录 -> 进行中上传预占的字节数
+        self.usage = {}         # 目录 -> [已用字节数, 上次遍历时间]
+        self.refreshing = {}    # 目录 -> 遍历期间又有变化，结束后需要再遍历一次
+        self.rejected = {'concurrency': 0, 'per_ip': 0, 'disk': 0, 'quota': 0, 'size': 0}
+
+    def _usage(self, folder):
+        """
+        目录已用字节数，不持有锁调用。
+        第一次遍历目录得到初值，之后使用累加的计数，过期时在后台重新遍历，上传请求不等待遍历
+        """
+        with self.lock:
+            entry = self.usage.get(folder)
+        if entry is None:
+            used = folder_usage(folder)
+            with self.lock:
+                entry = self.usage.setdefault(folder, [used, time.time()])
+            return entry[0]
+        if time.time() - entry[1] >= USAGE_REFRESH_SECONDS:
+            self.invalidate_usage(folder)
+        return entry[0]
+
+    def _refresh(self, folder):
+        while True:
+            used = folder_usage(folder)
+            with self.lock:
+                self.usage[folder] = [used, time.time()]
+                if not self.refreshing.pop(folder):
+                    return
+                self.refreshing[folder] = False
+
+    def invalidate_usage(self, folder):
+        """目录中有文件删除、替换或压缩后调用，在后台重新遍历目录校准占用；已在遍历时结束后再遍历一次"""
+        with self.lock:
+            if folder not in self.usage:
+                return
+            if folder in self.refreshing:
+                self.refreshing[folder] = True
+                return
+            self.refreshing[folder] = False
+        threading.Thread(target=self._refresh, args=(folder,), name='upload-usage', daemon=True).start()
+
+    def _reject(self, reason, status, message, retry=True):
+        with self.lock:
+            self.rejected[reason] += 1
+        resp = jsonify({'error': message, 'reason': reason})
+        resp.status_code = status
+        if retry:
+            resp.headers['Retry-After'] = str(config.get('upload_retry_after', 5))
+        return resp
+
+    def try_acquire(self, endpoint, folder, max_size):
+        """尝试为当前请求申请上传名额，成功返回(令牌, None)，失败返回(None, 错误响应)"""
+        length = request.content_length
+        if length is None:
+            return None, (jsonify({'error': '缺少Content-Length，无法上传'}), 411)
+        if length > max_size + MULTIPART_OVERHEAD:
+            return None, self._reject('size', 413, f'文件大小超过限制（最大{max_size//1024//1024}MB）', retry=False)
+
+        ip = get_client_ip()
+        max_concurrent = config.get('upload_max_concurrent', 4)
+        max_per_ip = config.get('upload_max_concurrent_per_ip', 2)
+        min_free = config.get('upload_min_free_mb', 500) * 1024 * 1024
+        quota = config.get('upload_folder_quota_mb', 0) * 1024 * 1024
+
+        # 磁盘和目录统计都在锁外取得，锁内只比较计数
+        free = shutil.disk_usage(folder).free
+        used = self._usage(folder) if quota else 0
+        rejection = None
+        with self.lock:
+            reserved = self.reserved.get(folder, 0)
+            if quota:
+                used = self.usage[folder][0]
+            if self.active.get(endpoint, 0) >= max_concurrent:
+                rejection = ('concurrency', 503, '服务器上传繁忙，请稍后重试')
+            elif self.active_ip.get((endpoint, ip), 0) >= max_per_ip:
+                rejection = ('per_ip', 429, '您同时进行的上传过多，请稍后重试')
+            elif free - reserved - length < min_free:
+                rejection = ('disk', 503, '服务器磁盘空间不足，请稍后重试')
+            elif quota and used + reserved + length > quota:
+                rejection = ('quota', 503, '存储配额已满，请稍后重试')
+            else:
+                self.active[endpoint] = self.active.get(endpoint, 0) + 1
+                self.active_ip[(endpoint, ip)] = self.active_ip.get((endpoint, ip), 0) + 1
+                self.reserved[folder] = reserved + length
+        if rejection is not None:
+            return None, self._reject(*rejection)
+        return (endpoint, ip, folder, length), None
+
+    def release(self, token, committed=False):
+        """释放上传名额；committed为真表示上传已保存，预占的字节数计入目录占用"""
+        endpoint, ip, folder, length = token
+        with self.lock:
+            self.active[endpoint] -= 1
+            key = (endpoint, ip)
+            self.active_ip[key] -= 1
+            if self.active_ip[key] <= 0:
+                del self.active_ip[key]
+            self.reserved[folder] -= length
+            if committed and folder in self.usage:
+                self.usage[folder][0] += length
+
+    def limit(self, endpoint, folder, max_size):
+        """装饰器：为上传接口加上准入控制"""
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                token, error = self.try_acquire(endpoint, folder, max_size)
+                if error is not None:
+                    return error
+                committed = False
+                try:
+                    response = view(*args, **kwargs)
+                    status = response[1] if isinstance(response, tuple) and len(response) > 1 else getattr(response, 'status_code', 200)
+                    committed = isinstance(status, int) and status < 300
+                    return response
+                finally:
+                    self.release(token, committed)
+            return wrapper
+        return decorator
+
+    def stats(self):
+        """当前准入状态，用于排查与监控"""
+        with self.lock:
+            return {
+                'active': dict(self.active),
+                'active_ips': len(self.active_ip),
+                'reserved_bytes': dict(self.reserved),
+                'rejected': dict(self.rejected)
+            }
+
+# 全局准入控制实例，文件与视频上传接口共用
+upload_admission = UploadAdmission()
@@ -1,9 +1,32 @@
-from flask import Blueprint, request, jsonify, send_from_directory
+from flask import Blueprint, request, jsonify, send_file
 import os
+import io
+import gzip
+import html
+import zipfile
 from werkzeug.utils import secure_filename
 import json
 import socket
-import threading
+from urllib.parse import quote
+from admission import upload_admission
+from versioning import collection_versions
+from shared_state import shared_state, file_lock
+from profiling import phase
+from archive import is_zip, list_entries, public_entries, find_entry, open_entry
+from cold_storage import ColdStorage, COMPRESSED_SUFFIX, gzip_logical_size
+from offload import offload_response, offload_mode, send_local
+from byte_cache import byte_cache
+from batch import batch_processor, StorageArea, BatchError
+from maintenance import metadata_maintenance, MaintenanceArea
+from multicast import multicast_distributor
+from checksums import checksum_store
+from popularity import popularity
+from delta_sync import (signature, base_token, open_base, logical_size, apply_delta, DeltaError,
+                        MIN_BLOCK_SIZE, MAX_BLOCK_SIZE)
+from storage_index import ListIndex, find_path, ensure_shard, walk_files, is_listed, parse_list_args
+from tabular import read_csv, read_xlsx, TableError, MAX_ROWS
+from jobs import job_queue
+from image_optimize import ImageOptimizer
 
 # 文件相关API蓝图
 file_bp = Blueprint('file', __name__)
@@ -11,37 +34,73 @@ UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), '..', 'uploads')
 ALLOWED_FILE_EXTENSIONS = set(['txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'bmp', 'md', 'zip', 'rar', '7z', 'csv', 'xlsx', 'docx', 'pptx'])
 MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB
 FILE_INFO_PATH = os.path.join(os.path.dirname(__file__), '..', 'file_info.json')
-MAX_FILES = 10
-MAX_FILES_LOCK = threading.Lock()
+# 可文本预览、可压缩存储的文本/代码类扩展名
+TEXT_EXTENSIONS = set(['txt', 'md', 'csv', 'json', 'xml', 'yaml', 'yml', 'ini', 'log', 'conf', 'config',
+                       'js', 'ts', 'jsx', 'tsx', 'css', 'scss', 'less', 'html', 'htm', 'vue', 'py', 'java', 'c', 'cpp', 'h', 'hpp', 'php', 'rb', 'go', 'rs', 'swift', 'kt', 'scala', 'sql', 'sh', 'bat', 'ps1', 'dockerfile', 'toml'])
+
+# 列表type筛选的分类
+FILE_CATEGORIES = {
+    'image': set(['png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp', 'svg']),
+    'document': set(['pdf', 'docx', 'pptx', 'xlsx', 'csv', 'md', 'txt']),
+    'archive': set(['zip', 'rar', '7z']),
+    'audio': set(['mp3', 'wav', 'flac', 'aac', 'ogg', 'wma']),
+    'text': TEXT_EXTENSIONS
+}
+# 最大保留数量上限
+MAX_RETENTION = 100000
+# 直接以原文件流预览的类型：图片、pdf、音频
+PREVIEW_MEDIA_EXTENSIONS = set(['png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp', 'svg', 'pdf',
+                                'mp3', 'wav', 'flac', 'aac', 'ogg', 'wma'])
 
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
+def get_max_files():
+    # 最大保留数量保存在跨进程共享状态中，所有工作进程一致
+    return shared_state.get('max_files')
+
+def set_max_files(val):
+    shared_state.set('max_files', val)
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_FILE_EXTENSIONS
 
 def save_file_ip(filename, ip):
     try:
-        if os.path.exists(FILE_INFO_PATH):
-            with open(FILE_INFO_PATH, 'r', encoding='utf-8') as f:
-                info = json.load(f)
-        else:
-            info = {}
-        info[filename] = ip
-        with open(FILE_INFO_PATH, 'w', encoding='utf-8') as f:
-            json.dump(info, f, ensure_ascii=False)
+        with file_lock(FILE_INFO_PATH):
+            if os.path.exists(FILE_INFO_PATH):
+                with open(FILE_INFO_PATH, 'r', encoding='utf-8') as f, phase('json'):
+                    info = json.load(f)
+            else:
+                info = {}
+            info[filename] = ip
+            with open(FILE_INFO_PATH, 'w', encoding='utf-8') as f, phase('json'):
+                json.dump(info, f, ensure_ascii=False)
     except Exception as e:
         print('保存文件IP失败', e)
 
-def get_file_ip(filename):
+def load_file_info():
+    """读取全部上传IP记录，文件不存在或损坏时返回空字典"""
     try:
         if os.path.exists(FILE_INFO_PATH):
-            with open(FILE_INFO_PATH, 'r', encoding='utf-8') as f:
-                info = json.load(f)
-            return info.get(filename, '')
-        return ''
+            with open(FILE_INFO_PATH, 'r', encoding='utf-8') as f, phase('json'):
+                return json.load(f)
+        return {}
     except:
-        return ''
+        return {}
+
+def remove_file(file_path, filename):
+    """删除文件，并在同一把IP记录锁内移除其记录，列表中不会留下孤儿记录（元数据维护仍作兜底）"""
+    with file_lock(FILE_INFO_PATH):
+        os.remove(file_path)
+        info = load_file_info()
+        if filename in info:
+            del info[filename]
+            with open(FILE_INFO_PATH, 'w', encoding='utf-8') as f, phase('json'):
+                json.dump(info, f, ensure_ascii=False)
+
+def get_file_ip(filename):
+    return load_file_info().get(filename, '')
 
 def get_local_ip():
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -55,24 +114,150 @@ def get_local_ip():
         s.close()
     return ip
 
-def clean_old_files(folder, max_files):
-    files = [os.path.join(folder, f) for f in os.listdir(folder) if os.path.isfile(os.path.join(folder, f))]
-    if len(files) > max_files:
-        files.sort(key=lambda x: os.path.getmtime(x))
-        for f in files[:-max_files]:
-            os.remove(f)
+def logical_name(stored_name):
+    """磁盘上的文件名转换为对外展示的文件名（去掉压缩存储的.gz后缀）"""
+    if stored_name.endswith(COMPRESSED_SUFFIX):
+        name = stored_name[:-len(COMPRESSED_SUFFIX)]
+        if file_cold_storage.eligible(name):
+            return name
+    return stored_name
+
+def stored_path(filename):
+    """
+    查找文件的实际存储位置（分片目录，或旧版本留在根目录下的位置）。
+    返回: (路径, 是否压缩存储)，文件不存在时返回(None, False)
+    """
+    file_path = find_path(UPLOAD_FOLDER, filename)
+    if file_path is not None:
+        return file_path, False
+    if file_cold_storage.eligible(filename):
+        file_path = find_path(UPLOAD_FOLDER, filename, COMPRESSED_SUFFIX)
+        if file_path is not None:
+            return file_path, True
+    return None, False
+
+def on_file_compressed(filename):
+    upload_admission.invalidate_usage(UPLOAD_FOLDER)
+    collection_versions.bump('files', [('update', filename)])
+
+file_cold_storage = ColdStorage(UPLOAD_FOLDER, TEXT_EXTENSIONS, on_compressed=on_file_compressed)
+
+def clean_old_files(max_files, pending=()):
+    """
+    按修改时间只保留最新的max_files个文件，返回被清理的文件名列表。
+    pending: 已写入磁盘但尚未递增版本号的文件名
+    """
+    file_index.refresh(pending)
+    removed = []
+    for name in file_index.oldest(file_index.count() - max_files):
+        file_path, _ = stored_path(name)
+        if file_path is not None:
+            os.remove(file_path)
+        removed.append(name)
+    file_index.discard(removed)
+    if removed:
+        upload_admission.invalidate_usage(UPLOAD_FOLDER)
+    return removed
+
+batch_processor.register(StorageArea(
+    'file', UPLOAD_FOLDER, FILE_INFO_PATH, 'files',
+    retain=lambda pending: clean_old_files(get_max_files(), pending),
+    allowed=allowed_file, locate=stored_path, compressible=file_cold_storage.eligible
+))
+
+def stored_names():
+    """磁盘上现有文件的对外文件名集合"""
+    return {logical_name(name) for name, _ in walk_files(UPLOAD_FOLDER) if is_listed(name)}
+
+metadata_maintenance.register(MaintenanceArea('file', UPLOAD_FOLDER, FILE_INFO_PATH, 'files', stored_names))
+multicast_distributor.register('file', stored_path, '/api/file/download/')
+checksum_store.register('file', stored_path)
+popularity.register('file', 'files', stored_path)
+
+# PNG/JPEG上传后在后台无损压缩并生成网页显示用的缩小版本，缩小版本随文件的增删自动清理
+def uncompressed_path(filename):
+    file_path, compressed = stored_path(filename)
+    return None if compressed else file_path
+
+image_optimizer = ImageOptimizer(UPLOAD_FOLDER, 'files', uncompressed_path,
+                                 on_replaced=lambda name: checksum_store.schedule('file', name))
+job_queue.register('image_optimize', image_optimizer.run_job, max_attempts=2)
+collection_versions.subscribe(image_optimizer.on_change)
+
+def file_entry(filename, info=None):
+    """
+    生成单个文件的列表条目，文件不存在时返回None。size为原始大小，stored_size为磁盘占用。
+    info: 已读取的上传IP记录，批量生成时避免每个文件都重新解析
+    """
+    file_path, compressed = stored_path(filename)
+    if file_path is None:
+        return None
+    file_stat = os.stat(file_path)
+    ip = info.get(filename, '') if info is not None else get_file_ip(filename)
+    if ip and ',' in ip:
+        ip = ip.split(',')[0].strip()
+    # 新增：本机访问时自动获取内网IP
+    if ip == '127.0.0.1':
+        ip = get_local_ip()
+    return {
+        'name': filename,
+        'size': gzip_logical_size(file_path) if compressed else file_stat.st_size,
+        'stored_size': file_stat.st_size,
+        'compressed': compressed,
+        'modified': file_stat.st_mtime,
+        'ip': ip
+    }
+
+# 文件列表索引，按修改时间、大小、文件名预先排序
+file_index = ListIndex('files', UPLOAD_FOLDER, logical_name, file_entry, load_file_info,
+                       scores=lambda: popularity.scores('file'))
+
+def unique_filename(filename):
+    """如果文件已存在（包括已压缩存储的），添加数字后缀"""
+    counter = 1
+    original_filename = filename
+    while stored_path(filename)[0] is not None:
+        name, ext = os.path.splitext(original_filename)
+        filename = f"{name}_{counter}{ext}"
+        counter += 1
+    return filename
+
+def finish_upload(filename):
+    """新文件写入后：记录上传IP、按保留数量清理、递增版本号。返回上传IP"""
+    ip = request.headers.get('X-Forwarded-For', request.remote_addr)
+    if ip and ',' in ip:
+        ip = ip.split(',')[0].strip()
+    # 新增：本机访问时自动获取内网IP
+    if ip == '127.0.0.1':
+        ip = get_local_ip()
+    save_file_ip(filename, ip)
+    
+    with phase('fs'):
+        removed = clean_old_files(get_max_files(), [filename])
+    collection_versions.bump('files', [('add', filename)] + [('remove', name) for name in removed])
+    return ip
+
+def post_upload_jobs(filename):
+    """上传完成后放到后台执行的处理，返回任务号列表（可通过/api/jobs查询进度）"""
+    jobs = (image_optimizer.schedule(filename), checksum_store.schedule('file', filename))
+    return [job for job in jobs if job is not None]
 
 @file_bp.route('/upload', methods=['POST'])
+@upload_admission.limit('file_upload', UPLOAD_FOLDER, MAX_FILE_SIZE)
 def upload_file():
     """
     上传文件接口。支持自动重命名、大小校验、类型校验、记录上传IP。
+    进入接口前先经过准入控制（并发数、磁盘空间、配额），超限返回429/503。
     返回: 上传结果、文件名、大小、上传IP。
     """
     try:
-        if 'file' not in request.files:
+        # 解析multipart请求体，即从网络读取上传数据
+        with phase('network'):
+            files = request.files
+        if 'file' not in files:
             return jsonify({'error': '没有选择文件'}), 400
         
-        file = request.files['file']
+        file = files['file']
         if file.filename == '':
             return jsonify({'error': '没有选择文件'}), 400
         
@@ -87,70 +272,148 @@ def upload_file():
         if file_size > MAX_FILE_SIZE:
             return jsonify({'error': f'文件大小超过限制（最大{MAX_FILE_SIZE//1024//1024}MB）'}), 400
         
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(UPLOAD_FOLDER, filename)
-        
-        # 如果文件已存在，添加数字后缀
-        counter = 1
-        original_filename = filename
-        while os.path.exists(file_path):
-            name, ext = os.path.splitext(original_filename)
-            filename = f"{name}_{counter}{ext}"
-            file_path = os.path.join(UPLOAD_FOLDER, filename)
-            counter += 1
+        filename = unique_filename(secure_filename(file.filename))
         
-        file.save(file_path)
+        with phase('fs'):
+            file.save(ensure_shard(UPLOAD_FOLDER, filename))
         
-        # 记录IP
-        ip = request.headers.get('X-Forwarded-For', request.remote_addr)
-        if ip and ',' in ip:
-            ip = ip.split(',')[0].strip()
-        # 新增：本机访问时自动获取内网IP
-        if ip == '127.0.0.1':
-            ip = get_local_ip()
-        save_file_ip(filename, ip)
-        
-        clean_old_files(UPLOAD_FOLDER, MAX_FILES)
+        # 记录IP、清理旧文件
+        ip = finish_upload(filename)
         
         return jsonify({
             'message': '文件上传成功',
             'filename': filename,
             'size': file_size,
-            'ip': ip
+            'ip': ip,
+            'jobs': post_upload_jobs(filename)
         })
     
     except Exception as e:
         return jsonify({'error': f'上传失败: {str(e)}'}), 500
 
+@file_bp.route('/signature/<filename>', methods=['GET'])
+def file_signature(filename):
+    """
+    获取文件的分块签名，供客户端计算增量上传的内容。
+    参数: filename - 作为基准的已有文件名；block_size（可选）- 块大小，默认按文件大小自动选择
+    返回: 文件大小、块大小、基准版本标识base_token、各整块的[adler32弱校验, SHA-256前16字节]
+    """
+    try:
+        file_path, compressed = stored_path(filename)
+        if file_path is None:
+            return jsonify({'error': '文件不存在'}), 404
+        block_size = request.args.get('block_size', type=int)
+        if block_size is not None and not MIN_BLOCK_SIZE <= block_size <= MAX_BLOCK_SIZE:
+            return jsonify({'error': f'block_size应在{MIN_BLOCK_SIZE}-{MAX_BLOCK_SIZE}之间'}), 400
+        with phase('fs'):
+            result = signature(file_path, compressed, block_size)
+        return jsonify(dict(result, name=filename))
+    except Exception as e:
+        return jsonify({'error': f'计算签名失败: {str(e)}'}), 500
+
+@file_bp.route('/delta/<filename>', methods=['POST'])
+@upload_admission.limit('file_upload', UPLOAD_FOLDER, MAX_FILE_SIZE)
+def delta_upload(filename):
+    """
+    增量上传：以已有文件filename为基准，请求体（application/octet-stream）为复制指令和新数据，
+    服务端边接收边重建新文件，保存方式与普通上传相同（同名时自动添加数字后缀）。
+    参数: name - 新文件名；base_token、block_size - 签名接口返回的值；sha256（可选）- 新文件的SHA-256，用于校验
+    返回: 上传结果、文件名、大小、上传IP，以及实际传输的字节数
+    """
+    try:
+        base_path, compressed = stored_path(filename)
+        if base_path is None:
+            return jsonify({'error': '基准文件不存在'}), 404
+        name = request.args.get('name', filename)
+        if not allowed_file(name):
+            return jsonify({'error': '不支持的文件类型'}), 400
+        block_size = request.args.get('block_size', type=int)
+        if block_size is None or not MIN_BLOCK_SIZE <= block_size <= MAX_BLOCK_SIZE:
+            return jsonify({'error': 'block_size不正确'}), 400
+        if request.args.get('base_token') != base_token(base_path):
+            return jsonify({'error': '基准文件已变化，请重新获取签名'}), 409
+        
+        new_name = unique_filename(secure_filename(name))
+        file_path = ensure_shard(UPLOAD_FOLDER, new_name)
+        tmp = f'{file_path}.{os.getpid()}.tmp'
+        try:
+            with open_base(base_path, compressed) as base, open(tmp, 'wb') as out, phase('network'):
+                block_count = logical_size(base_path, compressed) // block_size
+                size, digest = apply_delta(request.stream, base, block_count, block_size, out, MAX_FILE_SIZE)
+            expected = request.args.get('sha256')
+            if expected and expected.lower() != digest:
+                raise DeltaError('重建后的文件校验失败')
+            os.replace(tmp, file_path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        
+        ip = finish_upload(new_name)
+        # 重建时已经算出了SHA-256，直接记录
+        checksum_store.record('file', new_name, file_path, digest)
+        return jsonify({
+            'message': '文件上传成功',
+            'filename': new_name,
+            'size': size,
+            'ip': ip,
+            'transferred': request.content_length
+        })
+    except DeltaError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f'上传失败: {str(e)}'}), 500
+
 @file_bp.route('/list', methods=['GET'])
+@collection_versions.conditional('files', volatile=lambda: request.args.get('sort') == 'popularity')
 def list_files():
     """
-    获取所有已上传文件列表，按修改时间倒序。
-    返回: 文件名、大小、修改时间、上传IP。
+    获取已上传文件列表，默认按修改时间倒序，数据来自预先排序的内存索引。
+    支持If-None-Match，列表未变化时返回304，并通过X-Poll-Interval建议轮询间隔。
+    参数: since/epoch（可选）- 客户端已有的版本号与进程标识，提供时只返回此后新增、更新、删除的条目；
+          变更日志无法覆盖时返回全量（full为true）。
+          sort/order（可选）- 排序键mtime/size/name，升序asc或降序desc
+          limit/cursor（可选）- 每页条数（最多1000）和上一页返回的next_cursor，不提供limit时返回全部
+          type/ext/ip（可选）- 按分类（image/document/archive/audio/text）、扩展名（逗号分隔）、上传IP筛选
+    返回: 文件名、大小、修改时间、上传IP，以及当前版本号、文件总数和下一页游标。
     """
     try:
-        files = []
-        for filename in os.listdir(UPLOAD_FOLDER):
-            file_path = os.path.join(UPLOAD_FOLDER, filename)
-            if os.path.isfile(file_path):
-                file_stat = os.stat(file_path)
-                ip = get_file_ip(filename)
-                if ip and ',' in ip:
-                    ip = ip.split(',')[0].strip()
-                # 新增：本机访问时自动获取内网IP
-                if ip == '127.0.0.1':
-                    ip = get_local_ip()
-                files.append({
-                    'name': filename,
-                    'size': file_stat.st_size,
-                    'modified': file_stat.st_mtime,
-                    'ip': ip
+        since = request.args.get('since', type=int)
+        if since is not None:
+            version, changes = collection_versions.changes_since('files', since, request.args.get('epoch'))
+            if changes is not None:
+                file_index.refresh()
+                added, updated, removed = [], [], []
+                for name, state in changes.items():
+                    entry = None if state == 'removed' else file_index.get(name)
+                    if entry is None:
+                        removed.append(name)
+                    else:
+                        (added if state == 'added' else updated).append(entry)
+                return jsonify({
+                    'full': False,
+                    'version': version,
+                    'epoch': collection_versions.epoch,
+                    'added': added,
+                    'updated': updated,
+                    'removed': removed
                 })
         
-        # 按修改时间排序，最新的在前
-        files.sort(key=lambda x: x['modified'], reverse=True)
+        try:
+            with phase('fs'):
+                version, files, next_cursor, total = file_index.query(**parse_list_args(request.args, FILE_CATEGORIES))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        return jsonify({'files': files})
+        with phase('json'):
+            return jsonify({
+                'files': files,
+                'full': True,
+                'version': version,
+                'epoch': collection_versions.epoch,
+                'total': total,
+                'next_cursor': next_cursor
+            })
     
     except Exception as e:
         return jsonify({'error': f'获取文件列表失败: {str(e)}'}), 500
@@ -158,55 +421,240 @@ def list_files():
 @file_bp.route('/download/<filename>', methods=['GET'])
 def download_file(filename):
     """
-    下载指定文件。
+    下载指定文件。压缩存储的文件对支持gzip的客户端直接发送压缩数据，否则边解压边发送。
+    未压缩的文件支持Range分段下载，已算出校验和时在X-Content-SHA256头中返回。
     参数: filename - 文件名
     返回: 文件二进制流
     """
     try:
-        file_path = os.path.join(UPLOAD_FOLDER, filename)
-        if not os.path.exists(file_path):
+        entry, located = cached_file(filename)
+        if entry is not None:
+            record_access(filename)
+            # 与读盘发送一样带上已算出的校验和，分段下载据此校验
+            response = send_cached(entry, filename, as_attachment=True)
+            return checksum_store.advertise(response, 'file', filename, identity=(entry.mtime_ns, entry.size))
+        file_path, compressed = located or stored_path(filename)
+        if file_path is None:
             return jsonify({'error': '文件不存在'}), 404
         
-        return send_from_directory(UPLOAD_FOLDER, filename, as_attachment=True)
+        record_access(filename)
+        if compressed:
+            return send_compressed(file_path, filename, as_attachment=True)
+        response = send_stored(file_path, filename, as_attachment=True)
+        return checksum_store.advertise(response, 'file', filename, file_path)
     
     except Exception as e:
         return jsonify({'error': f'下载失败: {str(e)}'}), 500
 
+def record_access(filename):
+    """记录一次下载或预览，用于热度统计"""
+    popularity.record('file', filename, request.headers.get('Range'), request.method)
+
+def cached_file(filename):
+    """
+    从热点小文件缓存中取文件内容。
+    启用反向代理卸载时不缓存；压缩存储的文件不缓存。
+    返回: (CacheEntry, 存储位置)。不适合缓存或文件不存在时CacheEntry为None；
+    存储位置为查找过的stored_path结果，命中缓存未查找文件时为None，调用方不必再查找一次
+    """
+    if offload_mode():
+        return None, None
+    located = []
+    def locate():
+        located.append(stored_path(filename))
+        file_path, compressed = located[0]
+        return None if compressed else file_path
+    entry = byte_cache.fetch('files', filename, locate)
+    return entry, (located[0] if located else None)
+
+def send_cached(entry, filename, as_attachment):
+    """从内存发送缓存的文件内容，支持条件请求和Range"""
+    return send_local(io.BytesIO(entry.data), as_attachment=as_attachment, download_name=filename,
+                      etag=entry.etag, last_modified=entry.mtime)
+
+def send_stored(file_path, filename, as_attachment):
+    """发送未压缩的文件：启用反向代理卸载时只返回内部重定向头，否则由Flask直接发送"""
+    response = offload_response('uploads', UPLOAD_FOLDER, file_path, filename, as_attachment)
+    if response is not None:
+        return response
+    return send_local(file_path, as_attachment=as_attachment, download_name=filename)
+
+def send_compressed(file_path, filename, as_attachment):
+    """
+    发送压缩存储的文件：客户端接受gzip时原样发送（不重新压缩），否则流式解压。
+    两种方式都不支持Range（压缩数据的字节范围与原文件不对应，解压流无法跳转），客户端改为整体下载
+    """
+    if 'gzip' in request.accept_encodings:
+        response = send_file(file_path, as_attachment=as_attachment, download_name=filename, conditional=False)
+        response.headers['Content-Encoding'] = 'gzip'
+        response.make_conditional(request.environ)
+    else:
+        response = send_file(gzip.open(file_path, 'rb'), as_attachment=as_attachment, download_name=filename)
+        response.content_length = gzip_logical_size(file_path)
+    response.headers['Accept-Ranges'] = 'none'
+    response.vary.add('Accept-Encoding')
+    return response
+
 @file_bp.route('/preview/<filename>', methods=['GET'])
 def preview_file(filename):
     """
-    预览文件内容。支持图片/文本/音频类型。
-    参数: filename - 文件名
+    预览文件内容。支持图片/文本/音频类型。PNG/JPEG已生成缩小版本时默认返回缩小版本。
+    参数: filename - 文件名；original=1 - 图片返回原图
     返回: 图片/音频流或HTML文本
     """
     try:
-        file_path = os.path.join(UPLOAD_FOLDER, filename)
-        if not os.path.exists(file_path):
-            return jsonify({'error': '文件不存在'}), 404
         ext = filename.rsplit('.', 1)[-1].lower()
-        # 图片+pdf
-        if ext in ['png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp', 'svg', 'pdf']:
-            return send_from_directory(UPLOAD_FOLDER, filename, as_attachment=False)
-        # 音频
-        elif ext in ['mp3', 'wav', 'flac', 'aac', 'ogg', 'wma']:
-            return send_from_directory(UPLOAD_FOLDER, filename, as_attachment=False)
+        # 已生成缩小版本的图片默认返回缩小版本，original=1时返回原图
+        if image_optimizer.needs_optimize(filename) and request.args.get('original') != '1':
+            rendition = image_optimizer.ready_rendition(filename)
+            if rendition is not None:
+                record_access(filename)
+                return send_rendition(rendition, filename)
+        # 热点小文件直接从内存发送，不访问文件系统
+        entry, located = cached_file(filename) if ext in PREVIEW_MEDIA_EXTENSIONS or ext in TEXT_EXTENSIONS else (None, None)
+        if entry is not None:
+            record_access(filename)
+            if ext in PREVIEW_MEDIA_EXTENSIONS:
+                return send_cached(entry, filename, as_attachment=False)
+            content = entry.data.decode('utf-8', errors='ignore')
+            return f'<pre style="white-space:pre-wrap;word-break:break-all;">{content}</pre>'
+        file_path, compressed = located or stored_path(filename)
+        if file_path is None:
+            return jsonify({'error': '文件不存在'}), 404
+        record_access(filename)
+        # 图片+pdf、音频
+        if ext in PREVIEW_MEDIA_EXTENSIONS:
+            return send_stored(file_path, filename, as_attachment=False)
         # 文本/代码
-        elif ext in ['txt', 'md', 'csv', 'json', 'xml', 'yaml', 'yml', 'ini', 'log', 'conf', 'config',
-                     'js', 'ts', 'jsx', 'tsx', 'css', 'scss', 'less', 'html', 'htm', 'vue', 'py', 'java', 'c', 'cpp', 'h', 'hpp', 'php', 'rb', 'go', 'rs', 'swift', 'kt', 'scala', 'sql', 'sh', 'bat', 'ps1', 'dockerfile', 'toml']:
+        elif ext in TEXT_EXTENSIONS:
             try:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                opener = gzip.open if compressed else open
+                with opener(file_path, 'rt', encoding='utf-8', errors='ignore') as f:
                     content = f.read()
                 return f'<pre style="white-space:pre-wrap;word-break:break-all;">{content}</pre>'
             except UnicodeDecodeError:
                 return '文件编码不支持预览', 400
-        # 压缩包
-        elif ext in ['zip', 'rar', '7z']:
-            return '<div style="padding:32px;font-size:18px;">压缩包文件，请下载后解压查看内容。<br>支持格式：ZIP、RAR、7Z</div>'
+        # 压缩包：ZIP只读取中央目录列出条目，可单独下载其中的文件
+        elif ext == 'zip':
+            try:
+                entries, truncated = list_entries(file_path)
+            except zipfile.BadZipFile:
+                return '压缩包已损坏或格式不正确', 400
+            return render_archive_listing(filename, entries, truncated)
+        elif ext in ['rar', '7z']:
+            return '<div style="padding:32px;font-size:18px;">压缩包文件，请下载后解压查看内容。<br>支持在线浏览的格式：ZIP</div>'
         else:
             return '不支持预览此类型文件', 400
     except Exception as e:
         return jsonify({'error': f'预览失败: {str(e)}'}), 500
 
+def send_rendition(rendition, filename):
+    """发送图片的缩小版本，内容类型按缩小版本的格式"""
+    mimetype = ImageOptimizer.mimetype(rendition)
+    response = offload_response('uploads', UPLOAD_FOLDER, rendition, filename, False, mimetype)
+    if response is not None:
+        return response
+    return send_local(rendition, mimetype=mimetype, download_name=filename)
+
+def render_archive_listing(filename, entries, truncated):
+    """将压缩包目录渲染为HTML表格，文件条目可点击单独下载"""
+    rows = []
+    for entry in entries:
+        name = html.escape(entry['path'])
+        if entry['is_dir']:
+            rows.append(f'<tr><td>{name}</td><td></td><td>{entry["modified"]}</td></tr>')
+        else:
+            url = html.escape(f'/api/file/archive/{quote(filename)}/entry?path={quote(entry["path"])}')
+            rows.append(f'<tr><td><a href="{url}">{name}</a></td><td>{entry["size"]}</td><td>{entry["modified"]}</td></tr>')
+    tip = '<p>条目过多，仅显示前一部分。</p>' if truncated else ''
+    return ('<table style="width:100%;border-collapse:collapse;">'
+            '<tr><th align="left">文件</th><th align="left">大小</th><th align="left">修改时间</th></tr>'
+            + ''.join(rows) + '</table>' + tip)
+
+@file_bp.route('/archive/<filename>', methods=['GET'])
+def list_archive(filename):
+    """
+    列出ZIP压缩包内的条目，只读取文件末尾的中央目录，结果按文件修改时间缓存。
+    参数: filename - 压缩包文件名
+    返回: 条目路径、原始大小、压缩后大小、是否目录、修改时间
+    """
+    try:
+        file_path, _ = stored_path(filename)
+        if file_path is None:
+            return jsonify({'error': '文件不存在'}), 404
+        if not is_zip(filename):
+            return jsonify({'error': '仅支持浏览ZIP压缩包'}), 400
+        entries, truncated = list_entries(file_path)
+        return jsonify({'name': filename, 'entries': public_entries(entries), 'truncated': truncated})
+    except zipfile.BadZipFile:
+        return jsonify({'error': '压缩包已损坏或格式不正确'}), 400
+    except Exception as e:
+        return jsonify({'error': f'读取压缩包失败: {str(e)}'}), 500
+
+@file_bp.route('/archive/<filename>/entry', methods=['GET'])
+def download_archive_entry(filename):
+    """
+    从ZIP压缩包中单独下载一个条目，边解压边传输，不落盘。
+    参数: filename - 压缩包文件名；path - 条目在压缩包内的路径；inline=1时内联展示
+    返回: 条目内容流
+    """
+    try:
+        file_path, _ = stored_path(filename)
+        if file_path is None:
+            return jsonify({'error': '文件不存在'}), 404
+        if not is_zip(filename):
+            return jsonify({'error': '仅支持浏览ZIP压缩包'}), 400
+        entry = find_entry(file_path, request.args.get('path', ''))
+        if entry is None:
+            return jsonify({'error': '压缩包内不存在该文件'}), 404
+        response = send_file(open_entry(file_path, entry),
+                             as_attachment=request.args.get('inline') != '1',
+                             download_name=entry['path'].rsplit('/', 1)[-1])
+        response.content_length = entry['size']
+        return response
+    except zipfile.BadZipFile:
+        return jsonify({'error': '压缩包已损坏或格式不正确'}), 400
+    except Exception as e:
+        return jsonify({'error': f'下载失败: {str(e)}'}), 500
+
+@file_bp.route('/table/<filename>', methods=['GET'])
+def preview_table(filename):
+    """
+    表格预览：读取CSV/XLSX中的一段行，不加载整个文件。
+    参数: filename - 文件名；start - 起始数据行（从0开始，默认0）；limit - 行数（默认100）；
+          sheet - XLSX工作表名或序号（默认第一个）；header - 为0时第一行不作为表头
+    返回: 列名及推断的类型、行数据、是否还有更多行、总行数（未知时为null）
+    """
+    try:
+        ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+        if ext not in ('csv', 'xlsx'):
+            return jsonify({'error': '仅支持预览CSV和XLSX表格'}), 400
+        try:
+            start = int(request.args.get('start', 0))
+            limit = int(request.args.get('limit', 100))
+        except ValueError:
+            return jsonify({'error': 'start和limit应为整数'}), 400
+        if start < 0 or limit < 1 or limit > MAX_ROWS:
+            return jsonify({'error': f'start不能为负数，limit应在1-{MAX_ROWS}之间'}), 400
+        header = request.args.get('header') != '0'
+        file_path, compressed = stored_path(filename)
+        if file_path is None:
+            return jsonify({'error': '文件不存在'}), 404
+        with phase('fs'):
+            if ext == 'csv':
+                result = read_csv(file_path, compressed, start, limit, header)
+            else:
+                result = read_xlsx(file_path, start, limit, request.args.get('sheet'), header)
+        result['name'] = filename
+        result['limit'] = limit
+        return jsonify(result)
+    except TableError as e:
+        return jsonify({'error': str(e)}), 400
+    except (zipfile.BadZipFile, KeyError):
+        return jsonify({'error': '表格文件已损坏或格式不正确'}), 400
+    except Exception as e:
+        return jsonify({'error': f'读取表格失败: {str(e)}'}), 500
+
 @file_bp.route('/delete/<filename>', methods=['DELETE'])
 def delete_file(filename):
     """
@@ -215,34 +663,50 @@ def delete_file(filename):
     返回: 删除结果
     """
     try:
-        file_path = os.path.join(UPLOAD_FOLDER, filename)
-        if not os.path.exists(file_path):
+        file_path, _ = stored_path(filename)
+        if file_path is None:
             return jsonify({'error': '文件不存在'}), 404
         
-        os.remove(file_path)
+        remove_file(file_path, filename)
+        upload_admission.invalidate_usage(UPLOAD_FOLDER)
+        collection_versions.bump('files', [('remove', filename)])
         return jsonify({'message': '文件删除成功'})
     
     except Exception as e:
         return jsonify({'error': f'删除失败: {str(e)}'}), 500
 
+@file_bp.route('/batch', methods=['POST'])
+def batch_files():
+    """
+    批量删除、重命名文件，或将文件移动到视频区。整批只读写一次上传IP记录、只做一次保留数量清理。
+    参数: operations - 操作列表，每项为 {op: delete/rename/move, name: 文件名,
+          new_name: 新文件名（rename必填，move可选）, to: 目标区域（move时为video）}
+    返回: 每个操作的结果（status为200表示成功，否则附带error），以及成功、失败数量
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        return jsonify(batch_processor.run('file', data.get('operations')))
+    except BatchError as e:
+        return jsonify({'error': e.message}), e.status
+    except Exception as e:
+        return jsonify({'error': f'批量操作失败: {str(e)}'}), 500
+
 @file_bp.route('/max_count', methods=['GET', 'POST'])
 def file_max_count():
     """
     获取/设置文件最大保留数量。
     GET返回当前数量，POST设置新数量。
     """
-    global MAX_FILES
     if request.method == 'GET':
-        return jsonify({'max_count': MAX_FILES})
+        return jsonify({'max_count': get_max_files()})
     data = request.get_json()
     if not data or 'max_count' not in data:
         return jsonify({'error': '缺少max_count参数'}), 400
     try:
         val = int(data['max_count'])
-        if val < 1 or val > 100:
-            return jsonify({'error': 'max_count应在1-100之间'}), 400
-        with MAX_FILES_LOCK:
-            MAX_FILES = val
-        return jsonify({'max_count': MAX_FILES})
+        if val < 1 or val > MAX_RETENTION:
+            return jsonify({'error': f'max_count应在1-{MAX_RETENTION}之间'}), 400
+        set_max_files(val)
+        return jsonify({'max_count': get_max_files()})
     except Exception as e:
         return jsonify({'error': str(e)}), 400 
\ No newline at end of file
@@ -0,0 +1,58 @@
+from flask import Blueprint, request, jsonify
+from jobs import job_queue, STATES
+
+# 后台任务API蓝图（任务状态查询、取消、重试）
+jobs_bp = Blueprint('jobs', __name__)
+
+@jobs_bp.route('', methods=['GET'])
+def list_jobs():
+    """
+    获取后台任务列表，最新的在前。
+    参数: state - 按状态筛选（queued/running/done/failed/cancelled）；kind - 按任务类型筛选；limit - 条数（默认100，最多1000）
+    返回: 任务列表，以及各状态的任务数和工作线程数
+    """
+    try:
+        state = request.args.get('state')
+        if state and state not in STATES:
+            return jsonify({'error': '不支持的state'}), 400
+        try:
+            limit = int(request.args.get('limit', 100))
+        except ValueError:
+            return jsonify({'error': 'limit应为整数'}), 400
+        if limit < 1 or limit > 1000:
+            return jsonify({'error': 'limit应在1-1000之间'}), 400
+        return jsonify({'jobs': job_queue.list(state, request.args.get('kind'), limit), **job_queue.counts()})
+    except Exception as e:
+        return jsonify({'error': f'获取任务列表失败: {str(e)}'}), 500
+
+@jobs_bp.route('/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    获取单个任务的状态。
+    参数: job_id - 任务号（上传接口返回的jobs中的值）
+    返回: 状态、进度（0-1）、尝试次数、错误信息、结果
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify(job)
+
+@jobs_bp.route('/<int:job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """
+    取消排队中或执行中的任务。
+    参数: job_id - 任务号
+    """
+    if not job_queue.cancel(job_id):
+        return jsonify({'error': '任务不存在或已结束'}), 404
+    return jsonify({'success': True})
+
+@jobs_bp.route('/<int:job_id>/retry', methods=['POST'])
+def retry_job(job_id):
+    """
+    重新执行失败或已取消的任务。
+    参数: job_id - 任务号
+    """
+    if not job_queue.retry(job_id):
+        return jsonify({'error': '任务不存在、未失败或已重新加入'}), 409
+    return jsonify({'success': True})
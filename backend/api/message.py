@@ -2,42 +2,43 @@ from flask import Blueprint, request, jsonify
 import os
 import json
 from datetime import datetime
-import threading
+from versioning import collection_versions
+from shared_state import shared_state, file_lock
+from profiling import phase
 
 # 消息相关API蓝图
 message_bp = Blueprint('message', __name__)
 MESSAGE_FILE = os.path.join(os.path.dirname(__file__), '..', 'message.txt')
 HISTORY_FILE = os.path.join(os.path.dirname(__file__), '..', 'message_history.json')
 
-MAX_MESSAGES = 20
-MAX_MESSAGES_LOCK = threading.Lock()
-
 def load_history():
     if os.path.exists(HISTORY_FILE):
         try:
-            with open(HISTORY_FILE, 'r', encoding='utf-8') as f:
+            with open(HISTORY_FILE, 'r', encoding='utf-8') as f, phase('json'):
                 return json.load(f)
         except:
             return []
     return []
 
 def save_history(message):
-    history = load_history()
     ip = request.headers.get('X-Forwarded-For', request.remote_addr)
-    history.append({
-        'text': message,
-        'timestamp': datetime.now().isoformat(),
-        'ip': ip
-    })
-    # 只保留最近MAX_MESSAGES条消息
-    if len(history) > get_max_messages():
-        history = history[-get_max_messages():]
-    
-    try:
-        with open(HISTORY_FILE, 'w', encoding='utf-8') as f:
-            json.dump(history, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f"保存历史记录失败: {e}")
+    # 多个工作进程可能同时写入，读-改-写期间持有跨进程文件锁
+    with file_lock(HISTORY_FILE), phase('fs'):
+        history = load_history()
+        history.append({
+            'text': message,
+            'timestamp': datetime.now().isoformat(),
+            'ip': ip
+        })
+        # 只保留最近max_messages条消息
+        if len(history) > get_max_messages():
+            history = history[-get_max_messages():]
+        
+        try:
+            with open(HISTORY_FILE, 'w', encoding='utf-8') as f, phase('json'):
+                json.dump(history, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            print(f"保存历史记录失败: {e}")
 
 @message_bp.route('/', methods=['POST'])
 def post_message():
@@ -61,6 +62,8 @@ def post_message():
         
         # 保存到历史记录
         save_history(msg)
+        collection_versions.bump('message')
+        collection_versions.bump('history')
         
         return jsonify({
             'message': '消息保存成功',
@@ -72,9 +75,10 @@ def post_message():
         return jsonify({'error': f'保存消息失败: {str(e)}'}), 500
 
 @message_bp.route('/', methods=['GET'])
+@collection_versions.conditional('message')
 def get_message():
     """
-    获取当前最新消息。
+    获取当前最新消息。支持If-None-Match，未变化时返回304。
     返回: 消息内容
     """
     try:
@@ -90,9 +94,10 @@ def get_message():
         return jsonify({'error': f'获取消息失败: {str(e)}'}), 500
 
 @message_bp.route('/history', methods=['GET'])
+@collection_versions.conditional('history')
 def get_history():
     """
-    获取历史消息记录。
+    获取历史消息记录。支持If-None-Match，未变化时返回304。
     返回: 消息内容、时间戳、IP等
     """
     try:
@@ -103,13 +108,11 @@ def get_history():
         return jsonify({'error': f'获取历史记录失败: {str(e)}'}), 500
 
 def get_max_messages():
-    global MAX_MESSAGES
-    return MAX_MESSAGES
+    # 最大保留条数保存在跨进程共享状态中，所有工作进程一致
+    return shared_state.get('max_messages')
 
 def set_max_messages(val):
-    global MAX_MESSAGES
-    with MAX_MESSAGES_LOCK:
-        MAX_MESSAGES = val
+    shared_state.set('max_messages', val)
 
 @message_bp.route('/max_count', methods=['GET', 'POST'])
 def message_max_count():
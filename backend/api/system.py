@@ -0,0 +1,141 @@
+from flask import Blueprint, request, jsonify, send_from_directory
+from profiling import slow_requests, list_profiles, PROFILE_DIR
+from access_log import log_pipeline
+from admission import upload_admission
+from api.file import file_cold_storage
+from maintenance import metadata_maintenance
+from byte_cache import byte_cache
+from multicast import multicast_distributor
+from jobs import job_queue
+from popularity import popularity, page_prefetcher
+from api.file import get_local_ip, image_optimizer
+from api.video import video_transcoder
+import os
+import prefork
+
+# 系统运维相关API蓝图（运行指标、慢请求、性能分析结果、元数据维护等）
+system_bp = Blueprint('system', __name__)
+
+@system_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    获取运行指标。
+    返回: 日志队列深度与丢弃数、上传准入状态、冷文件压缩统计、热点文件缓存命中率与内存占用、后台任务数、图片优化节省的字节数、热点文件预读统计、响应的进程等
+    """
+    return jsonify({
+        'log': log_pipeline.stats(),
+        'upload_admission': upload_admission.stats(),
+        'cold_storage': file_cold_storage.stats,
+        'maintenance': metadata_maintenance.stats,
+        'byte_cache': byte_cache.stats(),
+        'jobs': job_queue.counts(),
+        'transcode': video_transcoder.stats,
+        'images': image_optimizer.stats,
+        'prefetch': page_prefetcher.stats,
+        # 多进程运行时各进程的统计各自独立，worker为响应本次请求的工作进程序号
+        'process': {'pid': os.getpid(), 'worker': prefork.current_worker}
+    })
+
+@system_bp.route('/maintenance', methods=['GET', 'POST'])
+def maintenance():
+    """
+    元数据维护。GET返回累计统计和上次各区域的结果，POST立即执行一次核对。
+    返回: 清理的孤儿记录数、收录的文件数、回收的字节数等
+    """
+    try:
+        if request.method == 'POST':
+            return jsonify({'results': metadata_maintenance.run(), 'stats': metadata_maintenance.stats})
+        return jsonify(metadata_maintenance.stats)
+    except Exception as e:
+        return jsonify({'error': f'元数据维护失败: {str(e)}'}), 500
+
+@system_bp.route('/popularity', methods=['GET'])
+def get_popularity():
+    """
+    获取下载热度排行。
+    参数: area - file或video（可选，默认全部）；limit - 条数（默认50，最多1000）
+    返回: 热度分数（按小时衰减）、最近24小时逐小时访问次数及合计、累计次数、最后访问时间
+    """
+    try:
+        area = request.args.get('area') or None
+        if area is not None and area not in ('file', 'video'):
+            return jsonify({'error': 'area应为file或video'}), 400
+        try:
+            limit = int(request.args.get('limit', 50))
+        except ValueError:
+            return jsonify({'error': 'limit应为整数'}), 400
+        if limit < 1 or limit > 1000:
+            return jsonify({'error': 'limit应在1-1000之间'}), 400
+        return jsonify({'items': popularity.top(area, limit)})
+    except Exception as e:
+        return jsonify({'error': f'获取热度统计失败: {str(e)}'}), 500
+
+@system_bp.route('/slow_requests', methods=['GET'])
+def get_slow_requests():
+    """
+    获取最近的慢请求记录，最新的在前。
+    返回: 请求方法、路径、状态码、总耗时及各阶段耗时（毫秒）
+    """
+    return jsonify({'slow_requests': list(reversed(slow_requests))})
+
+@system_bp.route('/profiles', methods=['GET'])
+def get_profiles():
+    """
+    获取已保存的性能分析结果文件列表，最新的在前。
+    返回: 文件名列表，可用pstats或snakeviz打开
+    """
+    return jsonify({'profiles': list_profiles()})
+
+@system_bp.route('/profiles/<name>', methods=['GET'])
+def download_profile(name):
+    """
+    下载指定的性能分析结果文件。
+    参数: name - 文件名
+    返回: pstats格式的二进制文件
+    """
+    if name not in list_profiles():
+        return jsonify({'error': '分析结果不存在'}), 404
+    return send_from_directory(PROFILE_DIR, name, as_attachment=True)
+
+@system_bp.route('/multicast', methods=['GET', 'POST'])
+def multicast():
+    """
+    组播推送分发。GET返回组播地址和各会话进度；POST开始分发一个文件。
+    参数（POST，JSON）: area - file或video；name - 文件名；rate_mbps - 发送速率（Mbps，可选）；passes - 发送遍数（可选，默认1）
+    返回: 会话信息（会话号、文件大小、块数、客户端补齐地址等）
+    """
+    try:
+        if request.method == 'GET':
+            return jsonify(multicast_distributor.list())
+        data = request.get_json(silent=True) or {}
+        if not data.get('name'):
+            return jsonify({'error': '缺少name参数'}), 400
+        try:
+            rate = float(data['rate_mbps']) if data.get('rate_mbps') else None
+            passes = int(data.get('passes', 1))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'rate_mbps和passes应为数字'}), 400
+        if passes < 1 or passes > 10:
+            return jsonify({'error': 'passes应在1-10之间'}), 400
+        # 客户端按公告中的地址补齐，本机访问时换成局域网地址
+        host_url = request.host_url
+        if request.host.split(':')[0] in ('localhost', '127.0.0.1'):
+            host_url = host_url.replace(request.host.split(':')[0], get_local_ip(), 1)
+        session = multicast_distributor.start(data.get('area', 'video'), data['name'], host_url, rate, passes)
+        return jsonify(session)
+    except FileNotFoundError:
+        return jsonify({'error': '文件不存在'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f'组播分发失败: {str(e)}'}), 500
+
+@system_bp.route('/multicast/<int:session_id>', methods=['DELETE'])
+def stop_multicast(session_id):
+    """
+    停止组播分发会话。
+    参数: session_id - 会话号
+    """
+    if not multicast_distributor.stop(session_id):
+        return jsonify({'error': '会话不存在'}), 404
+    return jsonify({'success': True})
@@ -1,9 +1,21 @@
-from flask import Blueprint, request, jsonify, send_from_directory, send_file
+from flask import Blueprint, request, jsonify
 import os
 from werkzeug.utils import secure_filename
 import json
 import socket
-import threading
+from admission import upload_admission
+from versioning import collection_versions
+from shared_state import shared_state, file_lock
+from profiling import phase
+from offload import offload_response, send_local
+from batch import batch_processor, StorageArea, BatchError
+from maintenance import metadata_maintenance, MaintenanceArea
+from multicast import multicast_distributor
+from checksums import checksum_store
+from jobs import job_queue
+from transcode import Transcoder, RENDITION_MIMETYPE
+from popularity import popularity
+from storage_index import ListIndex, find_path, ensure_shard, walk_files, is_listed, parse_list_args
 
 # 视频相关API蓝图
 video_bp = Blueprint('video', __name__)
@@ -11,37 +23,58 @@ VIDEO_FOLDER = os.path.join(os.path.dirname(__file__), '..', 'videos')
 ALLOWED_VIDEO_EXTENSIONS = set(['mp4', 'avi', 'mov', 'wmv', 'mkv', 'flv', 'webm'])
 MAX_VIDEO_SIZE = 500 * 1024 * 1024  # 500MB
 VIDEO_INFO_PATH = os.path.join(os.path.dirname(__file__), '..', 'video_info.json')
-MAX_VIDEOS = 10
-MAX_VIDEOS_LOCK = threading.Lock()
+# 最大保留数量上限
+MAX_RETENTION = 100000
 
 if not os.path.exists(VIDEO_FOLDER):
     os.makedirs(VIDEO_FOLDER)
 
+def get_max_videos():
+    # 最大保留数量保存在跨进程共享状态中，所有工作进程一致
+    return shared_state.get('max_videos')
+
+def set_max_videos(val):
+    shared_state.set('max_videos', val)
+
 def allowed_video(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_VIDEO_EXTENSIONS
 
 def save_video_ip(filename, ip):
     try:
-        if os.path.exists(VIDEO_INFO_PATH):
-            with open(VIDEO_INFO_PATH, 'r', encoding='utf-8') as f:
-                info = json.load(f)
-        else:
-            info = {}
-        info[filename] = ip
-        with open(VIDEO_INFO_PATH, 'w', encoding='utf-8') as f:
-            json.dump(info, f, ensure_ascii=False)
+        with file_lock(VIDEO_INFO_PATH):
+            if os.path.exists(VIDEO_INFO_PATH):
+                with open(VIDEO_INFO_PATH, 'r', encoding='utf-8') as f, phase('json'):
+                    info = json.load(f)
+            else:
+                info = {}
+            info[filename] = ip
+            with open(VIDEO_INFO_PATH, 'w', encoding='utf-8') as f, phase('json'):
+                json.dump(info, f, ensure_ascii=False)
     except Exception as e:
         print('保存视频IP失败', e)
 
-def get_video_ip(filename):
+def load_video_info():
+    """读取全部上传IP记录，文件不存在或损坏时返回空字典"""
     try:
         if os.path.exists(VIDEO_INFO_PATH):
-            with open(VIDEO_INFO_PATH, 'r', encoding='utf-8') as f:
-                info = json.load(f)
-            return info.get(filename, '')
-        return ''
+            with open(VIDEO_INFO_PATH, 'r', encoding='utf-8') as f, phase('json'):
+                return json.load(f)
+        return {}
     except:
-        return ''
+        return {}
+
+def remove_video(file_path, filename):
+    """删除视频，并在同一把IP记录锁内移除其记录，列表中不会留下孤儿记录（元数据维护仍作兜底）"""
+    with file_lock(VIDEO_INFO_PATH):
+        os.remove(file_path)
+        info = load_video_info()
+        if filename in info:
+            del info[filename]
+            with open(VIDEO_INFO_PATH, 'w', encoding='utf-8') as f, phase('json'):
+                json.dump(info, f, ensure_ascii=False)
+
+def get_video_ip(filename):
+    return load_video_info().get(filename, '')
 
 def get_local_ip():
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -54,24 +87,85 @@ def get_local_ip():
         s.close()
     return ip
 
-def clean_old_videos(folder, max_videos):
-    files = [os.path.join(folder, f) for f in os.listdir(folder) if os.path.isfile(os.path.join(folder, f))]
-    if len(files) > max_videos:
-        files.sort(key=lambda x: os.path.getmtime(x))
-        for f in files[:-max_videos]:
-            os.remove(f)
+# 不能直接播放的格式上传后在后台转码，转码结果随视频的增删自动清理
+video_transcoder = Transcoder(VIDEO_FOLDER, 'videos', lambda name: find_path(VIDEO_FOLDER, name))
+job_queue.register('transcode', video_transcoder.run_job, max_attempts=2, max_running=video_transcoder.max_running)
+collection_versions.subscribe(video_transcoder.on_change)
+
+def clean_old_videos(max_videos, pending=()):
+    """
+    按修改时间只保留最新的max_videos个视频，返回被清理的文件名列表。
+    pending: 已写入磁盘但尚未递增版本号的文件名
+    """
+    video_index.refresh(pending)
+    removed = []
+    for name in video_index.oldest(video_index.count() - max_videos):
+        file_path = find_path(VIDEO_FOLDER, name)
+        if file_path is not None:
+            os.remove(file_path)
+        removed.append(name)
+    video_index.discard(removed)
+    if removed:
+        upload_admission.invalidate_usage(VIDEO_FOLDER)
+    return removed
+
+batch_processor.register(StorageArea(
+    'video', VIDEO_FOLDER, VIDEO_INFO_PATH, 'videos',
+    retain=lambda pending: clean_old_videos(get_max_videos(), pending),
+    allowed=allowed_video
+))
+
+def stored_names():
+    """磁盘上现有视频的文件名集合"""
+    return {name for name, _ in walk_files(VIDEO_FOLDER) if is_listed(name)}
+
+metadata_maintenance.register(MaintenanceArea('video', VIDEO_FOLDER, VIDEO_INFO_PATH, 'videos', stored_names))
+multicast_distributor.register('video', lambda name: (find_path(VIDEO_FOLDER, name), False), '/api/video/download/')
+checksum_store.register('video', lambda name: (find_path(VIDEO_FOLDER, name), False))
+popularity.register('video', 'videos', lambda name: (find_path(VIDEO_FOLDER, name), False))
+
+def video_entry(filename, info=None):
+    """
+    生成单个视频的列表条目，文件不存在时返回None。
+    info: 已读取的上传IP记录，批量生成时避免每个文件都重新解析
+    """
+    file_path = find_path(VIDEO_FOLDER, filename)
+    if file_path is None:
+        return None
+    file_stat = os.stat(file_path)
+    ip = info.get(filename, '') if info is not None else get_video_ip(filename)
+    if ip and ',' in ip:
+        ip = ip.split(',')[0].strip()
+    if ip == '127.0.0.1':
+        ip = get_local_ip()
+    return {
+        'name': filename,
+        'size': file_stat.st_size,
+        'modified': file_stat.st_mtime,
+        'ip': ip,
+        'transcode': video_transcoder.status(filename, file_path)
+    }
+
+# 视频列表索引，按修改时间、大小、文件名预先排序
+video_index = ListIndex('videos', VIDEO_FOLDER, lambda name: name, video_entry, load_video_info,
+                        scores=lambda: popularity.scores('video'))
 
 @video_bp.route('/upload', methods=['POST'])
+@upload_admission.limit('video_upload', VIDEO_FOLDER, MAX_VIDEO_SIZE)
 def upload_video():
     """
     上传视频接口。支持自动重命名、大小校验、类型校验、记录上传IP。
+    进入接口前先经过准入控制（并发数、磁盘空间、配额），超限返回429/503。
     返回: 上传结果、文件名、大小、上传IP。
     """
     try:
-        if 'file' not in request.files:
+        # 解析multipart请求体，即从网络读取上传数据
+        with phase('network'):
+            files = request.files
+        if 'file' not in files:
             return jsonify({'error': '没有选择文件'}), 400
         
-        file = request.files['file']
+        file = files['file']
         if file.filename == '':
             return jsonify({'error': '没有选择文件'}), 400
         
@@ -87,18 +181,17 @@ def upload_video():
             return jsonify({'error': f'视频文件大小超过限制（最大{MAX_VIDEO_SIZE//1024//1024}MB）'}), 400
         
         filename = secure_filename(file.filename)
-        file_path = os.path.join(VIDEO_FOLDER, filename)
         
         # 如果文件已存在，添加数字后缀
         counter = 1
         original_filename = filename
-        while os.path.exists(file_path):
+        while find_path(VIDEO_FOLDER, filename) is not None:
             name, ext = os.path.splitext(original_filename)
             filename = f"{name}_{counter}{ext}"
-            file_path = os.path.join(VIDEO_FOLDER, filename)
             counter += 1
         
-        file.save(file_path)
+        with phase('fs'):
+            file.save(ensure_shard(VIDEO_FOLDER, filename))
         
         # 记录IP
         ip = request.headers.get('X-Forwarded-For', request.remote_addr)
@@ -108,63 +201,107 @@ def upload_video():
             ip = get_local_ip()
         save_video_ip(filename, ip)
         
-        clean_old_videos(VIDEO_FOLDER, MAX_VIDEOS)
+        with phase('fs'):
+            removed = clean_old_videos(get_max_videos(), [filename])
+        collection_versions.bump('videos', [('add', filename)] + [('remove', name) for name in removed])
         
         return jsonify({
             'message': '视频上传成功',
             'filename': filename,
             'size': file_size,
-            'ip': ip
+            'ip': ip,
+            'jobs': post_upload_jobs(filename)
         })
     
     except Exception as e:
         return jsonify({'error': f'上传失败: {str(e)}'}), 500
 
+def post_upload_jobs(filename):
+    """上传完成后放到后台执行的处理，返回任务号列表（可通过/api/jobs查询进度）"""
+    jobs = (checksum_store.schedule('video', filename), video_transcoder.schedule(filename))
+    return [job for job in jobs if job is not None]
+
 @video_bp.route('/list', methods=['GET'])
+@collection_versions.conditional('videos', volatile=lambda: request.args.get('sort') == 'popularity')
 def list_videos():
     """
-    获取所有已上传视频列表，按修改时间倒序。
-    返回: 视频名、大小、修改时间、上传IP。
+    获取已上传视频列表，默认按修改时间倒序，数据来自预先排序的内存索引。
+    支持If-None-Match，列表未变化时返回304，并通过X-Poll-Interval建议轮询间隔。
+    参数: since/epoch（可选）- 客户端已有的版本号与进程标识，提供时只返回此后新增、更新、删除的条目；
+          变更日志无法覆盖时返回全量（full为true）。
+          sort/order（可选）- 排序键mtime/size/name，升序asc或降序desc
+          limit/cursor（可选）- 每页条数（最多1000）和上一页返回的next_cursor，不提供limit时返回全部
+          ext/ip（可选）- 按扩展名（逗号分隔）、上传IP筛选
+    返回: 视频名、大小、修改时间、上传IP，以及当前版本号、视频总数和下一页游标。
     """
     try:
-        videos = []
-        for filename in os.listdir(VIDEO_FOLDER):
-            file_path = os.path.join(VIDEO_FOLDER, filename)
-            if os.path.isfile(file_path):
-                file_stat = os.stat(file_path)
-                ip = get_video_ip(filename)
-                if ip and ',' in ip:
-                    ip = ip.split(',')[0].strip()
-                if ip == '127.0.0.1':
-                    ip = get_local_ip()
-                videos.append({
-                    'name': filename,
-                    'size': file_stat.st_size,
-                    'modified': file_stat.st_mtime,
-                    'ip': ip
+        since = request.args.get('since', type=int)
+        if since is not None:
+            version, changes = collection_versions.changes_since('videos', since, request.args.get('epoch'))
+            if changes is not None:
+                video_index.refresh()
+                added, updated, removed = [], [], []
+                for name, state in changes.items():
+                    entry = None if state == 'removed' else video_index.get(name)
+                    if entry is None:
+                        removed.append(name)
+                    else:
+                        (added if state == 'added' else updated).append(entry)
+                return jsonify({
+                    'full': False,
+                    'version': version,
+                    'epoch': collection_versions.epoch,
+                    'added': added,
+                    'updated': updated,
+                    'removed': removed
                 })
         
-        # 按修改时间排序，最新的在前
-        videos.sort(key=lambda x: x['modified'], reverse=True)
+        try:
+            with phase('fs'):
+                version, videos, next_cursor, total = video_index.query(**parse_list_args(request.args, {}))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        return jsonify({'videos': videos})
+        with phase('json'):
+            return jsonify({
+                'videos': videos,
+                'full': True,
+                'version': version,
+                'epoch': collection_versions.epoch,
+                'total': total,
+                'next_cursor': next_cursor
+            })
     
     except Exception as e:
         return jsonify({'error': f'获取视频列表失败: {str(e)}'}), 500
 
+def send_video(file_path, filename, as_attachment, mimetype=None):
+    """
+    发送视频文件：启用反向代理卸载时只返回内部重定向头，由代理处理Range请求和传输。
+    mimetype: 不传时按文件名推断；发送转码结果时为MP4，不能按原视频的扩展名推断
+    """
+    response = offload_response('videos', VIDEO_FOLDER, file_path, filename, as_attachment, mimetype)
+    if response is not None:
+        return response
+    if as_attachment:
+        return send_local(file_path, mimetype=mimetype, as_attachment=True, download_name=filename)
+    return send_local(file_path, mimetype=mimetype)
+
 @video_bp.route('/download/<filename>', methods=['GET'])
 def download_video(filename):
     """
-    下载指定视频文件。
+    下载指定视频文件。支持Range分段下载，已算出校验和时在X-Content-SHA256头中返回。
     参数: filename - 视频文件名
     返回: 视频二进制流
     """
     try:
-        file_path = os.path.join(VIDEO_FOLDER, filename)
-        if not os.path.exists(file_path):
+        file_path = find_path(VIDEO_FOLDER, filename)
+        if file_path is None:
             return jsonify({'error': '视频文件不存在'}), 404
         
-        return send_from_directory(VIDEO_FOLDER, filename, as_attachment=True)
+        popularity.record('video', filename, request.headers.get('Range'), request.method)
+        response = send_video(file_path, filename, as_attachment=True)
+        return checksum_store.advertise(response, 'video', filename, file_path)
     
     except Exception as e:
         return jsonify({'error': f'下载失败: {str(e)}'}), 500
@@ -172,16 +309,20 @@ def download_video(filename):
 @video_bp.route('/preview/<filename>', methods=['GET'])
 def preview_video(filename):
     """
-    预览视频内容。
+    预览视频内容。浏览器无法播放的格式转码完成后返回转码后的MP4。
     参数: filename - 视频文件名
     返回: 视频流
     """
     try:
-        file_path = os.path.join(VIDEO_FOLDER, filename)
-        if not os.path.exists(file_path):
+        file_path = find_path(VIDEO_FOLDER, filename)
+        if file_path is None:
             return jsonify({'error': '视频文件不存在'}), 404
         
-        return send_file(file_path)
+        popularity.record('video', filename, request.headers.get('Range'), request.method)
+        rendition = video_transcoder.ready_rendition(filename, file_path)
+        if rendition is not None:
+            return send_video(rendition, filename, as_attachment=False, mimetype=RENDITION_MIMETYPE)
+        return send_video(file_path, filename, as_attachment=False)
     
     except Exception as e:
         return jsonify({'error': f'预览失败: {str(e)}'}), 500
@@ -194,34 +335,50 @@ def delete_video(filename):
     返回: 删除结果
     """
     try:
-        file_path = os.path.join(VIDEO_FOLDER, filename)
-        if not os.path.exists(file_path):
+        file_path = find_path(VIDEO_FOLDER, filename)
+        if file_path is None:
             return jsonify({'error': '视频文件不存在'}), 404
         
-        os.remove(file_path)
+        remove_video(file_path, filename)
+        upload_admission.invalidate_usage(VIDEO_FOLDER)
+        collection_versions.bump('videos', [('remove', filename)])
         return jsonify({'message': '视频删除成功'})
     
     except Exception as e:
         return jsonify({'error': f'删除失败: {str(e)}'}), 500
 
+@video_bp.route('/batch', methods=['POST'])
+def batch_videos():
+    """
+    批量删除、重命名视频，或将视频移动到文件区。整批只读写一次上传IP记录、只做一次保留数量清理。
+    参数: operations - 操作列表，每项为 {op: delete/rename/move, name: 视频文件名,
+          new_name: 新文件名（rename必填，move可选）, to: 目标区域（move时为file）}
+    返回: 每个操作的结果（status为200表示成功，否则附带error），以及成功、失败数量
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        return jsonify(batch_processor.run('video', data.get('operations')))
+    except BatchError as e:
+        return jsonify({'error': e.message}), e.status
+    except Exception as e:
+        return jsonify({'error': f'批量操作失败: {str(e)}'}), 500
+
 @video_bp.route('/max_count', methods=['GET', 'POST'])
 def video_max_count():
     """
     获取/设置视频最大保留数量。
     GET返回当前数量，POST设置新数量。
     """
-    global MAX_VIDEOS
     if request.method == 'GET':
-        return jsonify({'max_count': MAX_VIDEOS})
+        return jsonify({'max_count': get_max_videos()})
     data = request.get_json()
     if not data or 'max_count' not in data:
         return jsonify({'error': '缺少max_count参数'}), 400
     try:
         val = int(data['max_count'])
-        if val < 1 or val > 100:
-            return jsonify({'error': 'max_count应在1-100之间'}), 400
-        with MAX_VIDEOS_LOCK:
-            MAX_VIDEOS = val
-        return jsonify({'max_count': MAX_VIDEOS})
+        if val < 1 or val > MAX_RETENTION:
+            return jsonify({'error': f'max_count应在1-{MAX_RETENTION}之间'}), 400
+        set_max_videos(val)
+        return jsonify({'max_count': get_max_videos()})
     except Exception as e:
         return jsonify({'error': str(e)}), 400 
\ No newline at end of file
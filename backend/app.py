@@ -5,21 +5,26 @@ import os
 import random
 import webbrowser
 import logging
-from logging.handlers import RotatingFileHandler
 import socket
+import argparse
+import prefork
+from config import config
 from api.message import message_bp
-from api.file import file_bp
+from api.file import file_bp, file_cold_storage
 from api.video import video_bp
+from api.system import system_bp
+from api.jobs import jobs_bp
+from jobs import job_queue
+from popularity import popularity, page_prefetcher
+from maintenance import metadata_maintenance
+from profiling import init_profiling
+from access_log import log_pipeline, init_access_log
 import sys
 
-# 日志配置
+# 日志配置：请求线程只入队，由后台线程统一写文件
 def setup_logging(log_path):
     abs_log_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', log_path))
-    handler = RotatingFileHandler(abs_log_path, maxBytes=5*1024*1024, backupCount=2, encoding='utf-8')
-    logging.basicConfig(level=logging.INFO, handlers=[handler])
-    log = logging.getLogger('werkzeug')
-    log.setLevel(logging.INFO)
-    log.addHandler(handler)
+    log_pipeline.start(abs_log_path)
 
 # 获取局域网IP
 def get_lan_ip():
@@ -33,7 +38,19 @@ def get_lan_ip():
         s.close()
     return ip
 
-# 工厂函数，创建并配置Flask应用
+# 启动后台任务（按config.json中的开关决定是否实际运行）
+# primary: 多进程运行时只有0号工作进程运行全局只需一份的任务（冷文件压缩、元数据维护、任务队列、热点预读），
+# 下载热度各进程分别在内存中计数，都要定期写入
+def start_background_tasks(primary=True):
+    popularity.start()
+    if not primary:
+        return
+    file_cold_storage.start()
+    metadata_maintenance.start()
+    job_queue.start()
+    page_prefetcher.start()
+
+# 工厂函数，创建并配置Flask应用（不启动后台任务，由入口在实际处理请求的进程中调用start_background_tasks）
 # 返回: 配置好的Flask app实例
 # 用于WSGI服务器或直接运行
 
@@ -43,12 +60,18 @@ def create_app():
     else:
         static_folder = os.path.join(os.path.dirname(__file__), 'dist')
     app = Flask(__name__, static_folder=static_folder, static_url_path='')
-    # 启用跨域支持，允许前端跨域访问API
-    CORS(app)
+    # 启用跨域支持，允许前端跨域访问API，并允许读取缓存协商与重试相关的响应头
+    CORS(app, expose_headers=['ETag', 'X-Poll-Interval', 'Retry-After', 'Accept-Ranges', 'Content-Range', 'Content-Length', 'X-Content-SHA256'])
     # 注册消息、文件、视频API蓝图
     app.register_blueprint(message_bp, url_prefix='/api/message')
     app.register_blueprint(file_bp, url_prefix='/api/file')
     app.register_blueprint(video_bp, url_prefix='/api/video')
+    app.register_blueprint(system_bp, url_prefix='/api/system')
+    app.register_blueprint(jobs_bp, url_prefix='/api/jobs')
+    # 按需性能分析与慢请求记录（由config.json中的profile_*、slow_request_ms控制）
+    init_profiling(app)
+    # 结构化JSON访问日志（经异步日志队列写入）
+    init_access_log(app)
     
     # 添加前端路由，支持SPA
     @app.route('/', defaults={'path': ''})
@@ -61,9 +84,45 @@ def create_app():
     
     return app
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='启动内网共享服务')
+    parser.add_argument('--workers', type=int, default=None, help='工作进程数，默认使用config.json中的server_workers')
+    # 以下为主进程启动工作进程时使用的内部参数
+    parser.add_argument('--worker', type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--ready-fd', type=int, default=None, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+def worker_command(port):
+    """返回启动指定序号工作进程的命令（打包后的可执行文件直接带参数运行）"""
+    if getattr(sys, 'frozen', False):
+        base = [sys.executable]
+    else:
+        base = [sys.executable, os.path.abspath(__file__)]
+    return lambda index: base + ['--worker', str(index), '--port', str(port)]
+
+def run_worker(args):
+    """多进程运行时的工作进程：各自绑定同一端口，日志写入各自的文件，避免多个进程同时轮转同一个日志文件"""
+    setup_logging(f'backend.worker{args.worker}.log')
+    app = create_app()
+    start_background_tasks(primary=args.worker == 0)
+    def on_exit():
+        popularity.flush()
+        job_queue.release()
+        log_pipeline.stop()
+    prefork.serve_worker(app, '0.0.0.0', args.port, args.worker, args.ready_fd,
+                         int(config.get('server_graceful_timeout', 30)), on_exit)
+
 if __name__ == '__main__':
+    args = parse_args()
+    if args.worker is not None:
+        run_worker(args)
+        sys.exit(0)
+    workers = args.workers if args.workers is not None else int(config.get('server_workers', 1))
+    if workers > 1 and not prefork.supported():
+        print('当前系统不支持SO_REUSEPORT，以单进程运行')
+        workers = 1
     setup_logging('backend.log')
-    app = create_app()
     port = random.randint(10000, 65535)
     # 写入端口号到前端dist目录
     dist_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../frontend/dist'))
@@ -77,9 +136,17 @@ if __name__ == '__main__':
     url = f"http://{lan_ip}:{port}"
     # 只在主进程打印和弹窗
     if not os.environ.get("WERKZEUG_RUN_MAIN"):
-        print(f"服务已启动，局域网访问：{url}")
+        print(f"服务已启动，局域网访问：{url}" + (f"（{workers}个工作进程）" if workers > 1 else ""))
         try:
             webbrowser.open(url)
-    except Exception as e:
+        except Exception as e:
             logging.warning(f"[警告] 自动打开浏览器失败: {e}")
-    app.run(host='0.0.0.0', port=port, debug=True) 
\ No newline at end of file
+    if workers > 1:
+        # 主进程只监督工作进程，不创建应用；kill -HUP <主进程pid> 滚动重启
+        prefork.Supervisor(worker_command(port), workers, int(config.get('server_graceful_timeout', 30))).run()
+    else:
+        app = create_app()
+        # debug模式下werkzeug重载器的父进程只监视代码改动，后台任务只在实际处理请求的子进程中启动，避免每个任务运行两份
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            start_background_tasks()
+        app.run(host='0.0.0.0', port=port, debug=True)
@@ -0,0 +1,89 @@
+# 压缩包按需浏览：只读取ZIP末尾的中央目录列出条目，不解压、不整体读取文件
+# 目录结果按 文件路径+修改时间 缓存；单个条目可边解压边流式下载
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+
+# 最多缓存多少个压缩包的目录
+ARCHIVE_CACHE_SIZE = 64
+# 单个压缩包最多列出的条目数，防止异常压缩包生成超大响应
+MAX_LISTED_ENTRIES = 10000
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def is_zip(filename):
+    return filename.rsplit('.', 1)[-1].lower() == 'zip'
+
+def decode_entry_name(info):
+    """
+    Windows中文环境打包的ZIP常以GBK保存文件名且未设置UTF-8标志，
+    zipfile会按cp437解码成乱码，这里尝试还原。
+    """
+    if info.flag_bits & 0x800:
+        return info.filename
+    try:
+        return info.filename.encode('cp437').decode('gbk')
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return info.filename
+
+def _read_entries(path):
+    entries = []
+    with zipfile.ZipFile(path) as zf:
+        for info in zf.infolist()[:MAX_LISTED_ENTRIES]:
+            entries.append({
+                'path': decode_entry_name(info),
+                'size': info.file_size,
+                'compressed_size': info.compress_size,
+                'is_dir': info.is_dir(),
+                'modified': '%04d-%02d-%02d %02d:%02d:%02d' % info.date_time,
+                # 原始文件名，用于再次打开条目
+                '_raw': info.filename
+            })
+    return entries
+
+def list_entries(path):
+    """
+    列出ZIP压缩包内的条目，结果按修改时间缓存。
+    返回: (条目列表, 是否被截断)；不是有效ZIP时抛出zipfile.BadZipFile。
+    """
+    stat = os.stat(path)
+    key = os.path.abspath(path)
+    stamp = (stat.st_mtime, stat.st_size)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached and cached[0] == stamp:
+            _cache.move_to_end(key)
+            return cached[1], cached[2]
+    entries = _read_entries(path)
+    truncated = len(entries) >= MAX_LISTED_ENTRIES
+    with _cache_lock:
+        _cache[key] = (stamp, entries, truncated)
+        _cache.move_to_end(key)
+        while len(_cache) > ARCHIVE_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return entries, truncated
+
+def public_entries(entries):
+    """去掉内部字段，用于返回给客户端"""
+    return [{k: v for k, v in e.items() if not k.startswith('_')} for e in entries]
+
+def find_entry(path, entry_path):
+    """在缓存的目录中查找条目，找不到或是目录时返回None"""
+    entries, _ = list_entries(path)
+    for entry in entries:
+        if entry['path'] == entry_path and not entry['is_dir']:
+            return entry
+    return None
+
+def open_entry(path, entry):
+    """
+    打开压缩包内的单个条目，返回可流式读取的文件对象（边读边解压）。
+    ZipFile本身可以立即关闭，底层文件句柄在条目关闭后才释放。
+    """
+    zf = zipfile.ZipFile(path)
+    try:
+        return zf.open(entry['_raw'])
+    finally:
+        zf.close()
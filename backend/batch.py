@@ -0,0 +1,196 @@
+# 批量操作：一次请求完成多个文件的删除、重命名，以及在文件区和视频区之间移动
+# 整批操作只读写一次上传IP记录，每个区域只做一次保留数量清理、只递增一次版本号
+import gzip
+import json
+import os
+import shutil
+from contextlib import ExitStack
+from werkzeug.utils import secure_filename
+from admission import upload_admission
+from versioning import collection_versions
+from shared_state import file_lock
+from profiling import phase
+from cold_storage import COMPRESSED_SUFFIX
+from storage_index import find_path, ensure_shard
+
+# 单次请求最多包含的操作数
+MAX_BATCH_OPERATIONS = 1000
+OPERATIONS = ('delete', 'rename', 'move')
+
+class BatchError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+class StorageArea:
+    """
+    一个存储区域（文件区或视频区）的描述。
+    retain: 执行保留数量清理，参数为刚移入、尚未递增版本号的文件名，返回被清理的文件名列表
+    allowed: 判断文件名是否属于该区域允许的类型（用于重命名和移入）
+    locate: 查找文件实际存储位置，返回(路径, 是否压缩存储)，默认直接对应目录下的同名文件
+    compressible: 判断文件名是否可以保持压缩存储，默认不支持压缩存储
+    """
+
+    def __init__(self, name, folder, info_path, collection, retain, allowed=None, locate=None, compressible=None):
+        self.name = name
+        self.folder = folder
+        self.info_path = info_path
+        self.collection = collection
+        self.retain = retain
+        self.allowed = allowed
+        self.compressible = compressible or (lambda filename: False)
+        if locate is not None:
+            self.locate = locate
+
+    def locate(self, filename):
+        return find_path(self.folder, filename), False
+
+    def exists(self, filename):
+        return self.locate(filename)[0] is not None
+
+def valid_name(name):
+    """只接受目录下的普通文件名，拒绝路径分隔符和 . / .."""
+    return (isinstance(name, str) and name not in ('', '.', '..')
+            and os.path.basename(name) == name and '/' not in name and '\\' not in name)
+
+class BatchProcessor:
+    def __init__(self):
+        self.areas = {}
+
+    def register(self, area):
+        self.areas[area.name] = area
+
+    def _load_info(self, area):
+        if not os.path.exists(area.info_path):
+            return {}
+        try:
+            with open(area.info_path, 'r', encoding='utf-8') as f, phase('json'):
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def _save_info(self, area, info):
+        with open(area.info_path, 'w', encoding='utf-8') as f, phase('json'):
+            json.dump(info, f, ensure_ascii=False)
+
+    def _transfer(self, path, compressed, target, new_name):
+        """把文件移到目标区域，保留修改时间；压缩存储的文件在目标不支持压缩时解压"""
+        dest = ensure_shard(target.folder, new_name)
+        if not compressed:
+            os.replace(path, dest)
+        elif target.compressible(new_name):
+            os.replace(path, dest + COMPRESSED_SUFFIX)
+        else:
+            stat = os.stat(path)
+            tmp = f'{dest}.{os.getpid()}.tmp'
+            try:
+                with gzip.open(path, 'rb') as src, open(tmp, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+                os.utime(tmp, (stat.st_atime, stat.st_mtime))
+                os.replace(tmp, dest)
+            except Exception:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+            os.remove(path)
+
+    def _apply(self, source, operation, infos, changes):
+        """执行单个操作，成功返回附加结果字段，失败抛出BatchError"""
+        kind = operation.get('op')
+        name = operation.get('name')
+        if kind not in OPERATIONS:
+            raise BatchError(400, '不支持的操作')
+        if not valid_name(name):
+            raise BatchError(400, '文件名不合法')
+        path, compressed = source.locate(name)
+        if path is None:
+            raise BatchError(404, '文件不存在')
+
+        if kind == 'delete':
+            os.remove(path)
+            infos[source.name].pop(name, None)
+            changes[source.name].append(('remove', name))
+            return {}
+
+        if kind == 'rename':
+            target = source
+            if not operation.get('new_name'):
+                raise BatchError(400, '缺少new_name参数')
+        else:
+            target = self.areas.get(operation.get('to'))
+            if target is None or target is source:
+                raise BatchError(400, '目标区域不正确')
+        new_name = secure_filename(str(operation.get('new_name') or name))
+        if not new_name:
+            raise BatchError(400, '新文件名不合法')
+        if target is source and new_name == name:
+            raise BatchError(400, '新文件名与原文件名相同')
+        # 重命名和移动都不能得到目标区域不支持的类型，与上传时的限制一致
+        if target.allowed and not target.allowed(new_name):
+            raise BatchError(400, '不支持的文件类型' if kind == 'rename' else '目标区域不支持该文件类型')
+        if target.exists(new_name):
+            raise BatchError(409, '目标文件已存在')
+
+        with phase('fs'):
+            self._transfer(path, compressed, target, new_name)
+        ip = infos[source.name].pop(name, None)
+        if ip is not None:
+            infos[target.name][new_name] = ip
+        changes[source.name].append(('remove', name))
+        changes[target.name].append(('add', new_name))
+        return {'new_name': new_name, 'to': target.name}
+
+    def run(self, area_name, operations):
+        """
+        在area_name区域上依次执行operations，单个操作失败不影响其余操作。
+        返回: {'results': [每个操作的结果], 'succeeded': 成功数, 'failed': 失败数}
+        """
+        if not isinstance(operations, list) or not operations:
+            raise BatchError(400, '缺少operations参数')
+        if len(operations) > MAX_BATCH_OPERATIONS:
+            raise BatchError(400, f'单次最多{MAX_BATCH_OPERATIONS}个操作')
+        source = self.areas[area_name]
+        # 按固定顺序对所有区域的IP记录加锁，避免与其他批量请求互相等待
+        areas = sorted(self.areas.values(), key=lambda a: a.name)
+        results = []
+        changes = {area.name: [] for area in areas}
+        with ExitStack() as stack:
+            for area in areas:
+                stack.enter_context(file_lock(area.info_path))
+            infos = {area.name: self._load_info(area) for area in areas}
+
+            for index, operation in enumerate(operations):
+                if not isinstance(operation, dict):
+                    operation = {}
+                result = {'index': index, 'op': operation.get('op'), 'name': operation.get('name')}
+                try:
+                    result.update(self._apply(source, operation, infos, changes))
+                    result['status'] = 200
+                except BatchError as e:
+                    result.update(status=e.status, error=e.message)
+                except Exception as e:
+                    result.update(status=500, error=str(e))
+                results.append(result)
+
+            for area in areas:
+                if changes[area.name]:
+                    self._save_info(area, infos[area.name])
+
+        for area in areas:
+            area_changes = changes[area.name]
+            if not area_changes:
+                continue
+            # 有文件移入的区域数量可能超出上限，整批结束后统一清理一次
+            if any(op == 'add' for op, _ in area_changes) and area is not source:
+                with phase('fs'):
+                    moved_in = [name for op, name in area_changes if op == 'add']
+                    area_changes.extend(('remove', name) for name in area.retain(moved_in))
+            upload_admission.invalidate_usage(area.folder)
+            collection_versions.bump(area.collection, area_changes)
+
+        succeeded = sum(1 for r in results if r['status'] == 200)
+        return {'results': results, 'succeeded': succeeded, 'failed': len(results) - succeeded}
+
+# 全局批量操作实例，文件区和视频区在各自模块中注册
+batch_processor = BatchProcessor()
@@ -0,0 +1,129 @@
+# 热点小文件字节缓存：小于阈值的文件内容按LRU保存在内存中，所有请求共用
+# 缓存条目记录文件的修改时间和大小，以及放入/校验时的集合版本号；
+# 版本号未变时直接命中、不访问文件系统，版本号变化后先stat核对修改时间和大小再决定是否沿用
+import os
+import threading
+from collections import OrderedDict
+from config import config
+from versioning import collection_versions
+
+class CacheEntry:
+    __slots__ = ('data', 'mtime', 'mtime_ns', 'size', 'version')
+
+    def __init__(self, data, mtime, mtime_ns, size, version):
+        self.data = data
+        self.mtime = mtime
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.version = version
+
+    @property
+    def etag(self):
+        return f'{self.mtime}-{self.size}'
+
+class ByteCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # (集合, 文件名) -> CacheEntry
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def capacity(self):
+        return int(config.get('byte_cache_max_mb', 64) * 1024 * 1024)
+
+    @property
+    def max_file_size(self):
+        return int(config.get('byte_cache_max_file_kb', 1024) * 1024)
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes_used -= entry.size
+        return entry
+
+    def _count(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def fetch(self, collection, name, locate):
+        """
+        取文件内容，未命中时读盘并放入缓存。
+        locate: 返回文件路径，文件不存在或不应缓存（如压缩存储）时返回None；命中且版本号未变时不调用，否则只调用一次
+        返回: CacheEntry；文件不存在、超过大小阈值或缓存关闭时返回None，由调用方按原方式发送
+        """
+        capacity = self.capacity
+        if capacity <= 0:
+            return None
+        key = (collection, name)
+        # 先取版本号再核对文件，核对期间若有变更，下次请求版本号不同会重新核对
+        version = collection_versions.get(collection)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.version == version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        path = locate()
+        if path is None:
+            with self.lock:
+                self._remove(key)
+            self._count(False)
+            return None
+        stat = os.stat(path)
+        if entry is not None and entry.mtime_ns == stat.st_mtime_ns and entry.size == stat.st_size:
+            entry.version = version
+            self._count(True)
+            return entry
+        if stat.st_size > min(self.max_file_size, capacity):
+            self._count(False)
+            return None
+        with open(path, 'rb') as f:
+            data = f.read()
+        entry = CacheEntry(data, stat.st_mtime, stat.st_mtime_ns, len(data), version)
+        with self.lock:
+            self.misses += 1
+            self._remove(key)
+            self.entries[key] = entry
+            self.bytes_used += entry.size
+            while self.bytes_used > capacity and self.entries:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+        return entry
+
+    def invalidate(self, collection, names=None):
+        """删除指定集合中names对应的缓存，names为None时清空整个集合"""
+        with self.lock:
+            if names is None:
+                for key in [k for k in self.entries if k[0] == collection]:
+                    self._remove(key)
+            else:
+                for name in names:
+                    self._remove((collection, name))
+
+    def on_change(self, collection, changes):
+        """集合版本号变更时的回调：本进程内的上传、删除、压缩等立即释放对应缓存"""
+        self.invalidate(collection, None if changes is None else [item for _, item in changes])
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes_used': self.bytes_used,
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions
+            }
+
+# 全局字节缓存实例
+byte_cache = ByteCache()
+collection_versions.subscribe(byte_cache.on_change)
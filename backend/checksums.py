@@ -0,0 +1,116 @@
+# 文件校验和：上传完成后由后台任务计算SHA-256，结果按(区域, 文件名)保存，
+# 同时记录计算时文件的修改时间和大小，文件被替换或压缩存储后记录自动失效
+import gzip
+import hashlib
+import os
+import sqlite3
+import threading
+from jobs import job_queue
+
+DB_PATH = os.path.join(os.path.dirname(__file__), 'checksums.db')
+READ_CHUNK = 1024 * 1024
+# 下载响应中携带已知的SHA-256，客户端分段并行下载后据此校验拼接结果
+HASH_HEADER = 'X-Content-SHA256'
+
+class ChecksumStore:
+    """
+    各存储区域在自己的模块中注册查找函数：
+    locate(文件名) -> (路径, 是否压缩存储)，文件不存在时路径为None
+    """
+
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        self.local = threading.local()
+        self.areas = {}
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS checksums (area TEXT NOT NULL, name TEXT NOT NULL, mtime_ns INTEGER NOT NULL, '
+            'size INTEGER NOT NULL, sha256 TEXT NOT NULL, PRIMARY KEY (area, name))'
+        )
+
+    def _connect(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self.local.conn = conn
+        return conn
+
+    def register(self, area, locate):
+        self.areas[area] = locate
+
+    def get(self, area, name, path):
+        """取已计算的SHA-256，没有记录或文件已变化时返回None"""
+        stat = os.stat(path)
+        return self.lookup(area, name, stat.st_mtime_ns, stat.st_size)
+
+    def lookup(self, area, name, mtime_ns, size):
+        """按已知的修改时间和大小取SHA-256，不访问文件"""
+        row = self._connect().execute('SELECT mtime_ns, size, sha256 FROM checksums WHERE area = ? AND name = ?',
+                                      (area, name)).fetchone()
+        if row and row[0] == mtime_ns and row[1] == size:
+            return row[2]
+        return None
+
+    def advertise(self, response, area, name, path=None, identity=None):
+        """
+        已算出校验和且文件未变化时加到下载响应头中，查询失败不影响下载。
+        identity: 已知的(修改时间ns, 大小)，如缓存条目中记录的，给出时不再stat文件
+        """
+        try:
+            sha256 = self.lookup(area, name, *identity) if identity else self.get(area, name, path)
+        except Exception:
+            return response
+        if sha256:
+            response.headers[HASH_HEADER] = sha256
+        return response
+
+    def compute(self, area, name, progress=None):
+        """计算并保存文件（压缩存储的为解压后内容）的SHA-256，文件不存在时返回None"""
+        path, compressed = self.areas[area](name)
+        if path is None:
+            return None
+        stat = os.stat(path)
+        digest = hashlib.sha256()
+        done = 0
+        with (gzip.open(path, 'rb') if compressed else open(path, 'rb')) as f:
+            while True:
+                data = f.read(READ_CHUNK)
+                if not data:
+                    break
+                digest.update(data)
+                done += len(data)
+                if progress and stat.st_size:
+                    progress(min(done / stat.st_size, 1.0))
+        self._save(area, name, stat, digest.hexdigest())
+        return digest.hexdigest()
+
+    def record(self, area, name, path, sha256):
+        """保存写入时已经算出的SHA-256（如增量上传重建时），不必再排队计算"""
+        self._save(area, name, os.stat(path), sha256)
+
+    def _save(self, area, name, stat, sha256):
+        self._connect().execute('INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?)',
+                                (area, name, stat.st_mtime_ns, stat.st_size, sha256))
+
+    def schedule(self, area, name):
+        """
+        加入后台计算任务，返回任务号；同一文件的同一版本排队或计算中时不重复加入。
+        加入失败时返回None，不影响上传
+        """
+        try:
+            path, _ = self.areas[area](name)
+            # 文件被原地替换（如图片无损压缩后保留修改时间）时大小也会变化，一并作为版本
+            stat = os.stat(path) if path else None
+            version = f'{stat.st_mtime_ns}:{stat.st_size}' if stat else 0
+            return job_queue.enqueue('checksum', {'area': area, 'name': name}, dedup_key=f'checksum:{area}:{name}:{version}')
+        except Exception as e:
+            print('加入校验和任务失败', e)
+            return None
+
+def run_checksum_job(context):
+    sha256 = checksum_store.compute(context.payload['area'], context.payload['name'], context.progress)
+    return {'sha256': sha256}
+
+# 全局校验和实例，文件区和视频区在各自模块中注册
+checksum_store = ChecksumStore()
+job_queue.register('checksum', run_checksum_job)
@@ -0,0 +1,142 @@
+# 冷文件压缩存储：文本、CSV、日志、代码等文件在上传一段时间后于后台gzip压缩
+# 压缩后以 原文件名.gz 保存并保留原修改时间，客户端支持gzip时下载直接发送压缩数据
+import gzip
+import os
+import shutil
+import struct
+import threading
+import time
+from config import config
+from shared_state import file_lock
+from storage_index import walk_files
+
+COMPRESSED_SUFFIX = '.gz'
+# 压缩率达不到该比例的文件保持原样
+MIN_SAVING_RATIO = 0.9
+# 压缩过程的跨进程锁文件（以.开头，不出现在列表中）
+LOCK_NAME = '.cold_storage'
+
+def gzip_logical_size(path):
+    """读取gzip尾部记录的原始大小（ISIZE，按2^32取模，足够覆盖上传大小上限）"""
+    with open(path, 'rb') as f:
+        f.seek(-4, os.SEEK_END)
+        return struct.unpack('<I', f.read(4))[0]
+
+class ColdStorage:
+    def __init__(self, folder, extensions, on_compressed=None):
+        self.folder = folder
+        self.extensions = extensions
+        # 压缩完成后的回调，参数为逻辑文件名
+        self.on_compressed = on_compressed
+        # 压缩效果不佳而跳过的文件：(文件名, 修改时间)
+        self.skipped = set()
+        self.thread = None
+        self.stats = {'compressed': 0, 'skipped': 0, 'saved_bytes': 0, 'last_scan': None}
+
+    def eligible(self, filename):
+        return '.' in filename and filename.rsplit('.', 1)[1].lower() in self.extensions
+
+    @staticmethod
+    def same_file(stat, current):
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns) == (current.st_ino, current.st_size, current.st_mtime_ns)
+
+    def compress(self, raw):
+        """
+        压缩单个文件（raw为磁盘路径），成功返回True；压缩不划算、文件已被其他进程压缩或期间被改动时返回False。
+        多个进程（调试重载、滚动重启时新旧工作进程并存）可能同时扫描，压缩过程加跨进程锁
+        """
+        with file_lock(os.path.join(self.folder, LOCK_NAME)):
+            return self._compress(raw)
+
+    def _compress(self, raw):
+        filename = os.path.basename(raw)
+        target = raw + COMPRESSED_SUFFIX
+        tmp = f'{target}.{os.getpid()}.tmp'
+        try:
+            stat = os.stat(raw)
+        except FileNotFoundError:
+            # 其他进程已压缩完成或文件已被删除
+            return False
+        try:
+            with open(raw, 'rb') as src, gzip.open(tmp, 'wb', compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            stored_size = os.path.getsize(tmp)
+            if stored_size > stat.st_size * MIN_SAVING_RATIO:
+                self.skipped.add((filename, stat.st_mtime))
+                self.stats['skipped'] += 1
+                return False
+            try:
+                if not self.same_file(stat, os.stat(raw)):
+                    # 压缩期间被重新上传，下次扫描再处理
+                    return False
+            except FileNotFoundError:
+                return False
+            # 保留原修改时间，列表排序和保留数量清理不受影响
+            os.utime(tmp, (stat.st_atime, stat.st_mtime))
+            os.replace(tmp, target)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        # 先把原文件改名移开再核对：上传在核对之后替换原文件时不会被误删
+        aside = f'{raw}.{os.getpid()}.compressing.tmp'
+        try:
+            os.rename(raw, aside)
+        except FileNotFoundError:
+            # 原文件已不在，压缩文件即为最新内容
+            return False
+        except OSError:
+            # 原文件无法移动（如Windows下正被下载），原文件未变时撤销本次压缩，下次再试
+            try:
+                if self.same_file(stat, os.stat(raw)):
+                    os.remove(target)
+            except FileNotFoundError:
+                pass
+            return False
+        if not self.same_file(stat, os.stat(aside)):
+            # 移开的是刚上传的新内容：放回原位（其间又有新上传时保留更新的那个），旧内容的压缩文件作废
+            try:
+                os.link(aside, raw)
+            except FileExistsError:
+                pass
+            os.remove(aside)
+            os.remove(target)
+            return False
+        os.remove(aside)
+        self.stats['compressed'] += 1
+        self.stats['saved_bytes'] += stat.st_size - stored_size
+        if self.on_compressed:
+            self.on_compressed(filename)
+        return True
+
+    def scan(self):
+        """压缩所有已超过保鲜期的符合条件的文件"""
+        min_age = config.get('compress_after_seconds', 3600)
+        min_size = config.get('compress_min_size', 4096)
+        now = time.time()
+        for filename, path in walk_files(self.folder):
+            if not self.eligible(filename):
+                continue
+            try:
+                stat = os.stat(path)
+                if (not os.path.isfile(path) or stat.st_size < min_size
+                        or now - stat.st_mtime < min_age or (filename, stat.st_mtime) in self.skipped):
+                    continue
+                self.compress(path)
+            except FileNotFoundError:
+                # 扫描期间文件被删除
+                continue
+            except Exception as e:
+                print(f'压缩文件失败 {filename}: {e}')
+        self.stats['last_scan'] = now
+
+    def _run(self):
+        while True:
+            self.scan()
+            time.sleep(config.get('compress_scan_interval', 300))
+
+    def start(self):
+        """按配置启动后台压缩线程（compress_cold_files为false时不启动）"""
+        if self.thread is not None or not config.get('compress_cold_files', False):
+            return
+        self.thread = threading.Thread(target=self._run, name='cold-storage', daemon=True)
+        self.thread.start()
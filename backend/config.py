@@ -24,7 +24,68 @@ class Config:
             "allowed_extensions": [".txt", ".pdf", ".doc", ".docx", ".xls", ".xlsx", 
                                  ".jpg", ".jpeg", ".png", ".gif", ".mp4", ".avi", ".mov"],
             "upload_folder": "uploads",
-            "video_folder": "videos"
+            "video_folder": "videos",
+            # 上传准入控制
+            "upload_max_concurrent": 4,
+            "upload_max_concurrent_per_ip": 2,
+            "upload_min_free_mb": 500,
+            "upload_folder_quota_mb": 0,  # 0表示不限制
+            "upload_retry_after": 5,
+            # 冷文件压缩存储
+            "compress_cold_files": False,
+            "compress_after_seconds": 3600,
+            "compress_min_size": 4096,
+            "compress_scan_interval": 300,
+            # 性能分析与慢请求记录
+            "profile_sample_rate": 0.0,
+            "profile_token": "",  # 非空时，带 X-Profile: <token> 请求头的请求会被单独分析
+            "profile_keep": 50,
+            "slow_request_ms": 0,  # 0表示不记录慢请求
+            # 热点小文件内存缓存：总容量（MB，0表示关闭）和单个文件大小上限（KB）
+            "byte_cache_max_mb": 64,
+            "byte_cache_max_file_kb": 1024,
+            # 元数据维护：核对上传IP记录与磁盘文件的间隔（秒），0表示不启动后台维护
+            "maintenance_interval": 3600,
+            # 下载热度统计写入间隔（秒）；热点文件预读：间隔（秒，0表示关闭）、预读的文件数和总大小上限（MB）
+            "popularity_flush_interval": 30,
+            "prefetch_interval": 60,
+            "prefetch_top": 20,
+            "prefetch_max_mb": 512,
+            # 后台任务队列：本进程执行任务的工作线程数，0表示只加入任务不执行
+            "job_workers": 2,
+            # 视频转码：上传avi/wmv/mkv/flv后在后台用ffmpeg转为可在浏览器播放的MP4（需安装ffmpeg），
+            # 同时运行的ffmpeg进程数上限和进程的nice值（Windows下为低于正常优先级）
+            "transcode_enabled": False,
+            "ffmpeg_path": "ffmpeg",
+            "transcode_max_concurrent": 1,
+            "transcode_nice": 10,
+            # 组播推送分发：组播地址和端口、TTL（1表示不跨路由器）、默认发送速率（Mbps）、每组数据块数（每组附带一个校验块）、
+            # 发送网卡IP（""由系统选择，本机测试可设为127.0.0.1）
+            "multicast_group": "239.255.42.99",
+            "multicast_port": 5007,
+            "multicast_ttl": 1,
+            "multicast_rate_mbps": 200,
+            "multicast_fec_group": 8,
+            "multicast_interface": "",
+            # 图片优化：上传PNG/JPEG后在后台无损压缩原图（JPEG需安装jpegtran，PNG优先用oxipng/optipng，都没有时用Pillow），是否去除EXIF等元数据，
+            # 生成预览用缩小版本（需Pillow）的长边像素上限和JPEG质量
+            "image_optimize_enabled": False,
+            "jpegtran_path": "jpegtran",
+            "oxipng_path": "oxipng",
+            "optipng_path": "optipng",
+            "image_strip_metadata": False,
+            "image_web_max_px": 2048,
+            "image_web_quality": 82,
+            # 多进程运行：工作进程数（1为单进程，大于1时各进程用SO_REUSEPORT共用端口，仅Linux/macOS）、
+            # 停止或滚动重启时等待已有请求完成的最长时间（秒）
+            "server_workers": 1,
+            "server_graceful_timeout": 30,
+            # 反向代理文件发送卸载：""（由Flask发送）、"x-accel-redirect"（nginx）、"x-sendfile"（Apache/lighttpd）
+            "offload_mode": "",
+            "offload_locations": {  # x-accel-redirect模式下各存储目录对应的nginx internal location
+                "uploads": "/_protected/uploads/",
+                "videos": "/_protected/videos/"
+            }
         }
         
         if self.config_file.exists():
@@ -0,0 +1,141 @@
+# 增量上传（rsync风格）：服务端为已有文件提供分块签名（弱校验adler32 + 强校验SHA-256截断），
+# 客户端用滚动校验在新文件中找出与旧文件相同的块，只发送复制指令和变化的数据，服务端边接收边重建新文件
+#
+# 请求体为连续的指令记录（整数均为大端）：
+#   b'C' + 起始块号(uint32) + 块数(uint32)   从旧文件复制连续的若干整块
+#   b'D' + 长度(uint32) + 数据               直接写入的新数据
+#   b'E'                                     结束
+import gzip
+import hashlib
+import math
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from cold_storage import gzip_logical_size
+
+MIN_BLOCK_SIZE = 2 * 1024
+MAX_BLOCK_SIZE = 64 * 1024
+# 强校验取SHA-256的前16字节（浏览器端可用crypto.subtle计算）
+STRONG_HASH_BYTES = 16
+# 签名缓存条数
+SIGNATURE_CACHE_SIZE = 16
+COPY_CHUNK = 1024 * 1024
+
+OP_COPY = b'C'
+OP_DATA = b'D'
+OP_END = b'E'
+
+class DeltaError(Exception):
+    pass
+
+def choose_block_size(size):
+    """块大小取文件大小的平方根（按1KB取整），块数和每块数据量大致平衡"""
+    block = int(math.sqrt(max(size, 1)))
+    block = (block + 1023) // 1024 * 1024
+    return min(max(block, MIN_BLOCK_SIZE), MAX_BLOCK_SIZE)
+
+def strong_hash(data):
+    return hashlib.sha256(data).hexdigest()[:STRONG_HASH_BYTES * 2]
+
+def base_token(path):
+    """基准文件的版本标识，签名和增量上传之间文件被替换或压缩时随之变化"""
+    stat = os.stat(path)
+    return f'{stat.st_mtime_ns:x}-{stat.st_size:x}'
+
+def open_base(path, compressed):
+    return gzip.open(path, 'rb') if compressed else open(path, 'rb')
+
+def logical_size(path, compressed):
+    return gzip_logical_size(path) if compressed else os.path.getsize(path)
+
+_signature_cache = OrderedDict()
+_signature_lock = threading.Lock()
+
+def signature(path, compressed, block_size=None):
+    """
+    计算文件的分块签名，结果按(路径, 版本标识, 块大小)缓存。
+    只包含完整的块，末尾不足一块的数据不参与匹配。
+    返回: {'size', 'block_size', 'base_token', 'blocks': [[弱校验, 强校验], ...]}
+    """
+    token = base_token(path)
+    key = (path, token, block_size)
+    with _signature_lock:
+        cached = _signature_cache.get(key)
+        if cached is not None:
+            _signature_cache.move_to_end(key)
+            return cached
+    size = logical_size(path, compressed)
+    if block_size is None:
+        block_size = choose_block_size(size)
+    blocks = []
+    with open_base(path, compressed) as f:
+        while True:
+            data = f.read(block_size)
+            if len(data) < block_size:
+                break
+            blocks.append([zlib.adler32(data), strong_hash(data)])
+    result = {'size': size, 'block_size': block_size, 'base_token': token, 'blocks': blocks}
+    with _signature_lock:
+        _signature_cache[key] = result
+        while len(_signature_cache) > SIGNATURE_CACHE_SIZE:
+            _signature_cache.popitem(last=False)
+    return result
+
+def _read_exact(stream, size):
+    data = stream.read(size)
+    if len(data) == size:
+        return data
+    parts = [data]
+    remaining = size - len(data)
+    while remaining > 0:
+        chunk = stream.read(remaining)
+        if not chunk:
+            raise DeltaError('增量数据不完整')
+        parts.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(parts)
+
+def apply_delta(stream, base, block_count, block_size, out, max_size):
+    """
+    按指令流重建新文件，边读边写，内存占用与文件大小无关。
+    参数: stream - 指令流；base - 已打开的旧文件；block_count - 签名中的块数；out - 输出文件
+    返回: (新文件大小, 新文件SHA-256十六进制)
+    """
+    digest = hashlib.sha256()
+    written = 0
+
+    def write(data):
+        nonlocal written
+        written += len(data)
+        if written > max_size:
+            raise DeltaError(f'文件大小超过限制（最大{max_size//1024//1024}MB）')
+        digest.update(data)
+        out.write(data)
+
+    while True:
+        op = _read_exact(stream, 1)
+        if op == OP_END:
+            break
+        if op == OP_COPY:
+            index, count = struct.unpack('>II', _read_exact(stream, 8))
+            if count == 0 or index + count > block_count:
+                raise DeltaError('复制指令超出旧文件范围')
+            base.seek(index * block_size)
+            remaining = count * block_size
+            while remaining > 0:
+                data = base.read(min(COPY_CHUNK, remaining))
+                if not data:
+                    raise DeltaError('旧文件已变化')
+                write(data)
+                remaining -= len(data)
+        elif op == OP_DATA:
+            (length,) = struct.unpack('>I', _read_exact(stream, 4))
+            while length > 0:
+                data = _read_exact(stream, min(COPY_CHUNK, length))
+                write(data)
+                length -= len(data)
+        else:
+            raise DeltaError('无法识别的增量指令')
+    return written, digest.hexdigest()
@@ -0,0 +1,355 @@
+# 图片优化：上传的PNG/JPEG在后台无损重新压缩（可选去除EXIF等元数据），并生成适合网页显示的缩小版本，
+# 预览时优先返回缩小版本，下载仍为原图（像素不变，只是更小）。
+# JPEG无损优化使用本机jpegtran（libjpeg-turbo），PNG无损优化优先使用本机oxipng或optipng，都没有时用Pillow重新保存
+# （只处理8位以下、不含Pillow无法保留的数据块的PNG，并逐像素核对）；缩小版本需要Pillow；都没有时跳过对应步骤。
+# 缩小版本保存在 uploads/.renditions/ 下，与原图一样按文件名分片存放，随原图的删除、重命名自动清理
+import logging
+import os
+import shutil
+import struct
+import subprocess
+import threading
+from config import config
+from jobs import job_queue
+from storage_index import ensure_shard, find_path
+from versioning import collection_versions
+
+try:
+    from PIL import Image, ImageOps, PngImagePlugin
+except ImportError:
+    Image = None
+
+RENDITION_DIR = '.renditions'
+OPTIMIZE_EXTENSIONS = set(['jpg', 'jpeg', 'png'])
+# 无损重新压缩后至少小这么多字节才替换原图
+MIN_SAVING = 1024
+# 缩小版本不比原图小该比例时不保存，预览直接用原图
+MIN_RENDITION_RATIO = 0.9
+EXIF_ORIENTATION = 0x0112
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# Pillow重新保存PNG时能带上的数据块；含其他数据块（gAMA、cHRM、sRGB、sBIT等影响显示效果的）的PNG不用Pillow处理
+PILLOW_PNG_CHUNKS = {b'IHDR', b'PLTE', b'IDAT', b'IEND', b'tRNS', b'tEXt', b'zTXt', b'iTXt', b'iCCP', b'eXIf', b'pHYs'}
+# 去除元数据时允许丢掉的数据块
+PNG_METADATA_CHUNKS = {b'tEXt', b'zTXt', b'iTXt', b'eXIf', b'pHYs', b'tIME'}
+# Pillow按8位处理的模式（16位PNG在Pillow中会被截成8位，不能用Pillow重新保存）
+PILLOW_PNG_MODES = {'1', 'L', 'LA', 'P', 'RGB', 'RGBA'}
+
+def jpegtran_command(jpegtran, source, target, copy):
+    # -copy all 保留元数据，icc 只保留色彩配置，none 全部去除；-optimize 重新计算霍夫曼表，-progressive 渐进式，均不改变像素
+    return [jpegtran, '-copy', copy, '-optimize', '-progressive', '-outfile', target, source]
+
+def png_optimizer_command(kind, tool, source, target, strip):
+    """oxipng/optipng只做无损的重新编码（调整过滤方式、压缩参数，可无损降低位深或改用调色板）"""
+    if kind == 'oxipng':
+        # --strip safe 只去除不影响显示的数据块，色彩相关的（iCCP、sRGB、gAMA等）保留
+        return [tool, '-q', '-o', '2'] + (['--strip', 'safe'] if strip else []) + ['--out', target, source]
+    # optipng去除元数据的范围不够明确，始终保留
+    return [tool, '-quiet', '-o2', '-out', target, source]
+
+def png_header(path):
+    """读取PNG的(位深, 颜色类型)和所含数据块类型集合，不是PNG时返回(None, set())"""
+    chunks = set()
+    with open(path, 'rb') as f:
+        if f.read(8) != PNG_SIGNATURE:
+            return None, chunks
+        header = None
+        while True:
+            raw = f.read(8)
+            if len(raw) < 8:
+                break
+            length, kind = struct.unpack('>I4s', raw)
+            chunks.add(kind)
+            if kind == b'IHDR':
+                header = tuple(f.read(length)[8:10])
+                f.seek(4, os.SEEK_CUR)
+            else:
+                f.seek(length + 4, os.SEEK_CUR)
+            if kind == b'IEND':
+                break
+    return header, chunks
+
+class ImageOptimizer:
+    def __init__(self, folder, collection, locate, on_replaced=None):
+        """
+        folder: 文件目录；collection: 文件集合名（原图变小后递增版本号，列表中的大小随之更新）
+        locate: 文件名 -> 原图路径，不存在或已压缩存储时返回None
+        on_replaced: 原图被无损压缩替换后的回调（参数为文件名），如重新计算校验和
+        """
+        self.folder = folder
+        self.collection = collection
+        self.locate = locate
+        self.on_replaced = on_replaced
+        # 多个任务工作线程同时更新
+        self.stats_lock = threading.Lock()
+        self.stats = {'optimized': 0, 'bytes_saved': 0, 'renditions': 0, 'rendition_bytes_saved': 0, 'failed': 0, 'rejected': 0}
+
+    @property
+    def enabled(self):
+        return bool(config.get('image_optimize_enabled', False))
+
+    @property
+    def jpegtran(self):
+        return shutil.which(config.get('jpegtran_path', 'jpegtran') or 'jpegtran')
+
+    @property
+    def png_optimizer(self):
+        """返回(工具名, 路径)，优先oxipng，都没有时返回None"""
+        for kind in ('oxipng', 'optipng'):
+            path = shutil.which(config.get(f'{kind}_path', kind) or kind)
+            if path:
+                return kind, path
+        return None
+
+    def _count(self, **deltas):
+        with self.stats_lock:
+            for key, delta in deltas.items():
+                self.stats[key] += delta
+
+    @staticmethod
+    def extension(filename):
+        return filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+
+    def needs_optimize(self, filename):
+        return self.extension(filename) in OPTIMIZE_EXTENSIONS
+
+    def rendition_path(self, filename):
+        """缩小版本的路径：不透明的图片为JPEG，带透明通道的为PNG；旧版本直接放在.renditions下的也能找到"""
+        for suffix in ('.web.jpg', '.web.png'):
+            path = find_path(os.path.join(self.folder, RENDITION_DIR), filename, suffix)
+            if path is not None:
+                return path
+        return None
+
+    def ready_rendition(self, filename, source_path=None):
+        """已生成且不旧于原图的缩小版本路径，没有时返回None"""
+        path = self.rendition_path(filename)
+        if path is None:
+            return None
+        source_path = source_path or self.locate(filename)
+        try:
+            if source_path is None or os.stat(source_path).st_mtime > os.stat(path).st_mtime:
+                return None
+        except OSError:
+            return None
+        return path
+
+    def schedule(self, filename):
+        """需要优化且尚未生成缩小版本时加入后台任务，返回任务号；不需要或未启用时返回None"""
+        if not self.enabled or not self.needs_optimize(filename):
+            return None
+        source = self.locate(filename)
+        if source is None or self.ready_rendition(filename, source):
+            return None
+        try:
+            return job_queue.enqueue('image_optimize', {'name': filename},
+                                     dedup_key=f'image_optimize:{filename}:{os.stat(source).st_mtime_ns}')
+        except Exception as e:
+            logging.warning(f'加入图片优化任务失败 {filename}: {e}')
+            return None
+
+    def remove(self, filename):
+        while True:
+            path = self.rendition_path(filename)
+            if path is None:
+                return
+            try:
+                os.remove(path)
+            except OSError:
+                return
+
+    def on_change(self, collection, changes):
+        """文件增删改（上传、批量操作、保留数量清理等）时同步缩小版本：删除的清理，新增的加入优化"""
+        if collection != self.collection or changes is None:
+            return
+        try:
+            for op, name in changes:
+                if op == 'remove':
+                    self.remove(name)
+                else:
+                    self.schedule(name)
+        except Exception as e:
+            logging.warning(f'同步图片缩小版本失败: {e}')
+
+    def run_job(self, context):
+        filename = context.payload['name']
+        source = self.locate(filename)
+        if source is None:
+            return {'skipped': '原图已不存在'}
+        try:
+            saved = self.optimize_original(filename, source)
+            rendition = self.make_rendition(filename, source)
+        except Exception:
+            self._count(failed=1)
+            raise
+        if saved and self.on_replaced:
+            self.on_replaced(filename)
+        if saved or rendition:
+            collection_versions.bump(self.collection, [('update', filename)])
+        result = {'bytes_saved': saved, 'size': os.path.getsize(source)}
+        if rendition:
+            result.update(rendition)
+        elif Image is None:
+            result['rendition'] = '未安装Pillow，未生成缩小版本'
+        return result
+
+    def optimize_original(self, filename, source):
+        """无损重新压缩原图，变小时原子替换并保留修改时间，返回节省的字节数"""
+        strip = bool(config.get('image_strip_metadata', False))
+        ext = self.extension(filename)
+        before = os.stat(source)
+        tmp = f'{source}.{os.getpid()}.tmp'
+        try:
+            if ext in ('jpg', 'jpeg'):
+                jpegtran = self.jpegtran
+                if jpegtran is None:
+                    return 0
+                # 去除元数据会丢掉EXIF方向，方向不是默认值的照片保留元数据，以免显示时转向
+                if strip and self.orientation(source) not in (None, 1):
+                    strip = False
+                self.run_jpegtran(jpegtran, source, tmp, strip)
+            elif self.png_optimizer is not None:
+                if not self.run_png_optimizer(self.png_optimizer, source, tmp, strip):
+                    return 0
+            elif Image is not None:
+                if not self.save_png(source, tmp, strip):
+                    return 0
+                # Pillow不是专门的无损优化工具，结果与原图逐项核对，不一致时保留原图
+                if not self.same_png(source, tmp, strip):
+                    logging.warning(f'PNG重新保存后与原图不一致，保留原图: {filename}')
+                    self._count(rejected=1)
+                    return 0
+            else:
+                return 0
+            saved = before.st_size - os.path.getsize(tmp)
+            if saved < MIN_SAVING:
+                return 0
+            # 优化期间原图被重新上传或修改时放弃本次结果
+            current = os.stat(source)
+            if (current.st_mtime_ns, current.st_size) != (before.st_mtime_ns, before.st_size):
+                return 0
+            os.utime(tmp, ns=(before.st_atime_ns, before.st_mtime_ns))
+            os.replace(tmp, source)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self._count(optimized=1, bytes_saved=saved)
+        return saved
+
+    @staticmethod
+    def run_jpegtran(jpegtran, source, target, strip):
+        """去除元数据时保留ICC色彩配置（libjpeg-turbo 2.1起支持-copy icc），旧版本不支持时全部去除"""
+        copies = ['icc', 'none'] if strip else ['all']
+        for copy in copies:
+            result = subprocess.run(jpegtran_command(jpegtran, source, target, copy), capture_output=True, timeout=300)
+            if result.returncode == 0:
+                return
+        raise RuntimeError('jpegtran失败: ' + result.stderr.decode('utf-8', errors='ignore').strip()[-200:])
+
+    @staticmethod
+    def run_png_optimizer(optimizer, source, target, strip):
+        """用oxipng/optipng无损优化，返回是否生成了结果"""
+        kind, tool = optimizer
+        result = subprocess.run(png_optimizer_command(kind, tool, source, target, strip), capture_output=True, timeout=600)
+        if result.returncode != 0:
+            raise RuntimeError(f'{kind}失败: ' + result.stderr.decode('utf-8', errors='ignore').strip()[-200:])
+        # 无法再压缩时部分版本不写出结果
+        return os.path.exists(target)
+
+    @staticmethod
+    def orientation(source):
+        if Image is None:
+            # 无法读取方向时按非默认方向处理，不去除元数据
+            return 0
+        with Image.open(source) as img:
+            return img.getexif().get(EXIF_ORIENTATION)
+
+    @staticmethod
+    def save_png(source, target, strip):
+        """
+        用Pillow以最高压缩重新保存PNG；16位、动画PNG和含Pillow无法保留的数据块的PNG不处理，返回是否已保存。
+        保存后须再用same_png核对
+        """
+        header, chunks = png_header(source)
+        if header is None or header[0] > 8 or not chunks <= PILLOW_PNG_CHUNKS:
+            return False
+        with Image.open(source) as img:
+            if getattr(img, 'is_animated', False) or img.mode not in PILLOW_PNG_MODES:
+                return False
+            options = {'optimize': True}
+            if not strip:
+                if getattr(img, 'text', None):
+                    info = PngImagePlugin.PngInfo()
+                    for key, value in img.text.items():
+                        info.add_text(key, value)
+                    options['pnginfo'] = info
+                if img.info.get('icc_profile'):
+                    options['icc_profile'] = img.info['icc_profile']
+                if img.info.get('exif'):
+                    options['exif'] = img.info['exif']
+                if 'dpi' in img.info:
+                    options['dpi'] = img.info['dpi']
+            elif img.info.get('icc_profile'):
+                # 去除元数据时仍保留色彩配置，否则广色域图片颜色会变
+                options['icc_profile'] = img.info['icc_profile']
+            if 'transparency' in img.info:
+                options['transparency'] = img.info['transparency']
+            img.save(target, 'PNG', **options)
+        return True
+
+    @staticmethod
+    def same_png(source, target, strip):
+        """核对重新保存的PNG：位深和颜色类型相同、原有数据块都还在（去除元数据时除外）、解码后的像素完全相同"""
+        header, chunks = png_header(source)
+        new_header, new_chunks = png_header(target)
+        if header != new_header:
+            return False
+        expected = chunks - PNG_METADATA_CHUNKS if strip else chunks
+        # 文本块的压缩方式可能改变（tEXt/zTXt/iTXt），按是否有文本比较
+        text = {b'tEXt', b'zTXt', b'iTXt'}
+        if bool(expected & text) and not new_chunks & text:
+            return False
+        if not expected - text <= new_chunks:
+            return False
+        with Image.open(source) as a, Image.open(target) as b:
+            if a.mode != b.mode or a.size != b.size or a.info.get('transparency') != b.info.get('transparency'):
+                return False
+            if a.mode == 'P' and a.getpalette() != b.getpalette():
+                return False
+            return a.tobytes() == b.tobytes()
+
+    def make_rendition(self, filename, source):
+        """
+        生成缩小版本：按EXIF方向转正，长边不超过image_web_max_px，去除元数据。
+        比原图小不到10%时不保存。返回缩小版本信息，未生成时返回None
+        """
+        if Image is None:
+            return None
+        max_px = int(config.get('image_web_max_px', 2048))
+        quality = int(config.get('image_web_quality', 82))
+        with Image.open(source) as img:
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((max_px, max_px), Image.LANCZOS)
+            alpha = img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info)
+            target = ensure_shard(os.path.join(self.folder, RENDITION_DIR), filename) + ('.web.png' if alpha else '.web.jpg')
+            tmp = f'{target}.{os.getpid()}.tmp'
+            try:
+                if alpha:
+                    img.save(tmp, 'PNG', optimize=True)
+                else:
+                    img.convert('RGB').save(tmp, 'JPEG', quality=quality, optimize=True, progressive=True)
+                size = os.path.getsize(tmp)
+                original = os.path.getsize(source)
+                if size > original * MIN_RENDITION_RATIO:
+                    self.remove(filename)
+                    return None
+                self.remove(filename)
+                os.replace(tmp, target)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        self._count(renditions=1, rendition_bytes_saved=original - size)
+        return {'rendition': os.path.basename(target), 'rendition_size': size, 'width': img.width, 'height': img.height}
+
+    @staticmethod
+    def mimetype(rendition_path):
+        return 'image/png' if rendition_path.endswith('.png') else 'image/jpeg'
@@ -0,0 +1,339 @@
+# 后台任务队列：上传完成后较慢的处理（计算校验和、建立索引、探测媒体信息等）放到后台执行，上传接口立即返回
+# 任务保存在SQLite数据库中，服务重启后未完成的任务继续执行；多个工作进程共用同一个队列，由数据库事务保证每个任务只被领取一次
+# 支持优先级（数值大的先执行）、失败重试（指数退避）和相同任务去重（排队中或执行中的任务不会重复加入）
+# 可以限制某类任务同时执行的数量（如转码），达到上限时领取任务会跳过该类任务，工作线程不会空等
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from config import config
+
+DB_PATH = os.path.join(os.path.dirname(__file__), 'jobs.db')
+# 执行中的任务定期更新心跳时间（秒），超过STALE_SECONDS没有更新的视为所在进程已退出，重新排队
+HEARTBEAT_INTERVAL = 10
+STALE_SECONDS = 60
+# 重试等待时间的基数和上限（秒）
+RETRY_BASE_DELAY = 5
+RETRY_MAX_DELAY = 600
+# 空闲时检查新任务的间隔（秒），本进程加入的任务会立即唤醒工作线程
+POLL_INTERVAL = 2
+# 已结束任务的保留时间（秒）
+FINISHED_KEEP_SECONDS = 7 * 24 * 3600
+STATES = ('queued', 'running', 'done', 'failed', 'cancelled')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    dedup_key TEXT,
+    priority INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    run_after REAL NOT NULL DEFAULT 0,
+    progress REAL NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    error TEXT NOT NULL DEFAULT '',
+    result TEXT,
+    owner INTEGER,
+    heartbeat REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (state, priority DESC, run_after, id);
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_dedup ON jobs (dedup_key) WHERE dedup_key IS NOT NULL AND state IN ('queued', 'running');
+"""
+# 旧版本数据库补充的列
+MIGRATIONS = {
+    'owner': 'ALTER TABLE jobs ADD COLUMN owner INTEGER',
+    'heartbeat': 'ALTER TABLE jobs ADD COLUMN heartbeat REAL'
+}
+
+class JobContext:
+    """传给任务处理函数的上下文：任务参数、进度上报和取消检查"""
+
+    def __init__(self, queue, job_id, payload, attempt):
+        self.queue = queue
+        self.id = job_id
+        self.payload = payload
+        self.attempt = attempt
+
+    def progress(self, value):
+        """上报进度（0-1）"""
+        self.queue._execute('UPDATE jobs SET progress = ? WHERE id = ?', (min(max(float(value), 0.0), 1.0), self.id))
+
+    def cancelled(self):
+        row = self.queue._query('SELECT state FROM jobs WHERE id = ?', (self.id,))
+        return not row or row[0]['state'] == 'cancelled'
+
+class JobQueue:
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        self.handlers = {}  # 任务类型 -> (处理函数, 最大尝试次数)
+        self.limits = {}  # 任务类型 -> 同时执行数量上限（返回整数的函数）
+        self.local = threading.local()
+        self.wakeup = threading.Condition()
+        self.threads = []
+        self.maintainer = None
+        self.stopping = False
+        self.stats = {'completed': 0, 'failed': 0, 'retried': 0}
+        self._execute_script(SCHEMA)
+        columns = {row['name'] for row in self._query('PRAGMA table_info(jobs)')}
+        for column, sql in MIGRATIONS.items():
+            if column not in columns:
+                self._execute(sql)
+
+    def _connect(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def _execute_script(self, script):
+        self._connect().executescript(script)
+
+    def _execute(self, sql, params=()):
+        return self._connect().execute(sql, params)
+
+    def _query(self, sql, params=()):
+        return self._connect().execute(sql, params).fetchall()
+
+    def register(self, kind, handler, max_attempts=3, max_running=None):
+        """
+        注册任务类型。
+        handler: 接收JobContext，返回值（可JSON序列化）作为任务结果，抛出异常时按max_attempts重试
+        max_running: 所有进程合计同时执行的数量上限，整数或返回整数的函数（每次领取时读取，可随配置变化），None为不限
+        """
+        self.handlers[kind] = (handler, max_attempts)
+        if max_running is None:
+            self.limits.pop(kind, None)
+        else:
+            self.limits[kind] = max_running if callable(max_running) else (lambda: max_running)
+
+    def enqueue(self, kind, payload, priority=0, dedup_key=None, delay=0):
+        """
+        加入任务，返回任务号。dedup_key相同的任务在排队或执行中时不重复加入，直接返回已有任务的任务号。
+        """
+        if kind not in self.handlers:
+            raise ValueError(f'未注册的任务类型: {kind}')
+        max_attempts = self.handlers[kind][1]
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                'INSERT INTO jobs (kind, payload, dedup_key, priority, max_attempts, run_after, created) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (kind, json.dumps(payload, ensure_ascii=False), dedup_key, priority, max_attempts, time.time() + delay, time.time())
+            )
+            job_id = cursor.lastrowid
+        except sqlite3.IntegrityError:
+            rows = conn.execute("SELECT id FROM jobs WHERE dedup_key = ? AND state IN ('queued', 'running')", (dedup_key,)).fetchall()
+            if not rows:
+                # 已有任务恰好在此期间结束，重新加入
+                return self.enqueue(kind, payload, priority, dedup_key, delay)
+            return rows[0]['id']
+        with self.wakeup:
+            self.wakeup.notify()
+        return job_id
+
+    def _claim(self):
+        """
+        领取一个可执行的任务（优先级高的先，同优先级先入先出），没有时返回None。
+        执行中数量已达上限的任务类型本次不领取；计数与领取在同一个写事务中，多个进程同时领取也不会超过上限
+        """
+        conn = self._connect()
+        if not self.handlers:
+            return None
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            kinds = list(self.handlers)
+            if self.limits:
+                running = {row['kind']: row['n'] for row in conn.execute(
+                    "SELECT kind, COUNT(*) AS n FROM jobs WHERE state = 'running' GROUP BY kind").fetchall()}
+                kinds = [k for k in kinds if k not in self.limits or running.get(k, 0) < max(int(self.limits[k]()), 1)]
+            if not kinds:
+                conn.execute('COMMIT')
+                return None
+            placeholders = ','.join('?' * len(kinds))
+            rows = conn.execute(
+                f"SELECT * FROM jobs WHERE state = 'queued' AND run_after <= ? AND kind IN ({placeholders}) "
+                'ORDER BY priority DESC, run_after, id LIMIT 1', [now] + kinds
+            ).fetchall()
+            if not rows:
+                conn.execute('COMMIT')
+                return None
+            job = rows[0]
+            conn.execute("UPDATE jobs SET state = 'running', attempts = attempts + 1, started = ?, heartbeat = ?, owner = ?, progress = 0 "
+                         'WHERE id = ?', (now, now, os.getpid(), job['id']))
+            conn.execute('COMMIT')
+            return job
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _finish(self, job, ok, result=None, error=''):
+        """记录任务结果；任务已被重新排队（本进程退出时交还或心跳超时）并由其他进程领取时不覆盖"""
+        attempts = job['attempts'] + 1
+        owner = os.getpid()
+        if ok:
+            cursor = self._execute("UPDATE jobs SET state = 'done', progress = 1, finished = ?, result = ?, error = '' WHERE id = ? AND state = 'running' AND owner = ?",
+                                   (time.time(), json.dumps(result, ensure_ascii=False), job['id'], owner))
+            if cursor.rowcount:
+                self.stats['completed'] += 1
+        elif attempts < job['max_attempts']:
+            delay = min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+            cursor = self._execute("UPDATE jobs SET state = 'queued', run_after = ?, error = ? WHERE id = ? AND state = 'running' AND owner = ?",
+                                   (time.time() + delay, error, job['id'], owner))
+            if cursor.rowcount:
+                self.stats['retried'] += 1
+        else:
+            cursor = self._execute("UPDATE jobs SET state = 'failed', finished = ?, error = ? WHERE id = ? AND state = 'running' AND owner = ?",
+                                   (time.time(), error, job['id'], owner))
+            if cursor.rowcount:
+                self.stats['failed'] += 1
+
+    def run_one(self):
+        """领取并执行一个任务，没有可执行的任务时返回False"""
+        job = self._claim()
+        if job is None:
+            return False
+        handler = self.handlers[job['kind']][0]
+        context = JobContext(self, job['id'], json.loads(job['payload']), job['attempts'] + 1)
+        try:
+            result = handler(context)
+            self._finish(job, True, result)
+        except Exception as e:
+            logging.warning(f"后台任务失败 {job['kind']}#{job['id']}: {e}\n{traceback.format_exc()}")
+            self._finish(job, False, error=str(e) or type(e).__name__)
+        if job['kind'] in self.limits:
+            # 空出了名额，唤醒因达到上限而跳过该类任务的工作线程
+            with self.wakeup:
+                self.wakeup.notify()
+        return True
+
+    def _worker(self):
+        while not self.stopping:
+            try:
+                if self.run_one():
+                    continue
+            except Exception as e:
+                logging.warning(f'后台任务队列异常: {e}')
+            with self.wakeup:
+                self.wakeup.wait(POLL_INTERVAL)
+
+    def recover(self, startup=False):
+        """
+        重新排队所在进程已退出的执行中任务：心跳超时的，以及启动时记录为本进程领取的（重启后沿用了同一个pid，如容器中）。
+        已用完尝试次数的标记为失败，避免每次都让进程崩溃的任务无限重试
+        """
+        now = time.time()
+        stale = "state = 'running' AND (COALESCE(heartbeat, started) < ? OR owner = ?)"
+        params = (now - STALE_SECONDS, os.getpid() if startup else -1)
+        self._execute(f"UPDATE jobs SET state = 'failed', finished = ?, error = '执行任务的进程已退出' WHERE {stale} AND attempts >= max_attempts",
+                      (now,) + params)
+        cursor = self._execute(f"UPDATE jobs SET state = 'queued', run_after = ?, owner = NULL WHERE {stale}", (now,) + params)
+        if cursor.rowcount:
+            logging.info(f'重新排队{cursor.rowcount}个中断的后台任务')
+            with self.wakeup:
+                self.wakeup.notify_all()
+
+    def _maintain(self):
+        """定期更新本进程执行中任务的心跳，接管其他进程遗留的任务，清理过期的已结束任务"""
+        while not self.stopping:
+            try:
+                self._execute("UPDATE jobs SET heartbeat = ? WHERE state = 'running' AND owner = ?", (time.time(), os.getpid()))
+                self.recover()
+                self._execute("DELETE FROM jobs WHERE state IN ('done', 'failed', 'cancelled') AND finished < ?",
+                              (time.time() - FINISHED_KEEP_SECONDS,))
+            except Exception as e:
+                logging.warning(f'后台任务心跳更新失败: {e}')
+            time.sleep(HEARTBEAT_INTERVAL)
+
+    def release(self):
+        """
+        进程退出前停止领取新任务，并把本进程执行中的任务交还队列（不计入尝试次数），其他进程可以立即接手。
+        交还后本进程中仍在执行的处理函数结束时不再写入结果
+        """
+        self.stopping = True
+        if not self.threads:
+            return
+        cursor = self._execute("UPDATE jobs SET state = 'queued', run_after = ?, owner = NULL, attempts = MAX(attempts - 1, 0) "
+                               "WHERE state = 'running' AND owner = ?", (time.time(), os.getpid()))
+        if cursor.rowcount:
+            logging.info(f'退出前交还{cursor.rowcount}个执行中的后台任务')
+
+    def start(self):
+        """启动工作线程，数量由job_workers配置，0表示不在本进程执行任务"""
+        if self.maintainer is not None:
+            return
+        self.recover(startup=True)
+        # 正常退出时交还执行中的任务（多进程运行的工作进程由app.run_worker在退出前调用）
+        atexit.register(self.release)
+        self.maintainer = threading.Thread(target=self._maintain, name='job-heartbeat', daemon=True)
+        self.maintainer.start()
+        for i in range(int(config.get('job_workers', 2))):
+            thread = threading.Thread(target=self._worker, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def get(self, job_id):
+        rows = self._query('SELECT * FROM jobs WHERE id = ?', (job_id,))
+        return self._public(rows[0]) if rows else None
+
+    def list(self, state=None, kind=None, limit=100):
+        sql = 'SELECT * FROM jobs'
+        where, params = [], []
+        if state:
+            where.append('state = ?')
+            params.append(state)
+        if kind:
+            where.append('kind = ?')
+            params.append(kind)
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY id DESC LIMIT ?'
+        params.append(limit)
+        return [self._public(row) for row in self._query(sql, params)]
+
+    def counts(self):
+        """各状态的任务数及本进程的累计统计"""
+        counts = {state: 0 for state in STATES}
+        for row in self._query('SELECT state, COUNT(*) AS n FROM jobs GROUP BY state'):
+            counts[row['state']] = row['n']
+        return {'counts': counts, 'workers': len(self.threads), **self.stats}
+
+    def cancel(self, job_id):
+        """取消排队中的任务；执行中的任务标记为取消，由处理函数通过cancelled()检查后自行结束"""
+        cursor = self._execute("UPDATE jobs SET state = 'cancelled', finished = ? WHERE id = ? AND state IN ('queued', 'running')",
+                               (time.time(), job_id))
+        return cursor.rowcount > 0
+
+    def retry(self, job_id):
+        """重新执行失败或已取消的任务"""
+        try:
+            cursor = self._execute("UPDATE jobs SET state = 'queued', attempts = 0, run_after = ?, error = '', finished = NULL "
+                                   "WHERE id = ? AND state IN ('failed', 'cancelled')", (time.time(), job_id))
+        except sqlite3.IntegrityError:
+            # 相同的任务已经重新加入
+            return False
+        with self.wakeup:
+            self.wakeup.notify()
+        return cursor.rowcount > 0
+
+    @staticmethod
+    def _public(row):
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+# 全局任务队列实例，任务类型在各自模块中注册
+job_queue = JobQueue()
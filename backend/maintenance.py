@@ -0,0 +1,122 @@
+# 元数据维护：定期让 file_info.json / video_info.json 与磁盘上的实际文件保持一致
+# 删除已不存在文件的记录（保留数量清理、直接从目录中删除等留下的孤儿；删除接口已在删除文件时同步移除记录，这里只作兜底），收录直接放进目录的文件，并紧凑重写JSON
+import json
+import os
+import threading
+import time
+from config import config
+from shared_state import file_lock
+from versioning import collection_versions
+
+class MaintenanceArea:
+    """
+    一个需要维护元数据的存储区域。
+    list_names: 返回磁盘上现有文件的对外文件名集合
+    """
+
+    def __init__(self, name, folder, info_path, collection, list_names):
+        self.name = name
+        self.folder = folder
+        self.info_path = info_path
+        self.collection = collection
+        self.list_names = list_names
+
+def is_adoptable(filename):
+    """隐藏文件（如.gitkeep）和写入中的临时文件不收录"""
+    return not filename.startswith('.') and not filename.endswith('.tmp')
+
+class MetadataMaintenance:
+    def __init__(self):
+        self.areas = []
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stats = {
+            'runs': 0,
+            'last_run': None,
+            'last_duration_ms': None,
+            'orphans_removed': 0,
+            'adopted': 0,
+            'bytes_reclaimed': 0,
+            'areas': {}
+        }
+
+    def register(self, area):
+        self.areas.append(area)
+
+    def reconcile(self, area):
+        """
+        核对单个区域，返回本次结果。
+        记录文件不存在或无法解析时按空记录处理，并重新写出。
+        """
+        with file_lock(area.info_path):
+            before = os.path.getsize(area.info_path) if os.path.exists(area.info_path) else 0
+            try:
+                with open(area.info_path, 'r', encoding='utf-8') as f:
+                    info = json.load(f)
+                if not isinstance(info, dict):
+                    info = {}
+            except (FileNotFoundError, ValueError):
+                info = {}
+            on_disk = area.list_names()
+            orphans = [name for name in info if name not in on_disk]
+            adopted = sorted(name for name in on_disk if name not in info and is_adoptable(name))
+            for name in orphans:
+                del info[name]
+            for name in adopted:
+                # 来源未知，IP留空
+                info[name] = ''
+            data = json.dumps(info, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            # 内容有变化或原文件不是紧凑格式时才重写，先写临时文件再替换，读取方不会看到半截文件
+            if orphans or adopted or (len(data) != before and (before or info)):
+                tmp = f'{area.info_path}.{os.getpid()}.tmp'
+                with open(tmp, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp, area.info_path)
+        if adopted:
+            # 直接放进目录的文件从未出现在变更日志中，补记一次新增，增量同步的客户端才能看到
+            collection_versions.bump(area.collection, [('add', name) for name in adopted])
+        return {
+            'orphans_removed': len(orphans),
+            'adopted': len(adopted),
+            'entries': len(info),
+            'bytes_before': before,
+            'bytes_after': len(data),
+            'bytes_reclaimed': max(before - len(data), 0)
+        }
+
+    def run(self):
+        """核对所有区域并累计统计，返回本次各区域的结果"""
+        with self.lock:
+            start = time.perf_counter()
+            results = {}
+            for area in self.areas:
+                try:
+                    results[area.name] = self.reconcile(area)
+                except Exception as e:
+                    results[area.name] = {'error': str(e)}
+                    print(f'元数据维护失败 {area.name}: {e}')
+            stats = self.stats
+            for result in results.values():
+                stats['orphans_removed'] += result.get('orphans_removed', 0)
+                stats['adopted'] += result.get('adopted', 0)
+                stats['bytes_reclaimed'] += result.get('bytes_reclaimed', 0)
+            stats['runs'] += 1
+            stats['last_run'] = time.time()
+            stats['last_duration_ms'] = round((time.perf_counter() - start) * 1000, 2)
+            stats['areas'] = results
+            return results
+
+    def _run(self):
+        while True:
+            self.run()
+            time.sleep(config.get('maintenance_interval', 3600))
+
+    def start(self):
+        """按配置启动后台维护线程（maintenance_interval为0时不启动）"""
+        if self.thread is not None or config.get('maintenance_interval', 3600) <= 0:
+            return
+        self.thread = threading.Thread(target=self._run, name='metadata-maintenance', daemon=True)
+        self.thread.start()
+
+# 全局元数据维护实例，文件区和视频区在各自模块中注册
+metadata_maintenance = MetadataMaintenance()
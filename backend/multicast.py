@@ -0,0 +1,344 @@
+# 组播推送分发：同一个文件需要分发给局域网内大量客户端时，服务端只发送一遍UDP组播，
+# 每组数据块附带一个异或校验块（可恢复组内任意一个丢失的块），客户端收完后只对仍缺失的块用HTTP Range补齐。
+# 接收端见 multicast_receiver.py
+#
+# 数据包格式（整数均为大端）：
+#   头部: 魔数b'LSMC' + 类型(uint8) + 会话号(uint32) + 序号(uint32) + 数据长度(uint16)
+#   类型0 公告：数据为JSON，描述会话（文件名、大小、块大小、补齐下载地址、状态等）
+#   类型1 数据块：序号为块号，数据为文件中对应的一块
+#   类型2 校验块：序号为组号，数据为组内各块（不足块大小的补0）的异或
+import gzip
+import json
+import os
+import random
+import socket
+import struct
+import threading
+import time
+from urllib.parse import quote
+from config import config
+from cold_storage import gzip_logical_size
+from shared_state import file_lock
+
+MAGIC = b'LSMC'
+HEADER = struct.Struct('>4sBIIH')
+KIND_ANNOUNCE = 0
+KIND_DATA = 1
+KIND_PARITY = 2
+# 每块数据量：加上头部和IP/UDP头部后不超过以太网MTU（1500），避免IP分片
+BLOCK_SIZE = 1400
+# 同时进行的分发会话数
+MAX_SESSIONS = 4
+# 发送过程中公告的间隔（秒），中途加入的客户端据此得知会话信息
+ANNOUNCE_INTERVAL = 0.5
+# 结束公告重复发送的次数
+END_ANNOUNCES = 5
+# 已结束会话保留的条数（用于查询结果）
+FINISHED_KEEP = 20
+# 会话登记文件：多进程运行时各工作进程的会话都登记在这里，任一进程都能查看和停止
+REGISTRY_PATH = os.path.join(os.path.dirname(__file__), 'multicast_sessions.json')
+# 发送中的会话更新登记信息的间隔（秒），超过STALE_SECONDS未更新的视为所在进程已退出
+SYNC_INTERVAL = 1
+STALE_SECONDS = 10
+ACTIVE_STATES = ('pending', 'sending')
+
+def pack(kind, session_id, index, payload=b''):
+    return HEADER.pack(MAGIC, kind, session_id, index, len(payload)) + payload
+
+def unpack(packet):
+    """解析数据包，格式不正确时返回None"""
+    if len(packet) < HEADER.size:
+        return None
+    magic, kind, session_id, index, length = HEADER.unpack_from(packet)
+    if magic != MAGIC or len(packet) != HEADER.size + length:
+        return None
+    return kind, session_id, index, packet[HEADER.size:]
+
+def xor_blocks(blocks, size):
+    """按块大小（不足的补0）计算异或"""
+    acc = 0
+    for block in blocks:
+        acc ^= int.from_bytes(block.ljust(size, b'\0'), 'big')
+    return acc.to_bytes(size, 'big')
+
+def open_socket(ttl, interface=''):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+    # 本机的接收端也能收到，便于在同一台机器上测试
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+    if interface:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+    return sock
+
+class MulticastSession:
+    """
+    一次组播分发：按设定速率把文件发送passes遍，每fec_group个数据块后跟一个校验块。
+    opener: 打开文件返回可读的二进制文件对象（压缩存储的文件返回解压流）
+    """
+
+    def __init__(self, session_id, area, name, size, opener, repair_url, rate_mbps, passes, fec_group):
+        self.id = session_id
+        self.area = area
+        self.name = name
+        self.size = size
+        self.opener = opener
+        self.repair_url = repair_url
+        self.rate = max(rate_mbps, 1) * 1000 * 1000 / 8  # 字节/秒
+        self.passes = max(passes, 1)
+        self.fec_group = max(fec_group, 1)
+        self.blocks = (size + BLOCK_SIZE - 1) // BLOCK_SIZE
+        self.state = 'pending'
+        self.error = ''
+        self.current_pass = 0
+        self.sent_blocks = 0
+        self.sent_bytes = 0
+        self.started = None
+        self.finished = None
+        self.stop_event = threading.Event()
+        self.thread = None
+        # 发送过程中定期调用的回调（同步登记信息、检查其他进程发来的停止请求）
+        self.on_tick = None
+
+    def describe(self):
+        return {
+            'session': self.id,
+            'area': self.area,
+            'name': self.name,
+            'size': self.size,
+            'block_size': BLOCK_SIZE,
+            'blocks': self.blocks,
+            'fec_group': self.fec_group,
+            'repair_url': self.repair_url,
+            'state': self.state,
+            'pass': self.current_pass,
+            'passes': self.passes
+        }
+
+    def stats(self):
+        result = self.describe()
+        elapsed = ((self.finished or time.time()) - self.started) if self.started else 0
+        result.update(
+            error=self.error,
+            sent_blocks=self.sent_blocks,
+            sent_bytes=self.sent_bytes,
+            elapsed=round(elapsed, 3),
+            throughput_mbps=round(self.sent_bytes * 8 / elapsed / 1000 / 1000, 2) if elapsed else 0
+        )
+        return result
+
+    def _announce(self, sock, target):
+        sock.sendto(pack(KIND_ANNOUNCE, self.id, 0, json.dumps(self.describe(), ensure_ascii=False).encode('utf-8')), target)
+
+    def run(self, target, ttl, interface):
+        self.state = 'sending'
+        self.started = time.time()
+        sock = open_socket(ttl, interface)
+        try:
+            next_announce = 0
+            for self.current_pass in range(1, self.passes + 1):
+                with self.opener() as f:
+                    index = 0
+                    while index < self.blocks:
+                        group = []
+                        for _ in range(self.fec_group):
+                            if index >= self.blocks:
+                                break
+                            data = f.read(BLOCK_SIZE)
+                            if not data:
+                                raise IOError('文件在分发过程中被修改')
+                            group.append(data)
+                            self._send(sock, target, pack(KIND_DATA, self.id, index, data))
+                            index += 1
+                        self._send(sock, target, pack(KIND_PARITY, self.id, (index - 1) // self.fec_group,
+                                                      xor_blocks(group, BLOCK_SIZE)))
+                        if self.stop_event.is_set():
+                            self.state = 'stopped'
+                            return
+                        now = time.time()
+                        if self.on_tick:
+                            self.on_tick(self)
+                        if now >= next_announce:
+                            self._announce(sock, target)
+                            next_announce = now + ANNOUNCE_INTERVAL
+            self.state = 'done'
+        except Exception as e:
+            self.state = 'failed'
+            self.error = str(e)
+        finally:
+            self.finished = time.time()
+            if self.on_tick:
+                self.on_tick(self, force=True)
+            # 结束公告：接收端据此停止等待，开始补齐缺失的块
+            try:
+                for _ in range(END_ANNOUNCES):
+                    self._announce(sock, target)
+                    time.sleep(0.02)
+            finally:
+                sock.close()
+
+    def _send(self, sock, target, packet):
+        # 按设定速率发送：超前时等待，避免交换机和接收端缓冲区溢出
+        sock.sendto(packet, target)
+        self.sent_bytes += len(packet)
+        self.sent_blocks += 1
+        ahead = self.started + self.sent_bytes / self.rate - time.time()
+        if ahead > 0:
+            time.sleep(ahead)
+
+class MulticastDistributor:
+    """
+    管理组播分发会话。各存储区域在自己的模块中注册查找函数：
+    locate(文件名) -> (路径, 是否压缩存储)，文件不存在时路径为None
+    会话在启动它的进程中发送，同时登记在共享文件中：查看、停止请求落到其他工作进程时也能找到，
+    停止请求由发送会话的进程在下次同步时执行
+    """
+
+    def __init__(self, registry_path=REGISTRY_PATH):
+        self.lock = threading.Lock()
+        self.areas = {}
+        self.sessions = {}
+        self.registry_path = registry_path
+
+    def register(self, area, locate, download_prefix):
+        self.areas[area] = (locate, download_prefix)
+
+    @property
+    def target(self):
+        return (config.get('multicast_group', '239.255.42.99'), int(config.get('multicast_port', 5007)))
+
+    def _load(self):
+        try:
+            with open(self.registry_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _update(self, modify):
+        """在跨进程锁内读取、修改并写回会话登记，返回modify的返回值"""
+        with file_lock(self.registry_path):
+            registry = self._load()
+            result = modify(registry)
+            tmp = f'{self.registry_path}.{os.getpid()}.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(registry, f, ensure_ascii=False)
+            os.replace(tmp, self.registry_path)
+            return result
+
+    @staticmethod
+    def _active(entry, now):
+        return entry['state'] in ACTIVE_STATES and now - entry['updated'] <= STALE_SECONDS
+
+    @staticmethod
+    def _entry(session, stop=False):
+        return dict(session.stats(), pid=os.getpid(), started=session.started, updated=time.time(), stop=stop)
+
+    def _sync(self, session, force=False):
+        """把本进程会话的进度写入登记，并检查是否有其他进程发来的停止请求"""
+        now = time.time()
+        if not force and now - getattr(session, 'synced', 0) < SYNC_INTERVAL:
+            return
+        session.synced = now
+        def modify(registry):
+            entry = registry.get(str(session.id))
+            stop = bool(entry and entry.get('stop'))
+            registry[str(session.id)] = self._entry(session, stop)
+            return stop
+        try:
+            if self._update(modify):
+                session.stop_event.set()
+        except Exception:
+            # 登记失败不影响发送
+            pass
+
+    def start(self, area, name, base_url, rate_mbps=None, passes=1):
+        """
+        开始分发一个文件，返回会话信息。
+        base_url: 客户端补齐缺失块时访问的服务地址（如 http://192.168.1.10:5000）
+        文件不存在时抛出FileNotFoundError，区域不存在或会话数已满时抛出ValueError
+        """
+        if area not in self.areas:
+            raise ValueError('不支持的区域')
+        locate, prefix = self.areas[area]
+        path, compressed = locate(name)
+        if path is None:
+            raise FileNotFoundError(name)
+        if compressed:
+            size = gzip_logical_size(path)
+            opener = lambda: gzip.open(path, 'rb')
+        else:
+            size = os.path.getsize(path)
+            opener = lambda: open(path, 'rb')
+
+        def modify(registry):
+            # 会话数上限对所有工作进程合计，它们共用同一个网络
+            now = time.time()
+            if sum(1 for entry in registry.values() if self._active(entry, now)) >= MAX_SESSIONS:
+                raise ValueError(f'最多同时进行{MAX_SESSIONS}个组播分发')
+            session_id = random.getrandbits(32)
+            while str(session_id) in registry:
+                session_id = random.getrandbits(32)
+            session = MulticastSession(
+                session_id, area, name, size, opener,
+                base_url.rstrip('/') + prefix + quote(name),
+                rate_mbps or config.get('multicast_rate_mbps', 200), passes,
+                int(config.get('multicast_fec_group', 8))
+            )
+            registry[str(session_id)] = self._entry(session)
+            self._prune(registry, now)
+            return session
+
+        with self.lock:
+            session = self._update(modify)
+            session.on_tick = self._sync
+            self.sessions[session.id] = session
+            finished = [s for s in self.sessions.values() if s.state not in ACTIVE_STATES]
+            for old in sorted(finished, key=lambda s: s.finished or 0)[:-FINISHED_KEEP or None]:
+                del self.sessions[old.id]
+        session.thread = threading.Thread(
+            target=session.run,
+            args=(self.target, int(config.get('multicast_ttl', 1)), config.get('multicast_interface', '')),
+            daemon=True
+        )
+        session.thread.start()
+        return session.describe()
+
+    def _prune(self, registry, now):
+        # 所在进程已退出的会话也按已结束处理
+        finished = [key for key, entry in registry.items() if not self._active(entry, now)]
+        for key in sorted(finished, key=lambda k: registry[k].get('updated', 0))[:-FINISHED_KEEP or None]:
+            del registry[key]
+
+    def stop(self, session_id):
+        """停止会话（可以是其他工作进程中的会话），会话不存在时返回False"""
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session.stop_event.set()
+            return True
+        def modify(registry):
+            entry = registry.get(str(session_id))
+            if entry is None:
+                return False
+            if entry['state'] in ACTIVE_STATES:
+                entry['stop'] = True
+            return True
+        return self._update(modify)
+
+    def list(self):
+        group, port = self.target
+        now = time.time()
+        sessions = {}  # 会话号 -> (开始时间, 会话信息)
+        for key, entry in self._load().items():
+            if entry['state'] in ACTIVE_STATES and not self._active(entry, now):
+                entry = dict(entry, state='failed', error='发送会话的进程已退出')
+            sessions[int(key)] = (entry['started'] or 0, {k: v for k, v in entry.items() if k not in ('pid', 'started', 'updated', 'stop')})
+        # 本进程的会话用最新的进度
+        for session in list(self.sessions.values()):
+            sessions[session.id] = (session.started or 0, session.stats())
+        return {
+            'group': group,
+            'port': port,
+            'sessions': [stats for _, stats in sorted(sessions.values(), key=lambda item: item[0], reverse=True)]
+        }
+
+# 全局组播分发实例，文件区和视频区在各自模块中注册
+multicast_distributor = MulticastDistributor()
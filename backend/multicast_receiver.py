@@ -0,0 +1,231 @@
+# 组播分发接收端（命令行）：加入组播组接收服务端推送的文件，用校验块恢复丢失的块，
+# 最后只对仍缺失的块通过HTTP Range向服务端补齐。只依赖Python标准库，可单独复制到客户端使用。
+#
+# 用法:
+#   python multicast_receiver.py                           # 接收第一个公告的文件，保存到当前目录
+#   python multicast_receiver.py --name 培训.mp4 --out D:\下载
+#   python multicast_receiver.py --interface 192.168.1.23   # 多网卡时指定加入组播组的网卡
+#
+# 数据包格式与 multicast.py 一致
+import argparse
+import json
+import os
+import random
+import socket
+import struct
+import sys
+import time
+import urllib.request
+
+MAGIC = b'LSMC'
+HEADER = struct.Struct('>4sBIIH')
+KIND_ANNOUNCE = 0
+KIND_DATA = 1
+KIND_PARITY = 2
+# 补齐时合并相邻缺失区间，间隔不超过该块数的区间合并成一个Range请求
+MERGE_GAP_BLOCKS = 4
+# 单个Range请求的最大块数
+MAX_RANGE_BLOCKS = 4096
+
+def xor_blocks(blocks, size):
+    acc = 0
+    for block in blocks:
+        acc ^= int.from_bytes(block.ljust(size, b'\0'), 'big')
+    return acc.to_bytes(size, 'big')
+
+def open_socket(group, port, interface):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    # 加大接收缓冲区，减少突发时的丢包
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+    sock.bind(('', port))
+    membership = socket.inet_aton(group) + socket.inet_aton(interface or '0.0.0.0')
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+    return sock
+
+class Receiver:
+    def __init__(self, session, out_path):
+        self.session = session
+        self.block_size = session['block_size']
+        self.blocks = session['blocks']
+        self.size = session['size']
+        self.fec_group = session['fec_group']
+        self.received = bytearray(self.blocks)
+        self.remaining = self.blocks
+        # 校验块只保留收到时组内还有缺失的
+        self.parity = {}
+        self.stats = {'multicast_blocks': 0, 'duplicate_blocks': 0, 'fec_recovered': 0, 'http_blocks': 0, 'http_bytes': 0}
+        self.out = open(out_path, 'w+b')
+        self.out.truncate(self.size)
+
+    def block_length(self, index):
+        return min(self.block_size, self.size - index * self.block_size)
+
+    def group_range(self, group):
+        start = group * self.fec_group
+        return range(start, min(start + self.fec_group, self.blocks))
+
+    def write_block(self, index, data):
+        self.out.seek(index * self.block_size)
+        self.out.write(data[:self.block_length(index)])
+        self.received[index] = 1
+        self.remaining -= 1
+
+    def on_data(self, index, data):
+        if index >= self.blocks or len(data) != self.block_length(index):
+            return
+        if self.received[index]:
+            self.stats['duplicate_blocks'] += 1
+            return
+        self.write_block(index, data)
+        self.stats['multicast_blocks'] += 1
+
+    def on_parity(self, group, data):
+        if group * self.fec_group >= self.blocks or len(data) != self.block_size:
+            return
+        if any(not self.received[i] for i in self.group_range(group)):
+            self.parity[group] = data
+            # 校验块在组内数据块之后发送，此时只缺一块就可以立即恢复
+            self.recover(group)
+
+    def recover(self, group):
+        """组内恰好缺一块且有校验块时，由校验块和其余各块异或得到缺失的块"""
+        missing = [i for i in self.group_range(group) if not self.received[i]]
+        if len(missing) != 1 or group not in self.parity:
+            return
+        others = []
+        for i in self.group_range(group):
+            if i != missing[0]:
+                self.out.seek(i * self.block_size)
+                others.append(self.out.read(self.block_length(i)))
+        self.write_block(missing[0], xor_blocks(others + [self.parity.pop(group)], self.block_size))
+        self.stats['fec_recovered'] += 1
+
+    def missing_ranges(self):
+        """把缺失的块合并成[起始块, 结束块)区间"""
+        ranges = []
+        for index in (i for i in range(self.blocks) if not self.received[i]):
+            if ranges and index - ranges[-1][1] <= MERGE_GAP_BLOCKS and index - ranges[-1][0] < MAX_RANGE_BLOCKS:
+                ranges[-1][1] = index + 1
+            else:
+                ranges.append([index, index + 1])
+        return ranges
+
+    def repair(self, url):
+        """用HTTP Range补齐缺失的块；服务端不支持Range时读取整个响应并跳到需要的位置"""
+        for first, last in self.missing_ranges():
+            start = first * self.block_size
+            end = min(last * self.block_size, self.size) - 1
+            request = urllib.request.Request(url, headers={'Range': f'bytes={start}-{end}'})
+            with urllib.request.urlopen(request, timeout=60) as response:
+                offset = start if response.status == 206 else 0
+                while offset <= end:
+                    data = response.read(min(1024 * 1024, end + 1 - offset))
+                    if not data:
+                        raise IOError('补齐下载提前结束')
+                    if offset + len(data) > start:
+                        skip = max(start - offset, 0)
+                        self.out.seek(offset + skip)
+                        self.out.write(data[skip:])
+                    offset += len(data)
+            for index in range(first, last):
+                if not self.received[index]:
+                    self.received[index] = 1
+                    self.remaining -= 1
+                    self.stats['http_blocks'] += 1
+            self.stats['http_bytes'] += end + 1 - start
+
+    def close(self):
+        self.out.close()
+
+def wait_announce(sock, name, timeout):
+    """等待指定文件（未指定时为第一个）的公告，只接受仍在发送中的会话"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        sock.settimeout(max(deadline - time.time(), 0.01))
+        try:
+            packet, _ = sock.recvfrom(65535)
+        except socket.timeout:
+            break
+        if len(packet) < HEADER.size:
+            continue
+        magic, kind, _, _, length = HEADER.unpack_from(packet)
+        if magic != MAGIC or kind != KIND_ANNOUNCE:
+            continue
+        session = json.loads(packet[HEADER.size:HEADER.size + length].decode('utf-8'))
+        if session['state'] == 'sending' and (not name or session['name'] == name):
+            return session
+    return None
+
+def receive(sock, receiver, idle_timeout, loss=0.0):
+    """接收直到收齐、收到结束公告或长时间没有数据；loss为模拟丢包率，用于测试"""
+    session_id = receiver.session['session']
+    sock.settimeout(idle_timeout)
+    while receiver.remaining > 0:
+        try:
+            packet, _ = sock.recvfrom(65535)
+        except socket.timeout:
+            break
+        if len(packet) < HEADER.size:
+            continue
+        magic, kind, sid, index, length = HEADER.unpack_from(packet)
+        if magic != MAGIC or sid != session_id or len(packet) != HEADER.size + length:
+            continue
+        payload = packet[HEADER.size:]
+        if kind == KIND_ANNOUNCE:
+            if json.loads(payload.decode('utf-8'))['state'] != 'sending':
+                break
+        elif loss and random.random() < loss:
+            continue
+        elif kind == KIND_DATA:
+            receiver.on_data(index, payload)
+        elif kind == KIND_PARITY:
+            receiver.on_parity(index, payload)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='接收组播分发的文件，缺失部分通过HTTP补齐')
+    parser.add_argument('--group', default='239.255.42.99', help='组播地址（与服务端multicast_group一致）')
+    parser.add_argument('--port', type=int, default=5007, help='组播端口（与服务端multicast_port一致）')
+    parser.add_argument('--interface', default='', help='加入组播组的本机网卡IP，默认由系统选择')
+    parser.add_argument('--name', default='', help='只接收指定文件名，默认接收第一个公告的文件')
+    parser.add_argument('--out', default='.', help='保存目录')
+    parser.add_argument('--wait', type=float, default=600, help='等待公告的最长时间（秒）')
+    parser.add_argument('--idle-timeout', type=float, default=5, help='多久收不到数据视为发送结束（秒）')
+    parser.add_argument('--server', default='', help='补齐下载使用的服务地址，默认使用公告中的地址')
+    parser.add_argument('--simulate-loss', type=float, default=0.0, help='模拟丢包率（0-1），用于测试')
+    args = parser.parse_args(argv)
+
+    sock = open_socket(args.group, args.port, args.interface)
+    print(f'等待组播公告 {args.group}:{args.port} ...')
+    session = wait_announce(sock, args.name, args.wait)
+    if session is None:
+        print('没有收到公告')
+        return 1
+    name = os.path.basename(session['name'])
+    out_path = os.path.join(args.out, name)
+    print(f"接收 {name}（{session['size']} 字节，第{session['pass']}/{session['passes']}遍）")
+
+    started = time.time()
+    receiver = Receiver(session, out_path + '.part')
+    try:
+        receive(sock, receiver, args.idle_timeout, args.simulate_loss)
+        sock.close()
+        for group in list(receiver.parity):
+            receiver.recover(group)
+        if receiver.remaining:
+            url = session['repair_url']
+            if args.server:
+                url = args.server.rstrip('/') + url[url.index('/api/'):]
+            print(f'组播缺失 {receiver.remaining} 块，通过HTTP补齐 ...')
+            receiver.repair(url)
+    finally:
+        receiver.close()
+    os.replace(out_path + '.part', out_path)
+    stats = receiver.stats
+    print(f"完成: {out_path}，耗时 {time.time() - started:.1f}s；组播 {stats['multicast_blocks']} 块，"
+          f"校验恢复 {stats['fec_recovered']} 块，HTTP补齐 {stats['http_blocks']} 块（{stats['http_bytes']} 字节）")
+    print(json.dumps(stats))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,67 @@
+# 反向代理文件发送卸载：Python只做存在性检查并返回内部重定向头，由nginx/Apache用sendfile发送文件内容
+# offload_mode为x-accel-redirect（nginx）或x-sendfile（Apache mod_xsendfile、lighttpd）时启用
+import mimetypes
+import os
+import unicodedata
+from urllib.parse import quote
+from flask import current_app, send_file
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from config import config
+
+MODE_ACCEL = 'x-accel-redirect'
+MODE_SENDFILE = 'x-sendfile'
+
+def offload_mode():
+    return (config.get('offload_mode', '') or '').lower()
+
+def quoted_string(value):
+    """HTTP头中的带引号字符串，转义其中的反斜杠和双引号"""
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def content_disposition(filename, as_attachment):
+    """生成Content-Disposition，非ASCII文件名按RFC 5987编码"""
+    value = 'attachment' if as_attachment else 'inline'
+    try:
+        filename.encode('ascii')
+        return f'{value}; filename={quoted_string(filename)}'
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+        quoted = quote(filename, safe="!#$&+-.^_`|~")
+        return f"{value}; filename={quoted_string(simple)}; filename*=UTF-8''{quoted}"
+
+def offload_response(area, folder, file_path, download_name, as_attachment, mimetype=None):
+    """
+    生成交给反向代理发送文件的响应，未启用卸载时返回None。
+    area: 存储区域（uploads/videos），对应offload_locations中的nginx内部location前缀
+    """
+    mode = offload_mode()
+    if mode not in (MODE_ACCEL, MODE_SENDFILE):
+        return None
+    if mimetype is None:
+        mimetype = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+    response = current_app.response_class(None, mimetype=mimetype, direct_passthrough=True)
+    response.headers['Content-Disposition'] = content_disposition(download_name, as_attachment)
+    if mode == MODE_ACCEL:
+        locations = config.get('offload_locations', {})
+        prefix = locations.get(area, f'/_protected/{area}/')
+        relative = os.path.relpath(file_path, folder).replace(os.sep, '/')
+        response.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(relative)
+        # 大文件不经nginx缓冲，直接从磁盘发送
+        response.headers['X-Accel-Buffering'] = 'no'
+    else:
+        # 响应头只能是latin-1，路径按URL编码（mod_xsendfile默认XSendFileUnescape On，会先解码再打开文件）
+        response.headers['X-Sendfile'] = quote(os.path.abspath(file_path))
+    return response
+
+def send_local(path_or_file, **kwargs):
+    """
+    未启用卸载时由Flask发送文件（参数同send_file）。
+    完整响应也声明Accept-Ranges，客户端据此判断可以分段并行下载；Range超出文件大小时返回416而不是500
+    """
+    try:
+        response = send_file(path_or_file, **kwargs)
+    except RequestedRangeNotSatisfiable as e:
+        return e.get_response()
+    if response.status_code == 200:
+        response.headers['Accept-Ranges'] = 'bytes'
+    return response
@@ -0,0 +1,322 @@
+# 下载热度统计与热点文件预读
+# 每个文件保存最近48小时的逐小时访问次数（环形缓冲区，按小时序号取模存放），加上累计次数和最后访问时间；
+# 请求中只在内存里计数，后台定期把增量合并写入SQLite，多个工作进程共用同一份统计；
+# 请求中读取统计（按热度排序等）只读数据库并加上本进程尚未写入的计数，不在请求中写库。
+# 热度分数为各小时访问次数按时间衰减（半衰期6小时）后的和，列表可按热度排序；
+# 预读线程定期让操作系统把当前最热的文件读入页缓存（posix_fadvise WILLNEED），热度下降后再释放（DONTNEED）
+import array
+import logging
+import os
+import sqlite3
+import threading
+import time
+from config import config
+from versioning import collection_versions
+
+DB_PATH = os.path.join(os.path.dirname(__file__), 'popularity.db')
+HOURS = 48
+HALF_LIFE_HOURS = 6
+# 热度分数缓存时间（秒），列表按热度排序时不必每次读库
+SCORE_TTL = 5
+# 分数低于该值的文件不预读（约等于最近几小时内只访问过一次）
+PREFETCH_MIN_SCORE = 1.0
+# 已预读的文件超过该时间后重新预读一次（秒），页缓存可能已被挤出
+REWARM_SECONDS = 600
+READ_CHUNK = 1024 * 1024
+
+def current_hour(now=None):
+    return int((now or time.time()) // 3600)
+
+def rotate(buckets, base_hour, hour):
+    """把环形缓冲区推进到hour，清零期间经过的小时"""
+    if hour <= base_hour:
+        return
+    for h in range(max(base_hour + 1, hour - HOURS + 1), hour + 1):
+        buckets[h % HOURS] = 0
+
+def hourly(buckets, base_hour, hour, count=HOURS):
+    """最近count小时的访问次数，从早到晚"""
+    return [buckets[h % HOURS] if base_hour - HOURS < h <= base_hour else 0
+            for h in range(hour - count + 1, hour + 1)]
+
+def merge_counts(buckets, base_hour, total, counts, hour):
+    """把{小时序号: 次数}合并进环形缓冲区，返回新的(base_hour, total)"""
+    rotate(buckets, base_hour, hour)
+    base_hour = max(base_hour, hour)
+    for h, n in counts.items():
+        if base_hour - HOURS < h <= base_hour:
+            buckets[h % HOURS] += n
+        total += n
+    return base_hour, total
+
+def score_of(buckets, base_hour, hour):
+    return sum(c * 0.5 ** ((hour - h) / HALF_LIFE_HOURS)
+               for h, c in zip(range(hour - HOURS + 1, hour + 1), hourly(buckets, base_hour, hour)) if c)
+
+def counts_request(range_header, method='GET'):
+    """
+    播放器拖动、分段下载会发出多个Range请求，只有从头开始的请求计为一次访问；
+    分段下载前探测大小的HEAD请求不计
+    """
+    if method == 'HEAD':
+        return False
+    return not range_header or range_header.replace(' ', '').startswith('bytes=0-')
+
+class PopularityTracker:
+    """
+    各存储区域在自己的模块中注册：
+    register(区域名, 集合名, locate)，locate(文件名) -> (路径, 是否压缩存储)，文件不存在时路径为None
+    """
+
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.pending = {}  # (区域, 文件名) -> {小时序号: 次数}
+        self.areas = {}
+        self.collections = {}
+        self.score_cache = {}  # 区域 -> (时间, {文件名: 分数})
+        self.thread = None
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS popularity (area TEXT NOT NULL, name TEXT NOT NULL, base_hour INTEGER NOT NULL, '
+            'buckets BLOB NOT NULL, total INTEGER NOT NULL, last_access REAL NOT NULL, PRIMARY KEY (area, name))'
+        )
+
+    def _connect(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def register(self, area, collection, locate):
+        self.areas[area] = locate
+        self.collections[collection] = area
+
+    def record(self, area, name, range_header=None, method='GET'):
+        """记录一次访问（只在内存中计数）"""
+        if not counts_request(range_header, method):
+            return
+        hour = current_hour()
+        with self.lock:
+            counts = self.pending.setdefault((area, name), {})
+            counts[hour] = counts.get(hour, 0) + 1
+
+    def flush(self):
+        """把内存中的计数合并写入数据库"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        conn = self._connect()
+        now = time.time()
+        hour = current_hour(now)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for (area, name), counts in pending.items():
+                row = conn.execute('SELECT base_hour, buckets, total FROM popularity WHERE area = ? AND name = ?',
+                                   (area, name)).fetchone()
+                buckets = array.array('I', bytes(4 * HOURS))
+                base_hour, total = hour, 0
+                if row:
+                    buckets = array.array('I', row[1])
+                    base_hour, total = row[0], row[2]
+                base_hour, total = merge_counts(buckets, base_hour, total, counts, hour)
+                conn.execute('INSERT OR REPLACE INTO popularity VALUES (?, ?, ?, ?, ?, ?)',
+                             (area, name, base_hour, buckets.tobytes(), total, now))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            with self.lock:
+                for key, counts in pending.items():
+                    merged = self.pending.setdefault(key, {})
+                    for h, n in counts.items():
+                        merged[h] = merged.get(h, 0) + n
+            raise
+        self.score_cache.clear()
+
+    def _rows(self, area=None):
+        sql = 'SELECT area, name, base_hour, buckets, total, last_access FROM popularity'
+        if area:
+            return self._connect().execute(sql + ' WHERE area = ?', (area,)).fetchall()
+        return self._connect().execute(sql).fetchall()
+
+    def _current(self, area=None):
+        """
+        数据库中的统计加上本进程尚未写入的计数（只读，不等待其他进程的写事务），
+        返回[(区域, 文件名, base_hour, 缓冲区, 累计次数, 最后访问时间)]
+        """
+        with self.lock:
+            pending = {key: dict(counts) for key, counts in self.pending.items() if area is None or key[0] == area}
+        now = time.time()
+        hour = current_hour(now)
+        rows = {}
+        for row_area, name, base_hour, blob, total, last_access in self._rows(area):
+            rows[(row_area, name)] = (base_hour, array.array('I', blob), total, last_access)
+        for key, counts in pending.items():
+            base_hour, buckets, total, _ = rows.get(key, (hour, array.array('I', bytes(4 * HOURS)), 0, now))
+            base_hour, total = merge_counts(buckets, base_hour, total, counts, hour)
+            rows[key] = (base_hour, buckets, total, now)
+        return [key + value for key, value in rows.items()]
+
+    def scores(self, area):
+        """区域内各文件的热度分数，没有访问记录的文件不在其中"""
+        cached = self.score_cache.get(area)
+        if cached and time.time() - cached[0] < SCORE_TTL:
+            return cached[1]
+        hour = current_hour()
+        result = {}
+        for _, name, base_hour, buckets, _, _ in self._current(area):
+            score = score_of(buckets, base_hour, hour)
+            if score > 0:
+                result[name] = round(score, 3)
+        self.score_cache[area] = (time.time(), result)
+        return result
+
+    def top(self, area=None, limit=50):
+        """按热度从高到低返回文件的访问统计"""
+        hour = current_hour()
+        items = []
+        for row_area, name, base_hour, buckets, total, last_access in self._current(area):
+            last_24h = hourly(buckets, base_hour, hour, 24)
+            items.append({
+                'area': row_area,
+                'name': name,
+                'score': round(score_of(buckets, base_hour, hour), 3),
+                'last_24h': sum(last_24h),
+                'hourly': last_24h,
+                'total': total,
+                'last_access': last_access
+            })
+        items.sort(key=lambda item: (-item['score'], -item['last_access']))
+        return items[:limit]
+
+    def on_change(self, collection, changes):
+        """文件删除后清除其统计，重新上传的同名文件从零开始"""
+        area = self.collections.get(collection)
+        if area is None or not changes:
+            return
+        removed = [name for op, name in changes if op == 'remove']
+        if not removed:
+            return
+        try:
+            with self.lock:
+                for name in removed:
+                    self.pending.pop((area, name), None)
+            self._connect().executemany('DELETE FROM popularity WHERE area = ? AND name = ?', [(area, n) for n in removed])
+            self.score_cache.pop(area, None)
+        except Exception as e:
+            logging.warning(f'清除热度统计失败: {e}')
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(max(int(config.get('popularity_flush_interval', 30)), 1))
+            try:
+                self.flush()
+            except Exception as e:
+                logging.warning(f'写入热度统计失败: {e}')
+
+class PagePrefetcher:
+    """定期把最热的文件预读到操作系统页缓存，不再热门的已预读文件通知系统可以释放"""
+
+    def __init__(self, tracker):
+        self.tracker = tracker
+        self.thread = None
+        self.warmed = {}  # 路径 -> (修改时间, 预读时间)
+        self.stats = {'runs': 0, 'warmed_files': 0, 'warmed_bytes': 0, 'released_files': 0, 'last_run': None,
+                      'method': 'fadvise' if hasattr(os, 'posix_fadvise') else 'read'}
+
+    def hot_files(self):
+        """当前应预读的文件：按热度从高到低取prefetch_top个，总大小不超过prefetch_max_mb"""
+        budget = int(config.get('prefetch_max_mb', 512)) * 1024 * 1024
+        limit = int(config.get('prefetch_top', 20))
+        selected = []
+        for item in self.tracker.top(limit=limit):
+            if item['score'] < PREFETCH_MIN_SCORE:
+                break
+            locate = self.tracker.areas.get(item['area'])
+            path = locate(item['name'])[0] if locate else None
+            if path is None:
+                continue
+            stat = os.stat(path)
+            if stat.st_size > budget:
+                continue
+            budget -= stat.st_size
+            selected.append((path, stat))
+        return selected
+
+    @staticmethod
+    def _advise(path, advice):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, advice)
+        finally:
+            os.close(fd)
+
+    def warm(self, path):
+        if hasattr(os, 'posix_fadvise'):
+            self._advise(path, os.POSIX_FADV_WILLNEED)
+        else:
+            # 不支持fadvise的系统（Windows）顺序读一遍，由系统缓存
+            with open(path, 'rb') as f:
+                while f.read(READ_CHUNK):
+                    pass
+
+    def release(self, path):
+        if hasattr(os, 'posix_fadvise'):
+            self._advise(path, os.POSIX_FADV_DONTNEED)
+
+    def run(self):
+        now = time.time()
+        hot = self.hot_files()
+        hot_paths = set()
+        for path, stat in hot:
+            hot_paths.add(path)
+            previous = self.warmed.get(path)
+            if previous and previous[0] == stat.st_mtime and now - previous[1] < REWARM_SECONDS:
+                continue
+            try:
+                self.warm(path)
+            except OSError:
+                continue
+            self.warmed[path] = (stat.st_mtime, now)
+            self.stats['warmed_files'] += 1
+            self.stats['warmed_bytes'] += stat.st_size
+        for path in [p for p in self.warmed if p not in hot_paths]:
+            del self.warmed[path]
+            try:
+                self.release(path)
+                self.stats['released_files'] += 1
+            except OSError:
+                pass
+        self.stats['runs'] += 1
+        self.stats['last_run'] = now
+        self.stats['hot'] = len(hot_paths)
+
+    def start(self):
+        """启动预读线程，prefetch_interval为0时不启动"""
+        if self.thread is not None or int(config.get('prefetch_interval', 60)) <= 0:
+            return
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(int(config.get('prefetch_interval', 60)))
+            try:
+                self.run()
+            except Exception as e:
+                logging.warning(f'预读热点文件失败: {e}')
+
+# 全局实例，文件区和视频区在各自模块中注册
+popularity = PopularityTracker()
+collection_versions.subscribe(popularity.on_change)
+page_prefetcher = PagePrefetcher(popularity)
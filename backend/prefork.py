@@ -0,0 +1,255 @@
+# 多进程运行：主进程选定端口后启动N个工作进程，每个工作进程各自用SO_REUSEPORT绑定同一端口，
+# 由内核把新连接分配给各进程，JSON序列化、哈希计算、预览生成等受GIL限制的工作可以用满多个核。
+# 主进程只做监督：工作进程意外退出后重新启动（连续失败时逐步加长等待），收到SIGHUP时逐个滚动重启
+# （新进程就绪后旧进程停止接受连接，处理完已有请求再退出），收到SIGTERM/SIGINT时全部优雅退出。
+# 工作进程以新的Python进程启动（而不是直接fork主进程），SQLite连接等不会跨进程共用，滚动重启时也会加载新代码。
+# 需要SO_REUSEPORT（Linux 3.9+、macOS、BSD），Windows下不支持，退回单进程运行
+import logging
+import os
+import select
+import signal
+import socket
+import subprocess
+import threading
+import time
+from werkzeug.serving import make_server, BaseWSGIServer
+from werkzeug.wsgi import ClosingIterator
+
+# 等待工作进程绑定端口的最长时间（秒）
+READY_TIMEOUT = 60
+# 工作进程异常退出后重新启动的等待时间（秒），连续失败时加倍，不超过上限
+RESTART_DELAY = 1
+MAX_RESTART_DELAY = 30
+# 运行超过该时间后退出的不算连续失败（秒）
+STABLE_SECONDS = 60
+LISTEN_BACKLOG = 128
+POLL_INTERVAL = 0.5
+
+# 当前进程的工作进程序号，单进程运行时为None
+current_worker = None
+
+def supported():
+    return hasattr(socket, 'SO_REUSEPORT') and os.name != 'nt'
+
+def listen_socket(host, port):
+    """创建设置了SO_REUSEPORT的监听套接字，多个进程可以同时绑定同一端口"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(LISTEN_BACKLOG)
+    return sock
+
+class RequestTracker:
+    """WSGI中间件：统计正在处理（含响应体发送中）的请求数，优雅退出时等待其归零"""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.lock = threading.Lock()
+        self.active = 0
+
+    def __call__(self, environ, start_response):
+        with self.lock:
+            self.active += 1
+        try:
+            return ClosingIterator(self.wsgi_app(environ, start_response), self._done)
+        except BaseException:
+            self._done()
+            raise
+
+    def _done(self):
+        with self.lock:
+            self.active -= 1
+
+    def wait_idle(self, timeout):
+        deadline = time.time() + timeout
+        while self.active > 0 and time.time() < deadline:
+            time.sleep(0.1)
+        return self.active == 0
+
+def drain_backlog(server):
+    """
+    关闭监听套接字前接受并处理已在其等待队列中的连接。
+    内核按SO_REUSEPORT分配到本进程、尚未accept的连接在套接字关闭时会被重置，滚动重启时客户端会看到连接错误
+    """
+    server.socket.setblocking(False)
+    while True:
+        try:
+            request, address = server.socket.accept()
+        except OSError:
+            return
+        request.setblocking(True)
+        server.process_request(request, address)
+
+def serve_worker(app, host, port, index, ready_fd=None, graceful_timeout=30, on_exit=None):
+    """
+    工作进程主循环：绑定端口、通知主进程已就绪，收到SIGTERM/SIGINT后停止接受连接，
+    等已有请求处理完（最多graceful_timeout秒）后调用on_exit并退出
+    """
+    global current_worker
+    current_worker = index
+    tracker = RequestTracker(app.wsgi_app)
+    app.wsgi_app = tracker
+    sock = listen_socket(host, port)
+    server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+    sock.close()
+
+    stop = threading.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: stop.set())
+    # werkzeug的serve_forever结束时立即关闭监听套接字，这里直接使用socketserver的循环，关闭前先处理等待队列中的连接
+    serve_forever = super(BaseWSGIServer, server).serve_forever
+    threading.Thread(target=serve_forever, name='http-server', daemon=True).start()
+    if ready_fd is not None:
+        os.write(ready_fd, b'1')
+        os.close(ready_fd)
+
+    while not stop.wait(1):
+        pass
+    server.shutdown()
+    drain_backlog(server)
+    server.server_close()
+    if not tracker.wait_idle(graceful_timeout):
+        logging.warning(f'工作进程{index}退出时仍有{tracker.active}个请求未完成')
+    try:
+        if on_exit:
+            on_exit()
+    finally:
+        # 空闲的长连接线程和其他后台线程不再等待
+        os._exit(0)
+
+def wait_ready(read_fd, process, timeout=READY_TIMEOUT):
+    """等待工作进程写入就绪标记；进程提前退出或超时返回False"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        readable, _, _ = select.select([read_fd], [], [], min(deadline - time.time(), POLL_INTERVAL))
+        if readable:
+            return os.read(read_fd, 1) == b'1'
+        if process.poll() is not None:
+            return False
+    return False
+
+class Supervisor:
+    def __init__(self, command, workers, graceful_timeout=30):
+        """
+        command: 工作进程序号 -> 启动命令（参数列表），由supervisor追加 --ready-fd
+        workers: 工作进程数
+        """
+        self.command = command
+        self.workers = workers
+        self.graceful_timeout = graceful_timeout
+        self.processes = {}  # 序号 -> (Popen, 启动时间)
+        self.retiring = []   # 滚动重启中等待退出的旧进程 (Popen, 通知退出的时间)
+        self.failures = {}   # 序号 -> 连续失败次数
+        self.restart_at = {}  # 序号 -> 重新启动的时间
+        self.reload_requested = False
+        self.stopping = False
+
+    def spawn(self, index):
+        """启动工作进程并等待其就绪，失败时抛出RuntimeError"""
+        read_fd, write_fd = os.pipe()
+        try:
+            process = subprocess.Popen(self.command(index) + ['--ready-fd', str(write_fd)], pass_fds=(write_fd,))
+        finally:
+            os.close(write_fd)
+        try:
+            ready = wait_ready(read_fd, process)
+        finally:
+            os.close(read_fd)
+        if not ready:
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+            raise RuntimeError(f'工作进程{index}启动失败（退出码{process.returncode}）')
+        self.processes[index] = (process, time.time())
+        logging.info(f'工作进程{index}已启动，pid={process.pid}')
+        return process
+
+    def start(self, index):
+        self.restart_at.pop(index, None)
+        try:
+            self.spawn(index)
+        except Exception as e:
+            logging.warning(str(e))
+            self.schedule_restart(index)
+
+    def schedule_restart(self, index):
+        failures = self.failures.get(index, 0)
+        self.failures[index] = failures + 1
+        self.restart_at[index] = time.time() + min(RESTART_DELAY * 2 ** failures, MAX_RESTART_DELAY)
+
+    def reap(self):
+        """回收已退出的进程，意外退出的按退避时间重新启动"""
+        for index, (process, started) in list(self.processes.items()):
+            if process.poll() is None:
+                continue
+            del self.processes[index]
+            logging.warning(f'工作进程{index}（pid={process.pid}）意外退出，退出码{process.returncode}')
+            if time.time() - started > STABLE_SECONDS:
+                self.failures[index] = 0
+            self.schedule_restart(index)
+        now = time.time()
+        for index, when in list(self.restart_at.items()):
+            if when <= now and not self.stopping:
+                self.start(index)
+        still_running = []
+        for process, since in self.retiring:
+            if process.poll() is not None:
+                continue
+            if now - since > self.graceful_timeout + 5:
+                process.kill()
+            still_running.append((process, since))
+        self.retiring = still_running
+
+    def rolling_reload(self):
+        """逐个替换工作进程：新进程就绪后再通知旧进程退出，任一时刻都有进程在接受连接"""
+        logging.info('开始滚动重启工作进程')
+        for index in range(self.workers):
+            old = self.processes.get(index)
+            try:
+                self.spawn(index)
+            except Exception as e:
+                logging.warning(f'{e}，保留原工作进程')
+                continue
+            if old is not None:
+                old[0].send_signal(signal.SIGTERM)
+                self.retiring.append((old[0], time.time()))
+            self.failures[index] = 0
+            self.restart_at.pop(index, None)
+
+    def shutdown(self):
+        """通知所有工作进程优雅退出，超时后强制结束"""
+        processes = [process for process, _ in self.processes.values()] + [process for process, _ in self.retiring]
+        for process in processes:
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+        deadline = time.time() + self.graceful_timeout + 5
+        for process in processes:
+            try:
+                process.wait(max(deadline - time.time(), 0.1))
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        self.processes.clear()
+        self.retiring = []
+
+    def run(self):
+        """启动全部工作进程并监督，直到收到SIGTERM或SIGINT"""
+        def request_stop(*_):
+            self.stopping = True
+        def request_reload(*_):
+            self.reload_requested = True
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+        signal.signal(signal.SIGHUP, request_reload)
+        for index in range(self.workers):
+            self.start(index)
+        try:
+            while not self.stopping:
+                self.reap()
+                if self.reload_requested:
+                    self.reload_requested = False
+                    self.rolling_reload()
+                time.sleep(POLL_INTERVAL)
+        finally:
+            self.shutdown()
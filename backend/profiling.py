@@ -0,0 +1,155 @@
+# 按需性能分析：按比例抽样或凭可信请求头对单个请求做cProfile，转储到轮转目录
+# 同时记录慢请求日志，按文件系统、JSON、网络三个阶段拆分耗时；未开启时几乎没有开销
+import cProfile
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import request, g
+from config import config
+
+PROFILE_DIR = os.path.join(os.path.dirname(__file__), 'profiles')
+PROFILE_HEADER = 'X-Profile'
+PHASES = ('fs', 'json', 'network')
+
+# 当前请求的阶段计时，未开启计时的请求为None
+_timings = ContextVar('request_timings', default=None)
+# cProfile同一时间只能有一个实例在运行（Python 3.12起为全局限制）
+_profile_lock = threading.Lock()
+slow_requests = deque(maxlen=200)
+slow_logger = logging.getLogger('slow_requests')
+
+class PhaseTimings:
+    def __init__(self):
+        self.totals = dict.fromkeys(PHASES, 0.0)
+        # 嵌套阶段只计入最内层，外层在内层期间暂停计时
+        self.stack = []
+
+    def enter(self, name):
+        now = time.perf_counter()
+        if self.stack:
+            outer = self.stack[-1]
+            self.totals[outer[0]] += now - outer[1]
+        self.stack.append([name, now])
+
+    def exit(self):
+        now = time.perf_counter()
+        name, start = self.stack.pop()
+        self.totals[name] += now - start
+        if self.stack:
+            self.stack[-1][1] = now
+
+@contextmanager
+def phase(name):
+    """标记一段代码所属的阶段（fs/json/network），未开启计时时不做任何事"""
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    timings.enter(name)
+    try:
+        yield
+    finally:
+        timings.exit()
+
+def _rotate_profiles(keep):
+    files = sorted(
+        (os.path.join(PROFILE_DIR, f) for f in os.listdir(PROFILE_DIR) if f.endswith('.prof')),
+        key=os.path.getmtime
+    )
+    for path in files[:-keep] if keep > 0 else files:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def _should_profile():
+    token = config.get('profile_token', '')
+    if token and request.headers.get(PROFILE_HEADER) == token:
+        return True
+    rate = config.get('profile_sample_rate', 0)
+    return rate > 0 and random.random() < rate
+
+def _before_request():
+    slow_ms = config.get('slow_request_ms', 0)
+    profile = _should_profile()
+    if slow_ms <= 0 and not profile:
+        return
+    g.profile_start = time.perf_counter()
+    g.profile_timings = PhaseTimings()
+    _timings.set(g.profile_timings)
+    if profile and _profile_lock.acquire(blocking=False):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+def _dump_profile(profiler):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path_part = request.path.strip('/').replace('/', '_')[:60] or 'root'
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{int(time.time() * 1000) % 1000:03d}-{request.method}-{path_part}.prof"
+    profiler.dump_stats(os.path.join(PROFILE_DIR, name))
+    _rotate_profiles(config.get('profile_keep', 50))
+    return name
+
+def _after_request(response):
+    start = g.get('profile_start')
+    if start is None:
+        return response
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        _profile_lock.release()
+        try:
+            response.headers['X-Profile-Id'] = _dump_profile(profiler)
+        except Exception as e:
+            logging.warning(f'[警告] 保存性能分析结果失败: {e}')
+
+    timings = g.profile_timings
+    handler_done = time.perf_counter()
+    method, path, status = request.method, request.full_path.rstrip('?'), response.status_code
+
+    # 响应体发送完毕后才计算总耗时，发送阶段计入network
+    def on_close():
+        end = time.perf_counter()
+        timings.totals['network'] += end - handler_done
+        total_ms = (end - start) * 1000
+        if total_ms < config.get('slow_request_ms', 0):
+            return
+        phases = {k: round(v * 1000, 2) for k, v in timings.totals.items()}
+        phases['other'] = round(max(total_ms - sum(phases.values()), 0), 2)
+        entry = {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'method': method,
+            'path': path,
+            'status': status,
+            'total_ms': round(total_ms, 2),
+            'phases_ms': phases
+        }
+        slow_requests.append(entry)
+        slow_logger.warning(json.dumps(entry, ensure_ascii=False))
+    response.call_on_close(on_close)
+    return response
+
+def _teardown_request(exc):
+    # 请求异常中断时确保释放分析器
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        _profile_lock.release()
+    _timings.set(None)
+
+def init_profiling(app):
+    """在Flask应用上注册性能分析与慢请求记录的钩子"""
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+
+def list_profiles():
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    names = [f for f in os.listdir(PROFILE_DIR) if f.endswith('.prof')]
+    return sorted(names, reverse=True)
@@ -0,0 +1,254 @@
+# 跨进程共享状态：最大保留数量等设置和各集合的版本号保存在一块文件映射内存中
+# 多个工作进程读写同一份数据；读操作不加锁，写操作使用线程锁+文件锁保证一致；
+# 映射文件保存在磁盘上，重启后数值仍然保留
+# 各集合的变更日志（增量同步用）保存在另一块映射内存的环形缓冲区中，与版本号在同一次加锁中写入
+import mmap
+import os
+import random
+import struct
+import threading
+from contextlib import contextmanager
+
+STATE_PATH = os.path.join(os.path.dirname(__file__), 'shared_state.bin')
+LOCK_PATH = STATE_PATH + '.lock'
+MAGIC = b'LSHARE01'
+SLOT_SIZE = 8
+MAX_SLOTS = 64
+
+# 槽位布局，只能在末尾追加，不能调整顺序
+SLOTS = [
+    'epoch',
+    'max_files',
+    'max_videos',
+    'max_messages',
+    'version:files',
+    'version:videos',
+    'version:message',
+    'version:history',
+    'changed_at:files',
+    'changed_at:videos',
+    'changed_at:message',
+    'changed_at:history',
+]
+SLOT_OFFSETS = {name: len(MAGIC) + i * SLOT_SIZE for i, name in enumerate(SLOTS)}
+CHANGELOG_PATH = os.path.join(os.path.dirname(__file__), 'shared_changelog.bin')
+CHANGELOG_MAGIC = b'LSCLOG01'
+# 记录变更日志的集合，只能在末尾追加
+CHANGELOG_COLLECTIONS = ['files', 'videos', 'message', 'history']
+# 每个集合保留的变更记录条数（每个变更的条目一条），客户端落后更多时退化为全量同步
+CHANGELOG_RECORDS = 1024
+# 变更记录：版本号、操作、条目名长度，后接UTF-8条目名
+RECORD_HEADER = struct.Struct('<qBH')
+RECORD_SIZE = 272
+NAME_MAX = RECORD_SIZE - RECORD_HEADER.size
+# 操作编码：UNKNOWN表示该版本的变更内容未知，NONE表示该版本没有条目变化
+OP_UNKNOWN = 0
+OP_NONE = 4
+OP_CODES = {'add': 1, 'update': 2, 'remove': 3}
+OP_NAMES = {code: op for op, code in OP_CODES.items()}
+
+# 首次创建映射文件时写入的初始值
+DEFAULTS = {
+    'max_files': 10,
+    'max_videos': 10,
+    'max_messages': 20,
+}
+
+if os.name == 'nt':
+    import msvcrt
+
+    def _lock_file(fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        while True:
+            try:
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                # LK_LOCK重试10次后仍失败会抛出异常，继续等待
+                continue
+
+    def _unlock_file(fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _lock_file(fd):
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+    def _unlock_file(fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+class SharedState:
+    def __init__(self, path=STATE_PATH, lock_path=LOCK_PATH):
+        self.thread_lock = threading.Lock()
+        self.lock_fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        size = len(MAGIC) + MAX_SLOTS * SLOT_SIZE
+        with self._locked():
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size < size:
+                    os.ftruncate(fd, size)
+                self.mm = mmap.mmap(fd, size)
+            finally:
+                # 映射建立后即可关闭文件描述符
+                os.close(fd)
+            if self.mm[:len(MAGIC)] != MAGIC:
+                self._initialize()
+
+    def _initialize(self):
+        self.mm[:] = b'\0' * len(self.mm)
+        # epoch用于区分不同的共享状态文件，删除文件重建后旧的ETag和增量同步版本全部失效
+        self._write('epoch', random.getrandbits(32))
+        for name, value in DEFAULTS.items():
+            self._write(name, value)
+        self.mm[:len(MAGIC)] = MAGIC
+        self.mm.flush()
+
+    def _write(self, name, value):
+        struct.pack_into('<q', self.mm, SLOT_OFFSETS[name], value)
+
+    @contextmanager
+    def _locked(self):
+        """线程锁保证进程内互斥，文件锁保证进程间互斥"""
+        with self.thread_lock:
+            _lock_file(self.lock_fd)
+            try:
+                yield
+            finally:
+                _unlock_file(self.lock_fd)
+
+    def get(self, name):
+        """读取数值，不加锁（8字节对齐的整数读取）"""
+        return struct.unpack_from('<q', self.mm, SLOT_OFFSETS[name])[0]
+
+    def set(self, name, value):
+        with self._locked():
+            self._write(name, int(value))
+            self.mm.flush()
+
+    def increment(self, name, extra=None, on_increment=None):
+        """
+        原子地将name加1并返回新值。
+        extra: {槽位名: 值}，在同一次加锁中一并写入（如变更时间）。
+        on_increment: 仍持有锁时以新值调用（如写入变更日志），其他进程看到新值时日志已经写好
+        """
+        with self._locked():
+            value = self.get(name) + 1
+            self._write(name, value)
+            for key, val in (extra or {}).items():
+                self._write(key, int(val))
+            if on_increment:
+                on_increment(value)
+        return value
+
+class SharedChangelog:
+    """
+    各集合的变更日志，保存在跨进程共享的环形缓冲区中，任一工作进程的变更其他进程都能看到。
+    写入由SharedState.increment在持有锁时调用，读取也加同一把锁
+    """
+
+    def __init__(self, state, path=CHANGELOG_PATH):
+        self.state = state
+        self.section_size = 8 + CHANGELOG_RECORDS * RECORD_SIZE
+        size = len(CHANGELOG_MAGIC) + 8 + len(CHANGELOG_COLLECTIONS) * self.section_size
+        with state._locked():
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size < size:
+                    os.ftruncate(fd, size)
+                self.mm = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+            # 共享状态文件重建后版本号从头开始，旧的日志作废
+            epoch = state.get('epoch')
+            if self.mm[:len(CHANGELOG_MAGIC)] != CHANGELOG_MAGIC or struct.unpack_from('<q', self.mm, len(CHANGELOG_MAGIC))[0] != epoch:
+                self.mm[:] = b'\0' * len(self.mm)
+                struct.pack_into('<q', self.mm, len(CHANGELOG_MAGIC), epoch)
+                self.mm[:len(CHANGELOG_MAGIC)] = CHANGELOG_MAGIC
+                self.mm.flush()
+
+    def _section(self, collection):
+        return len(CHANGELOG_MAGIC) + 8 + CHANGELOG_COLLECTIONS.index(collection) * self.section_size
+
+    def append(self, collection, version, changes):
+        """
+        记录一个版本的变更，调用方须持有SharedState的锁。
+        changes: [(操作, 条目名)]，None表示变更内容未知
+        """
+        if collection not in CHANGELOG_COLLECTIONS:
+            return
+        records = []
+        if changes is None:
+            records.append((OP_UNKNOWN, b''))
+        elif not changes:
+            records.append((OP_NONE, b''))
+        for op, item in changes or ():
+            name = item.encode('utf-8')
+            if len(name) > NAME_MAX or op not in OP_CODES:
+                records = [(OP_UNKNOWN, b'')]
+                break
+            records.append((OP_CODES[op], name))
+        base = self._section(collection)
+        head = struct.unpack_from('<q', self.mm, base)[0]
+        for code, name in records:
+            offset = base + 8 + (head % CHANGELOG_RECORDS) * RECORD_SIZE
+            RECORD_HEADER.pack_into(self.mm, offset, version, code, len(name))
+            self.mm[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + len(name)] = name
+            head += 1
+        struct.pack_into('<q', self.mm, base, head)
+
+    def read(self, collection, since, current):
+        """
+        返回since之后到current为止各版本的变更 [(版本号, changes)]，按版本号升序。
+        日志无法完整覆盖（记录已被覆盖、含未记录的版本）时返回None
+        """
+        if collection not in CHANGELOG_COLLECTIONS:
+            return None
+        if since >= current:
+            return []
+        base = self._section(collection)
+        by_version = {}
+        with self.state._locked():
+            head = struct.unpack_from('<q', self.mm, base)[0]
+            reached = False
+            for i in range(head - 1, max(head - CHANGELOG_RECORDS, 0) - 1, -1):
+                offset = base + 8 + (i % CHANGELOG_RECORDS) * RECORD_SIZE
+                version, code, length = RECORD_HEADER.unpack_from(self.mm, offset)
+                if version <= since:
+                    reached = True
+                    break
+                if version > current:
+                    continue
+                name = bytes(self.mm[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length]).decode('utf-8')
+                by_version.setdefault(version, []).append((code, name))
+            # 缓冲区已写满一圈且没有读到since及之前的记录时，最早那个版本的记录可能只剩一部分
+            if not reached and head > CHANGELOG_RECORDS:
+                return None
+        if len(by_version) != current - since:
+            return None
+        result = []
+        for version in sorted(by_version):
+            records = list(reversed(by_version[version]))
+            if any(code == OP_UNKNOWN for code, _ in records):
+                result.append((version, None))
+            else:
+                result.append((version, [(OP_NAMES[code], name) for code, name in records if code != OP_NONE]))
+        return result
+
+@contextmanager
+def file_lock(path):
+    """对 path.lock 加跨进程互斥锁，用于保护JSON文件的读-改-写"""
+    fd = os.open(path + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        _lock_file(fd)
+        try:
+            yield
+        finally:
+            _unlock_file(fd)
+    finally:
+        os.close(fd)
+
+# 全局共享状态实例
+shared_state = SharedState()
+shared_changelog = SharedChangelog(shared_state)
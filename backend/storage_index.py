@@ -0,0 +1,276 @@
+# 存储目录分片与列表索引
+# 文件按文件名哈希存放在 目录/xx/文件名 的256个子目录中，单个目录的文件数保持在较小规模；
+# 每个存储区域在内存中维护一份按修改时间、大小、文件名预先排好序的索引，列表接口分页、排序、筛选都在索引上完成，
+# 索引按集合版本号和变更日志增量更新，变更日志无法覆盖（如其他进程的变更）时重新扫描目录
+import base64
+import bisect
+import hashlib
+import json
+import os
+import threading
+from versioning import collection_versions
+
+SORT_KEYS = ('mtime', 'size', 'name')
+# 热度随时间变化，不预先排序，查询时按当前分数排序
+DYNAMIC_SORT_KEYS = ('popularity',)
+# 单页最多返回的条目数
+MAX_LIST_LIMIT = 1000
+
+def shard_of(name):
+    return hashlib.md5(name.encode('utf-8')).hexdigest()[:2]
+
+def shard_path(folder, name):
+    """文件在分片目录中的路径（不检查是否存在）"""
+    return os.path.join(folder, shard_of(name), name)
+
+def ensure_shard(folder, name):
+    """创建文件所在的分片目录并返回文件路径"""
+    path = shard_path(folder, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+def find_path(folder, stored_name, suffix=''):
+    """
+    查找磁盘上的文件，先查分片目录，再查旧版本直接放在根目录下的位置。
+    suffix: 磁盘文件名在对外文件名之后的后缀（如压缩存储的.gz），分片按对外文件名计算
+    返回: 文件路径，不存在时返回None
+    """
+    path = shard_path(folder, stored_name) + suffix
+    if os.path.isfile(path):
+        return path
+    path = os.path.join(folder, stored_name + suffix)
+    if os.path.isfile(path):
+        return path
+    return None
+
+def is_listed(stored_name):
+    """隐藏文件（如.gitkeep）和写入中的临时文件不出现在列表中"""
+    return not stored_name.startswith('.') and not stored_name.endswith('.tmp')
+
+def walk_files(folder):
+    """遍历根目录和各分片目录下的文件，返回(文件名, 路径)"""
+    with os.scandir(folder) as it:
+        for entry in it:
+            if entry.is_file():
+                yield entry.name, entry.path
+            elif entry.is_dir() and len(entry.name) == 2:
+                with os.scandir(entry.path) as shard:
+                    for item in shard:
+                        if item.is_file():
+                            yield item.name, item.path
+
+def encode_cursor(sort, order, value, name):
+    raw = json.dumps([sort, order, value, name], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """解析游标，结构或排序值类型不合法时抛出ValueError（排序值要与索引键比较，类型不对会出错）"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort, order, value, name = json.loads(raw)
+    except Exception:
+        raise ValueError('cursor不合法')
+    numeric = isinstance(value, (int, float)) and not isinstance(value, bool)
+    if not isinstance(name, str) or not (isinstance(value, str) if sort == 'name' else numeric):
+        raise ValueError('cursor不合法')
+    return sort, order, value, name
+
+def parse_list_args(args, categories):
+    """
+    解析列表接口的分页、排序、筛选参数，参数不合法时抛出ValueError。
+    参数: categories - {类型名: 扩展名集合}，用于type筛选
+    返回: ListIndex.query的关键字参数
+    """
+    sort = args.get('sort', 'mtime')
+    if sort not in SORT_KEYS + DYNAMIC_SORT_KEYS:
+        raise ValueError('sort应为mtime、size、name或popularity')
+    order = args.get('order', 'asc' if sort == 'name' else 'desc')
+    if order not in ('asc', 'desc'):
+        raise ValueError('order应为asc或desc')
+    limit = args.get('limit')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValueError('limit应为整数')
+        if limit < 1 or limit > MAX_LIST_LIMIT:
+            raise ValueError(f'limit应在1-{MAX_LIST_LIMIT}之间')
+    exts = set()
+    if args.get('ext'):
+        exts = {e.strip().lower().lstrip('.') for e in args['ext'].split(',') if e.strip()}
+    if args.get('type'):
+        for category in args['type'].split(','):
+            if category not in categories:
+                raise ValueError(f'不支持的type: {category}')
+            exts |= categories[category]
+    return {
+        'sort': sort,
+        'order': order,
+        'limit': limit,
+        'cursor': args.get('cursor') or None,
+        'exts': exts or None,
+        'ip': args.get('ip') or None
+    }
+
+class ListIndex:
+    """
+    单个存储区域的内存列表索引。
+    logical_name: 磁盘文件名转对外文件名
+    describe: (文件名, IP记录) -> 列表条目dict，文件不存在时返回None
+    load_info: 读取整个上传IP记录
+    scores: 返回{文件名: 热度分数}，用于按热度排序
+    """
+
+    def __init__(self, collection, folder, logical_name, describe, load_info, scores=None):
+        self.collection = collection
+        self.folder = folder
+        self.logical_name = logical_name
+        self.describe = describe
+        self.load_info = load_info
+        self.scores = scores
+        self.lock = threading.RLock()
+        self.version = None
+        self.entries = {}
+        self.sorted = {key: [] for key in SORT_KEYS}
+
+    @staticmethod
+    def _key(sort, entry):
+        if sort == 'mtime':
+            return (entry['modified'], entry['name'])
+        if sort == 'size':
+            return (entry['size'], entry['name'])
+        return (entry['name'], entry['name'])
+
+    def _discard(self, name):
+        entry = self.entries.pop(name, None)
+        if entry is None:
+            return
+        for sort, keys in self.sorted.items():
+            key = self._key(sort, entry)
+            i = bisect.bisect_left(keys, key)
+            if i < len(keys) and keys[i] == key:
+                del keys[i]
+
+    def _insert(self, entry):
+        self._discard(entry['name'])
+        self.entries[entry['name']] = entry
+        for sort, keys in self.sorted.items():
+            bisect.insort(keys, self._key(sort, entry))
+
+    def _restat(self, names, info):
+        for name in names:
+            entry = self.describe(name, info)
+            if entry is None:
+                self._discard(name)
+            else:
+                self._insert(entry)
+
+    def rebuild(self):
+        """重新扫描整个目录；旧版本留在根目录下的文件顺带移入分片目录"""
+        with self.lock:
+            version = collection_versions.get(self.collection)
+            info = self.load_info()
+            names = set()
+            for stored_name, path in walk_files(self.folder):
+                if not is_listed(stored_name):
+                    continue
+                name = self.logical_name(stored_name)
+                if os.path.normpath(os.path.dirname(path)) == os.path.normpath(self.folder):
+                    try:
+                        os.replace(path, ensure_shard(self.folder, name) + stored_name[len(name):])
+                    except OSError:
+                        pass
+                names.add(name)
+            entries = [e for e in (self.describe(name, info) for name in names) if e is not None]
+            self.entries = {e['name']: e for e in entries}
+            for sort in SORT_KEYS:
+                self.sorted[sort] = sorted(self._key(sort, e) for e in entries)
+            self.version = version
+
+    def refresh(self, pending=()):
+        """
+        使索引与当前版本一致。
+        pending: 已改动但尚未递增版本号的文件名，一并重新读取
+        """
+        with self.lock:
+            if self.version is None:
+                self.rebuild()
+            else:
+                version, changes = collection_versions.changes_since(self.collection, self.version)
+                if changes is None:
+                    self.rebuild()
+                elif changes:
+                    self._restat(changes, self.load_info())
+                    self.version = version
+                else:
+                    self.version = version
+            if pending:
+                self._restat(pending, self.load_info())
+
+    def get(self, name):
+        """取单个条目，不刷新索引"""
+        with self.lock:
+            return self.entries.get(name)
+
+    def count(self):
+        with self.lock:
+            return len(self.entries)
+
+    def oldest(self, count):
+        """按修改时间最早的count个文件名"""
+        with self.lock:
+            return [name for _, name in self.sorted['mtime'][:max(count, 0)]]
+
+    def discard(self, names):
+        with self.lock:
+            for name in names:
+                self._discard(name)
+
+    def query(self, sort='mtime', order='desc', limit=None, cursor=None, exts=None, ip=None):
+        """
+        按排序键分页查询，游标记录上一页最后一条的(排序值, 文件名)，翻页期间有增删也不会重复或遗漏。
+        返回: (索引版本号, 条目列表, 下一页游标或None, 符合筛选条件的总条目数)
+        """
+        def matches(entry):
+            if exts is not None and entry['name'].rsplit('.', 1)[-1].lower() not in exts:
+                return False
+            return ip is None or entry['ip'] == ip
+
+        with self.lock:
+            self.refresh()
+            if sort in DYNAMIC_SORT_KEYS:
+                # 分数在翻页期间可能变化，游标保证不重复，但排名变化的条目可能被跳过
+                scores = self.scores() if self.scores else {}
+                keys = sorted((scores.get(name, 0.0), name) for name in self.entries)
+            else:
+                keys = self.sorted[sort]
+            descending = order == 'desc'
+            if cursor:
+                c_sort, c_order, value, name = decode_cursor(cursor)
+                if c_sort != sort or c_order != order:
+                    raise ValueError('cursor与排序方式不一致')
+                key = (value, name)
+                start = bisect.bisect_left(keys, key) - 1 if descending else bisect.bisect_right(keys, key)
+            else:
+                start = len(keys) - 1 if descending else 0
+            if exts is None and ip is None:
+                total = len(self.entries)
+            else:
+                total = sum(1 for entry in self.entries.values() if matches(entry))
+            step = -1 if descending else 1
+            items = []
+            i = start
+            last_key = None
+            while 0 <= i < len(keys):
+                key = keys[i]
+                entry = self.entries[key[1]]
+                i += step
+                if not matches(entry):
+                    continue
+                if limit is not None and len(items) == limit:
+                    return self.version, items, encode_cursor(sort, order, last_key[0], last_key[1]), total
+                if sort in DYNAMIC_SORT_KEYS:
+                    entry = dict(entry, **{sort: key[0]})
+                items.append(entry)
+                last_key = key
+            return self.version, items, None, total
@@ -0,0 +1,510 @@
+# 表格预览：按行窗口读取CSV和XLSX，返回JSON行数据和推断的列类型，内存占用与文件大小无关
+# CSV：边读边记录行偏移（每隔一定行数一个检查点），读取任意窗口时从最近的检查点开始；索引按文件缓存
+# XLSX：不加载整个工作簿，从zip中流式解析工作表XML，同样每隔一定行数记录一个位置检查点，共享字符串只取窗口内用到的部分
+import bisect
+import codecs
+import csv
+import datetime
+import gzip
+import io
+import os
+import re
+import threading
+import zipfile
+import posixpath
+from collections import OrderedDict
+from xml.etree.ElementTree import TreeBuilder, iterparse
+from xml.parsers import expat
+
+# 每隔多少行记录一个偏移检查点
+CHECKPOINT_ROWS = 1000
+# 缓存行偏移索引的文件数
+INDEX_CACHE_SIZE = 32
+# 单次最多返回的行数
+MAX_ROWS = 1000
+# 编码和分隔符检测读取的字节数
+SNIFF_BYTES = 64 * 1024
+# 解析工作表XML时每次读取的字节数
+READ_CHUNK = 64 * 1024
+# 工作表第一行之前的内容（根元素、列宽等）超过这个大小时不记录检查点
+SHEET_PREFIX_LIMIT = 1024 * 1024
+
+class TableError(Exception):
+    pass
+
+# ---------------- 列类型推断 ----------------
+
+INT_RE = re.compile(r'^[+-]?\d+$')
+FLOAT_RE = re.compile(r'^[+-]?(\d+\.\d*|\.\d+|\d+)([eE][+-]?\d+)?$')
+DATE_RE = re.compile(r'^\d{4}[-/]\d{1,2}[-/]\d{1,2}([ T]\d{1,2}:\d{2}(:\d{2}(\.\d+)?)?)?$')
+BOOL_VALUES = {'true', 'false'}
+
+def value_type(value):
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, int):
+        return 'integer'
+    if isinstance(value, float):
+        return 'integer' if value.is_integer() else 'number'
+    text = str(value).strip()
+    if INT_RE.match(text):
+        return 'integer'
+    if FLOAT_RE.match(text):
+        return 'number'
+    if text.lower() in BOOL_VALUES:
+        return 'boolean'
+    if DATE_RE.match(text):
+        return 'date'
+    return 'string'
+
+def infer_types(rows, width):
+    """按窗口内的数据推断每列类型：整数和小数混合为number，其他混合为string，全空为empty"""
+    types = [None] * width
+    for row in rows:
+        for i in range(width):
+            t = value_type(row[i] if i < len(row) else None)
+            if t is None or types[i] == t:
+                continue
+            if types[i] is None:
+                types[i] = t
+            elif {types[i], t} == {'integer', 'number'}:
+                types[i] = 'number'
+            else:
+                types[i] = 'string'
+    return [t or 'empty' for t in types]
+
+def build_table(header, rows, start, has_more, total_rows):
+    width = max([len(header or [])] + [len(r) for r in rows])
+    names = list(header or [])
+    names += [f'列{i + 1}' for i in range(len(names), width)]
+    rows = [list(r) + [None] * (width - len(r)) for r in rows]
+    return {
+        'columns': [{'name': n, 'type': t} for n, t in zip(names, infer_types(rows, width))],
+        'rows': rows,
+        'start': start,
+        'has_more': has_more,
+        'total_rows': total_rows
+    }
+
+# ---------------- CSV ----------------
+
+def detect_encoding(sample):
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    try:
+        # 样本末尾可能截断了多字节字符
+        sample.decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError as e:
+        if e.start >= len(sample) - 3:
+            return 'utf-8'
+    # Excel在中文系统下导出的CSV通常为GBK
+    return 'gb18030'
+
+def detect_delimiter(text):
+    try:
+        return csv.Sniffer().sniff(text, delimiters=',;\t|').delimiter
+    except csv.Error:
+        return ','
+
+class CsvIndex:
+    """
+    单个CSV文件的行偏移索引。
+    checkpoints[i] 为第 i*CHECKPOINT_ROWS 条记录（从0开始，包含表头行）的字节偏移；
+    按引号奇偶判断记录边界，字段内的换行不会被当作新记录
+    """
+
+    def __init__(self, open_file):
+        self.open_file = open_file
+        self.lock = threading.Lock()
+        with open_file() as f:
+            sample = f.read(SNIFF_BYTES)
+        self.encoding = detect_encoding(sample)
+        text = sample.decode(self.encoding, errors='ignore')
+        self.delimiter = detect_delimiter(text[:text.rfind('\n')] if '\n' in text else text)
+        self.checkpoints = [3 if self.encoding == 'utf-8-sig' else 0]
+        # 已扫描到的记录数及其偏移，total在扫描到文件末尾后确定
+        self.scanned = 0
+        self.scanned_offset = self.checkpoints[0]
+        self.total = None
+
+    def _scan_to(self, record):
+        """向后扫描直到知道第record条记录的偏移所在检查点，或到达文件末尾"""
+        target = record // CHECKPOINT_ROWS
+        if self.total is not None or len(self.checkpoints) > target:
+            return
+        with self.open_file() as f:
+            f.seek(self.scanned_offset)
+            offset, count, quotes = self.scanned_offset, self.scanned, 0
+            for line in f:
+                offset += len(line)
+                quotes += line.count(b'"')
+                if quotes % 2:
+                    continue
+                quotes = 0
+                count += 1
+                if count % CHECKPOINT_ROWS == 0:
+                    self.checkpoints.append(offset)
+                    self.scanned, self.scanned_offset = count, offset
+                    if len(self.checkpoints) > target:
+                        return
+            self.total = count
+            self.scanned, self.scanned_offset = count, offset
+
+    def read(self, start, count):
+        """读取第start条记录开始的count条记录（包含表头行时表头为第0条），多读一条用于判断是否还有更多"""
+        with self.lock:
+            self._scan_to(start)
+            index = min(start // CHECKPOINT_ROWS, len(self.checkpoints) - 1)
+            offset = self.checkpoints[index]
+            skip = start - index * CHECKPOINT_ROWS
+            total = self.total
+        with self.open_file() as f:
+            f.seek(offset)
+            text = io.TextIOWrapper(f, encoding=self.encoding, errors='replace', newline='')
+            rows = []
+            for i, row in enumerate(csv.reader(text, delimiter=self.delimiter)):
+                if i < skip:
+                    continue
+                rows.append(row)
+                if len(rows) > count:
+                    break
+            text.detach()
+        return rows, total
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+def cached_index(path, key, build):
+    """按(路径, 修改时间, 大小)缓存行位置索引，文件变化后重新建立"""
+    stat = os.stat(path)
+    token = (stat.st_mtime_ns, stat.st_size)
+    with _indexes_lock:
+        cached = _indexes.get(key)
+        if cached is not None and cached[0] == token:
+            _indexes.move_to_end(key)
+            return cached[1]
+    index = build()
+    with _indexes_lock:
+        _indexes[key] = (token, index)
+        while len(_indexes) > INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
+
+def csv_index(path, compressed):
+    # 压缩存储的文件在解压流上定位，偏移为解压后的偏移
+    return cached_index(path, ('csv', path), lambda: CsvIndex(
+        lambda: gzip.open(path, 'rb') if compressed else open(path, 'rb')))
+
+def read_csv(path, compressed, start, limit, header=True):
+    """读取第start行数据开始的limit行（header为真时第一行作为表头，不计入行号）"""
+    index = csv_index(path, compressed)
+    head = None
+    if header:
+        first, _ = index.read(0, 0)
+        head = first[0] if first else []
+    rows, total = index.read(start + (1 if header else 0), limit)
+    has_more = len(rows) > limit
+    if total is not None and header:
+        total -= 1
+    elif not has_more:
+        # 读到了文件末尾，总行数随之确定
+        total = start + len(rows)
+    result = build_table(head, rows[:limit], start, has_more, total)
+    result.update(format='csv', encoding=index.encoding, delimiter=index.delimiter)
+    return result
+
+# ---------------- XLSX ----------------
+
+NS_MAIN = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+NS_REL = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+NS_PKG_REL = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+# 内置的日期时间数字格式编号
+DATE_FORMAT_IDS = set(range(14, 23)) | {45, 46, 47}
+DATE_FORMAT_RE = re.compile(r'[ymdhs]', re.IGNORECASE)
+EXCEL_EPOCH = datetime.datetime(1899, 12, 30)
+
+def column_index(ref):
+    """单元格引用（如C12）中的列号，从0开始"""
+    n = 0
+    for ch in ref:
+        if not ch.isalpha():
+            break
+        n = n * 26 + (ord(ch.upper()) - 64)
+    return n - 1
+
+def _iter_elements(zf, member, tag):
+    """流式遍历zip中XML文件的指定元素，处理完即从父元素中移除，内存只保留当前元素"""
+    with zf.open(member) as f:
+        parents = []
+        for event, elem in iterparse(f, events=('start', 'end')):
+            if event == 'start':
+                parents.append(elem)
+                continue
+            parents.pop()
+            if elem.tag == tag:
+                yield elem
+                elem.clear()
+                if parents:
+                    parents[-1].remove(elem)
+
+def workbook_sheets(zf):
+    """返回[(工作表名, zip内路径)]，按工作簿中的顺序"""
+    targets = {}
+    for rel in _iter_elements(zf, 'xl/_rels/workbook.xml.rels', NS_PKG_REL + 'Relationship'):
+        target = rel.get('Target', '')
+        target = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+        targets[rel.get('Id')] = target
+    return [(s.get('name'), targets.get(s.get(NS_REL + 'id')))
+            for s in _iter_elements(zf, 'xl/workbook.xml', NS_MAIN + 'sheet')]
+
+def date_styles(zf):
+    """返回日期格式的单元格样式序号集合"""
+    if 'xl/styles.xml' not in zf.namelist():
+        return set()
+    custom = {}
+    styles = set()
+    with zf.open('xl/styles.xml') as f:
+        in_xfs = False
+        xf_index = 0
+        for event, elem in iterparse(f, events=('start', 'end')):
+            if event == 'start':
+                if elem.tag == NS_MAIN + 'cellXfs':
+                    in_xfs = True
+                continue
+            if elem.tag == NS_MAIN + 'numFmt':
+                custom[int(elem.get('numFmtId', 0))] = elem.get('formatCode', '')
+            elif elem.tag == NS_MAIN + 'xf' and in_xfs:
+                fmt = int(elem.get('numFmtId', 0))
+                if fmt in DATE_FORMAT_IDS or (fmt in custom and DATE_FORMAT_RE.search(re.sub(r'"[^"]*"|\[[^\]]*\]', '', custom[fmt]))):
+                    styles.add(xf_index)
+                xf_index += 1
+            elif elem.tag == NS_MAIN + 'cellXfs':
+                in_xfs = False
+                elem.clear()
+    return styles
+
+def shared_strings(zf, wanted):
+    """只取出需要的共享字符串序号对应的文本"""
+    result = {}
+    if not wanted or 'xl/sharedStrings.xml' not in zf.namelist():
+        return result
+    last = max(wanted)
+    for i, si in enumerate(_iter_elements(zf, 'xl/sharedStrings.xml', NS_MAIN + 'si')):
+        if i in wanted:
+            result[i] = ''.join(t.text or '' for t in si.iter(NS_MAIN + 't'))
+        if i >= last:
+            break
+    return result
+
+def excel_date(serial):
+    try:
+        value = EXCEL_EPOCH + datetime.timedelta(days=float(serial))
+    except (ValueError, OverflowError):
+        return serial
+    if value.hour == value.minute == value.second == 0:
+        return value.date().isoformat()
+    return value.isoformat(sep=' ', timespec='seconds')
+
+def _cell_value(c, styles):
+    kind = c.get('t', 'n')
+    v = c.find(NS_MAIN + 'v')
+    text = v.text if v is not None else None
+    if kind == 'inlineStr':
+        return ''.join(t.text or '' for t in c.iter(NS_MAIN + 't'))
+    if text is None:
+        return None
+    if kind == 's':
+        # 共享字符串先记下序号，窗口读完后统一替换
+        return ('sst', int(text))
+    if kind == 'b':
+        return text == '1'
+    if kind in ('str', 'e'):
+        return text
+    if int(c.get('s', 0)) in styles:
+        return excel_date(text)
+    number = float(text)
+    return int(number) if number.is_integer() else number
+
+ROW_TAG = NS_MAIN + 'row'
+
+class _StopSheet(Exception):
+    pass
+
+def _qualified(name):
+    # expat按命名空间展开后的名称为"命名空间}本地名"，补上左括号与ElementTree一致
+    return '{' + name if '}' in name else name
+
+class SheetIndex:
+    """
+    单个工作表的行位置索引。
+    numbers[i]、offsets[i] 为第 (i+1)*CHECKPOINT_ROWS 个<row>元素之前一行的行号，以及该<row>在解压后工作表XML中的字节偏移；
+    从检查点继续读时先送入第一个<row>之前的内容（根元素和命名空间声明），再从偏移处接着解析。
+    <row>没有r属性时行号为上一行加一
+    """
+
+    def __init__(self, member):
+        self.member = member
+        self.lock = threading.Lock()
+        self.prefix = None
+        self.numbers = []
+        self.offsets = []
+        # 第1行的原始值，从头读过一次后缓存，从检查点读时也能给出表头
+        self.head = None
+
+    def _checkpoint(self, count, number, offset):
+        with self.lock:
+            if len(self.offsets) == count // CHECKPOINT_ROWS - 1:
+                self.numbers.append(number)
+                self.offsets.append(offset)
+
+    def read(self, zf, first, last, styles):
+        """返回(第1行, 行号在[first, last)内的行, 是否还有更多行)，中间的空行补为空行"""
+        with self.lock:
+            i = bisect.bisect_left(self.numbers, first) - 1
+            if i >= 0 and self.prefix is not None:
+                prev, offset, count = self.numbers[i], self.offsets[i], (i + 1) * CHECKPOINT_ROWS
+                prefix, head = self.prefix, self.head
+            else:
+                prev, offset, count = 0, 0, 0
+                prefix, head = None, None
+        parser = expat.ParserCreate(namespace_separator='}')
+        # 解析器中的字节位置换算为工作表XML中的偏移
+        base = offset - len(prefix) if prefix is not None else 0
+        kept = bytearray() if prefix is None else None
+        builder = None
+        rows = []
+        has_more = False
+
+        def start(tag, attrs):
+            nonlocal prev, count, builder, has_more, kept
+            tag = _qualified(tag)
+            if builder is not None:
+                builder.start(tag, {_qualified(k): v for k, v in attrs.items()})
+                return
+            if tag != ROW_TAG:
+                return
+            position = base + parser.CurrentByteIndex
+            if count == 0 and kept is not None:
+                if position <= len(kept):
+                    with self.lock:
+                        self.prefix = bytes(kept[:position])
+                kept = None
+            elif count % CHECKPOINT_ROWS == 0 and self.prefix is not None:
+                self._checkpoint(count, prev, position)
+            r = attrs.get('r')
+            number = int(r) if r else prev + 1
+            count += 1
+            prev = number
+            if number >= last:
+                has_more = True
+                raise _StopSheet()
+            if number == 1 or number >= first:
+                builder = TreeBuilder()
+                builder.start(tag, {_qualified(k): v for k, v in attrs.items()})
+
+        def end(tag):
+            nonlocal builder, head
+            if builder is None:
+                return
+            tag = _qualified(tag)
+            builder.end(tag)
+            if tag != ROW_TAG:
+                return
+            values = _row_values(builder.close(), styles)
+            builder = None
+            if prev == 1:
+                head = values
+                if prefix is None:
+                    with self.lock:
+                        self.head = values
+            if prev >= first:
+                while first + len(rows) < prev:
+                    rows.append([])
+                rows.append(values)
+
+        def data(text):
+            if builder is not None:
+                builder.data(text)
+
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        parser.CharacterDataHandler = data
+        with zf.open(self.member) as f:
+            try:
+                if prefix is not None:
+                    parser.Parse(prefix, False)
+                    # 压缩流只能解压后丢弃来前进，按块跳过避免一次读入整段
+                    skip = offset
+                    while skip > 0:
+                        skipped = len(f.read(min(skip, READ_CHUNK)))
+                        if not skipped:
+                            break
+                        skip -= skipped
+                while True:
+                    chunk = f.read(READ_CHUNK)
+                    if kept is not None and len(kept) < SHEET_PREFIX_LIMIT:
+                        kept += chunk
+                    parser.Parse(chunk, not chunk)
+                    if not chunk:
+                        break
+            except _StopSheet:
+                # 窗口末尾的空行
+                while first + len(rows) < last:
+                    rows.append([])
+            except expat.ExpatError as e:
+                raise TableError(f'工作表解析失败：{e}')
+        return head, rows, has_more
+
+def sheet_index(path, member):
+    return cached_index(path, ('xlsx', path, member), lambda: SheetIndex(member))
+
+def read_xlsx(path, start, limit, sheet=None, header=True):
+    """
+    读取工作表中从第start行数据开始的limit行（header为真时第一行作为表头），
+    行号以工作表中的实际行号为准，中间的空行补为空行。
+    """
+    with zipfile.ZipFile(path) as zf:
+        sheets = workbook_sheets(zf)
+        if not sheets:
+            raise TableError('工作簿中没有工作表')
+        if sheet is None or sheet == '':
+            name, member = sheets[0]
+        elif sheet.isdigit() and int(sheet) < len(sheets):
+            name, member = sheets[int(sheet)]
+        else:
+            match = [s for s in sheets if s[0] == sheet]
+            if not match:
+                raise TableError('工作表不存在')
+            name, member = match[0]
+        if member not in zf.namelist():
+            raise TableError('工作表数据缺失')
+        styles = date_styles(zf)
+
+        first = 1 + (1 if header else 0) + start
+        head, rows, has_more = sheet_index(path, member).read(zf, first, first + limit, styles)
+        if not header:
+            head = None
+
+        # 只解析窗口内用到的共享字符串
+        wanted = {v[1] for r in ([head] if head else []) + rows for v in r if isinstance(v, tuple)}
+        strings = shared_strings(zf, wanted)
+        resolve = lambda r: [strings.get(v[1], '') if isinstance(v, tuple) else v for v in r]
+        head = resolve(head) if head else ([] if header else None)
+        rows = [resolve(r) for r in rows]
+        # 工作表的行数要读到末尾才能确定
+        total = None if has_more else start + len(rows)
+        result = build_table(head, rows, start, has_more, total)
+        result.update(format='xlsx', sheet=name, sheets=[s[0] for s in sheets])
+        return result
+
+def _row_values(row, styles):
+    values = []
+    for c in row.iter(NS_MAIN + 'c'):
+        col = column_index(c.get('r', '')) if c.get('r') else len(values)
+        while len(values) < col:
+            values.append(None)
+        values.append(_cell_value(c, styles))
+    return values
@@ -0,0 +1,135 @@
+# 反向代理卸载：响应头与 docs/nginx.conf.example 中的 internal location 对应，非ASCII文件名的Content-Disposition正确
+# 运行：在backend目录下执行 python -m unittest discover tests
+import os
+import re
+import shutil
+import sys
+import tempfile
+import unittest
+from urllib.parse import quote, unquote
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+from flask import Flask
+from config import config
+from offload import offload_response, MODE_ACCEL, MODE_SENDFILE
+
+NGINX_EXAMPLE = os.path.join(BACKEND, '..', 'docs', 'nginx.conf.example')
+# 示例中的backend目录占位路径
+EXAMPLE_BACKEND = '/path/to/backend/'
+NAMES = ['report.pdf', '季度报告 2024.xlsx', 'a "quoted" name.txt', 'naïve café.txt', '100%&#?.txt']
+
+def internal_locations():
+    """示例配置中的internal location：{location前缀: alias目录}"""
+    with open(NGINX_EXAMPLE, encoding='utf-8') as f:
+        text = f.read()
+    locations = {}
+    for prefix, body in re.findall(r'location\s+(\S+)\s*\{([^}]*)\}', text):
+        alias = re.search(r'^\s*alias\s+(\S+);', body, re.MULTILINE)
+        if re.search(r'^\s*internal;', body, re.MULTILINE) and alias:
+            locations[prefix] = alias.group(1)
+    return locations
+
+def content_disposition_name(value):
+    """按浏览器的规则取出Content-Disposition中的文件名：有filename*时优先使用"""
+    extended = re.search(r"filename\*=UTF-8''([^;\s]+)", value)
+    if extended:
+        return unquote(extended.group(1), errors='strict')
+    plain = re.search(r'filename="((?:[^"\\]|\\.)*)"', value)
+    return re.sub(r'\\(.)', r'\1', plain.group(1))
+
+class OffloadTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.locations = internal_locations()
+        self.folders = {}
+        for area in ('uploads', 'videos'):
+            self.folders[area] = os.path.join(self.root, area)
+            # 文件按存储索引分片存放在子目录中
+            os.makedirs(os.path.join(self.folders[area], 'ab'))
+        self.saved = {key: config.get(key) for key in ('offload_mode', 'offload_locations')}
+        self.app = Flask(__name__)
+
+        @self.app.route('/download/<area>/<path:name>')
+        def download(area, name):
+            path = os.path.join(self.folders[area], 'ab', name)
+            return offload_response(area, self.folders[area], path, name, True)
+
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        config.config.update(self.saved)
+        shutil.rmtree(self.root)
+
+    def create(self, area, name):
+        path = os.path.join(self.folders[area], 'ab', name)
+        with open(path, 'wb') as f:
+            f.write(b'data')
+        return path
+
+    def get(self, area, name):
+        response = self.client.get(f'/download/{area}/' + quote(name))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b'')
+        # 响应头在WSGI中只能是latin-1
+        for key, value in response.headers.items():
+            value.encode('latin-1')
+        return response
+
+    def example_path(self, alias, rest):
+        """按示例配置把alias中的backend目录换成测试目录后，nginx实际打开的文件路径"""
+        self.assertTrue(alias.startswith(EXAMPLE_BACKEND))
+        return os.path.join(self.root, alias[len(EXAMPLE_BACKEND):], rest)
+
+    def test_example_has_a_location_per_area(self):
+        for area in self.folders:
+            self.assertIn(f'/_protected/{area}/', self.locations)
+            self.assertEqual(self.locations[f'/_protected/{area}/'], f'{EXAMPLE_BACKEND}{area}/')
+
+    def test_accel_redirect_maps_onto_example_alias(self):
+        # offload_locations使用config.json中的值，与示例配置对照
+        config.config.update(offload_mode=MODE_ACCEL)
+        for area in self.folders:
+            for name in NAMES:
+                path = self.create(area, name)
+                response = self.get(area, name)
+                uri = response.headers['X-Accel-Redirect']
+                prefix = [p for p in self.locations if uri.startswith(p)]
+                self.assertEqual(len(prefix), 1, uri)
+                # nginx对X-Accel-Redirect中的URI先解码再按alias拼接路径
+                target = self.example_path(self.locations[prefix[0]], unquote(uri[len(prefix[0]):], errors='strict'))
+                self.assertTrue(os.path.samefile(target, path), (uri, target))
+                self.assertEqual(response.headers['X-Accel-Buffering'], 'no')
+
+    def test_sendfile_path_is_inside_example_alias(self):
+        config.config.update(offload_mode=MODE_SENDFILE)
+        for area in self.folders:
+            for name in NAMES:
+                path = self.create(area, name)
+                response = self.get(area, name)
+                # mod_xsendfile默认XSendFileUnescape On，先解码再打开文件
+                target = unquote(response.headers['X-Sendfile'], errors='strict')
+                self.assertTrue(os.path.samefile(target, path))
+                alias = self.example_path(self.locations[f'/_protected/{area}/'], '')
+                self.assertTrue(os.path.abspath(target).startswith(alias))
+
+    def test_content_disposition_keeps_name(self):
+        config.config.update(offload_mode=MODE_ACCEL)
+        for name in NAMES:
+            self.create('uploads', name)
+            value = self.get('uploads', name).headers['Content-Disposition']
+            self.assertTrue(value.startswith('attachment; '), value)
+            self.assertEqual(content_disposition_name(value), name)
+            # 不支持filename*的旧客户端也能拿到一个ASCII文件名
+            plain = re.search(r'filename="((?:[^"\\]|\\.)*)"', value)
+            self.assertIsNotNone(plain, value)
+            plain.group(1).encode('ascii')
+
+    def test_disabled_returns_none(self):
+        config.config.update(offload_mode='')
+        with self.app.test_request_context():
+            self.assertIsNone(offload_response('uploads', self.folders['uploads'], self.create('uploads', 'a.txt'), 'a.txt', True))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,202 @@
+# 视频转码：浏览器无法直接播放的格式（avi、wmv、mkv、flv）上传后在后台用本机ffmpeg转成H.264/AAC的MP4，
+# 并把索引信息移到文件开头（faststart），边下边播；转码结果保存在 videos/.renditions/ 下，预览时优先返回
+# 转码任务经后台任务队列执行，同时运行的ffmpeg进程数有上限（由任务队列在领取时限制），并以较低的CPU优先级运行，不影响上传下载
+import logging
+import os
+import shutil
+import subprocess
+import threading
+from config import config
+from jobs import job_queue
+from versioning import collection_versions
+
+RENDITION_DIR = '.renditions'
+# 需要转码的扩展名
+TRANSCODE_EXTENSIONS = set(['avi', 'wmv', 'mkv', 'flv'])
+# 转码结果的MIME类型
+RENDITION_MIMETYPE = 'video/mp4'
+
+def ffmpeg_command(ffmpeg, source, target):
+    return [
+        ffmpeg, '-hide_banner', '-nostdin', '-y', '-i', source,
+        '-map', '0:v:0', '-map', '0:a:0?',
+        '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-pix_fmt', 'yuv420p',
+        # 奇数宽高无法用yuv420p编码
+        '-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2',
+        '-c:a', 'aac', '-b:a', '128k', '-ac', '2',
+        '-movflags', '+faststart',
+        '-progress', 'pipe:1', '-nostats',
+        '-f', 'mp4', target
+    ]
+
+def start_low_priority(command, nice, **kwargs):
+    """
+    以较低的CPU优先级启动子进程。
+    不用preexec_fn（有其他线程在运行时fork后执行Python代码可能死锁），而是启动后再调整子进程的优先级
+    """
+    if os.name == 'nt':
+        return subprocess.Popen(command, creationflags=subprocess.BELOW_NORMAL_PRIORITY_CLASS, **kwargs)
+    process = subprocess.Popen(command, **kwargs)
+    try:
+        os.setpriority(os.PRIO_PROCESS, process.pid, min(os.getpriority(os.PRIO_PROCESS, 0) + nice, 19))
+    except OSError as e:
+        logging.warning(f'降低转码进程优先级失败: {e}')
+    return process
+
+class Transcoder:
+    def __init__(self, folder, collection, locate):
+        """
+        folder: 视频目录；collection: 视频集合名（转码完成后递增版本号，列表中的状态随之更新）
+        locate: 文件名 -> 原视频路径，不存在时返回None
+        """
+        self.folder = folder
+        self.collection = collection
+        self.locate = locate
+        # 多个任务工作线程同时更新
+        self.stats_lock = threading.Lock()
+        self.stats = {'completed': 0, 'failed': 0, 'running': 0}
+
+    @property
+    def enabled(self):
+        return bool(config.get('transcode_enabled', False))
+
+    @property
+    def ffmpeg(self):
+        return shutil.which(config.get('ffmpeg_path', 'ffmpeg') or 'ffmpeg')
+
+    @staticmethod
+    def max_running():
+        # 同时运行的ffmpeg进程数上限，注册任务类型时交给任务队列，领取时检查
+        return max(int(config.get('transcode_max_concurrent', 1)), 1)
+
+    @staticmethod
+    def needs_transcode(filename):
+        return '.' in filename and filename.rsplit('.', 1)[1].lower() in TRANSCODE_EXTENSIONS
+
+    def rendition_path(self, filename):
+        return os.path.join(self.folder, RENDITION_DIR, filename + '.mp4')
+
+    def ready_rendition(self, filename, source_path=None):
+        """已完成且不旧于原视频的转码结果路径，没有时返回None"""
+        path = self.rendition_path(filename)
+        try:
+            rendition_mtime = os.stat(path).st_mtime
+        except OSError:
+            return None
+        source_path = source_path or self.locate(filename)
+        if source_path is None or os.stat(source_path).st_mtime > rendition_mtime:
+            return None
+        return path
+
+    def status(self, filename, source_path=None):
+        """列表中显示的转码状态：ready已可播放，pending等待或转码中，None不需要转码"""
+        if not self.needs_transcode(filename):
+            return None
+        if self.ready_rendition(filename, source_path):
+            return 'ready'
+        return 'pending' if self.enabled else None
+
+    def schedule(self, filename):
+        """需要转码且尚未转码时加入后台任务，返回任务号；不需要或未启用时返回None"""
+        if not self.enabled or not self.needs_transcode(filename):
+            return None
+        source = self.locate(filename)
+        if source is None or self.ready_rendition(filename, source):
+            return None
+        try:
+            return job_queue.enqueue('transcode', {'name': filename}, priority=-1,
+                                     dedup_key=f'transcode:{filename}:{os.stat(source).st_mtime_ns}')
+        except Exception as e:
+            logging.warning(f'加入转码任务失败 {filename}: {e}')
+            return None
+
+    def remove(self, filename):
+        try:
+            os.remove(self.rendition_path(filename))
+        except OSError:
+            pass
+
+    def on_change(self, collection, changes):
+        """视频增删改（上传、批量操作、保留数量清理等）时同步转码结果：删除的清理，新增的加入转码"""
+        if collection != self.collection or changes is None:
+            return
+        try:
+            for op, name in changes:
+                if op == 'remove':
+                    self.remove(name)
+                else:
+                    self.schedule(name)
+        except Exception as e:
+            logging.warning(f'同步转码结果失败: {e}')
+
+    def run_job(self, context):
+        filename = context.payload['name']
+        source = self.locate(filename)
+        if source is None:
+            return {'skipped': '原视频已不存在'}
+        ffmpeg = self.ffmpeg
+        if ffmpeg is None:
+            raise RuntimeError('未找到ffmpeg，请安装或在config.json中设置ffmpeg_path')
+        target = self.rendition_path(filename)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = f'{target}.{os.getpid()}.tmp'
+        duration = self.probe_duration(ffmpeg, source)
+        self._count('running', 1)
+        try:
+            self._run_ffmpeg(context, ffmpeg, source, tmp, duration)
+            os.replace(tmp, target)
+        except Exception:
+            self._count('failed', 1)
+            raise
+        finally:
+            self._count('running', -1)
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self._count('completed', 1)
+        collection_versions.bump(self.collection, [('update', filename)])
+        return {'rendition': os.path.basename(target), 'size': os.path.getsize(target)}
+
+    def _count(self, key, delta):
+        with self.stats_lock:
+            self.stats[key] += delta
+
+    def probe_duration(self, ffmpeg, source):
+        """用ffprobe读取时长（秒），用于计算进度；没有ffprobe或读取失败时返回None"""
+        ffprobe = shutil.which(os.path.join(os.path.dirname(ffmpeg), 'ffprobe')) or shutil.which('ffprobe')
+        if ffprobe is None:
+            return None
+        try:
+            out = subprocess.run([ffprobe, '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', source],
+                                 capture_output=True, text=True, timeout=60).stdout
+            return float(out.strip()) or None
+        except (OSError, ValueError, subprocess.TimeoutExpired):
+            return None
+
+    def _run_ffmpeg(self, context, ffmpeg, source, tmp, duration):
+        process = start_low_priority(ffmpeg_command(ffmpeg, source, tmp), int(config.get('transcode_nice', 10)),
+                                     stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        # stderr单独读取，避免缓冲区写满导致ffmpeg阻塞；只保留最后几行用于报错
+        tail = []
+        def drain():
+            for line in process.stderr:
+                tail.append(line.rstrip())
+                del tail[:-20]
+        reader = threading.Thread(target=drain, daemon=True)
+        reader.start()
+        try:
+            # -progress 每隔约0.5秒输出一组 key=value，out_time_us为已转码的时长
+            for line in process.stdout:
+                key, _, value = line.strip().partition('=')
+                if key == 'out_time_us' and duration and value.isdigit():
+                    context.progress(int(value) / 1000000 / duration * 0.99)
+                elif key == 'progress' and context.cancelled():
+                    process.kill()
+                    raise RuntimeError('转码已取消')
+            process.wait()
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            reader.join(timeout=5)
+        if process.returncode != 0:
+            raise RuntimeError(f'ffmpeg转码失败（退出码{process.returncode}）: ' + ' | '.join(tail[-3:]))
@@ -0,0 +1,123 @@
+# 集合版本号：文件列表、视频列表、当前消息、历史消息在每次变更时递增版本号
+# 列表接口据此生成弱ETag（同一集合不同查询参数的响应不同，ETag中带有查询参数的摘要），命中If-None-Match时直接返回304，不做任何文件系统和JSON处理
+# 同时为每个集合保留有界的变更日志，支持 ?since=<版本号> 的增量同步
+# 版本号、变更时间和变更日志保存在跨进程共享状态中，多个工作进程看到的是同一个版本号和同一份变更日志
+import hashlib
+import time
+from urllib.parse import urlencode
+from functools import wraps
+from flask import request, make_response
+from shared_state import shared_state, shared_changelog
+
+# 根据距上次变更的时间给出建议的轮询间隔（秒）：(距上次变更不超过多少秒, 建议间隔)
+POLL_INTERVAL_STEPS = [(30, 2), (300, 5), (1800, 15)]
+IDLE_POLL_INTERVAL = 30
+
+class CollectionVersions:
+    def __init__(self):
+        # 共享状态标识，共享状态文件重建后旧ETag全部失效
+        self.epoch = format(shared_state.get('epoch'), '08x')
+        # 本进程内集合变更时的回调，参数为(集合名, changes)
+        self.listeners = []
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def get(self, name):
+        return shared_state.get(f'version:{name}')
+
+    def bump(self, name, changes=None):
+        """
+        集合发生变更时调用，返回新版本号。
+        changes: [(操作, 条目名)]，操作为add/update/remove；
+        为None表示变更内容未知，跨越该版本的增量同步会退化为全量。
+        """
+        version = shared_state.increment(f'version:{name}', {f'changed_at:{name}': time.time() * 1000},
+                                         lambda value: shared_changelog.append(name, value, changes))
+        for listener in self.listeners:
+            listener(name, changes)
+        return version
+
+    def changes_since(self, name, since, epoch=None):
+        """
+        汇总since之后的变更，返回(当前版本号, {条目名: added/updated/removed})。
+        变更日志无法完整覆盖（版本过旧、含未知变更）时，变更部分返回None。
+        """
+        current = self.get(name)
+        if (epoch is not None and epoch != self.epoch) or since < 0 or since > current:
+            return current, None
+        entries = shared_changelog.read(name, since, current)
+        if entries is None:
+            return current, None
+        result = {}
+        for _, changes in entries:
+            if changes is None:
+                return current, None
+            for op, item in changes:
+                state = result.get(item)
+                if op == 'add':
+                    # 同名条目先删后加，对客户端来说是更新
+                    result[item] = 'updated' if state == 'removed' else 'added'
+                elif op == 'update':
+                    if state != 'added':
+                        result[item] = 'updated'
+                elif op == 'remove':
+                    if state == 'added':
+                        del result[item]
+                    else:
+                        result[item] = 'removed'
+        return current, result
+
+    def etag(self, name, version=None, args=None):
+        """
+        args: 查询参数（MultiDict），分页、排序、筛选不同的响应内容不同，
+        按参数名排序后取摘要放入ETag，只按ETag缓存的客户端也不会把其他查询的304当作本次结果
+        """
+        if version is None:
+            version = self.get(name)
+        tag = f'{self.epoch}-{name}-{version}'
+        if args:
+            query = urlencode(sorted(args.items(multi=True)))
+            tag += '-' + hashlib.sha1(query.encode('utf-8')).hexdigest()[:12]
+        return tag
+
+    def poll_interval(self, name):
+        """集合越活跃，建议的轮询间隔越短"""
+        changed_at = shared_state.get(f'changed_at:{name}')
+        if not changed_at:
+            return IDLE_POLL_INTERVAL
+        idle = time.time() - changed_at / 1000
+        for limit, interval in POLL_INTERVAL_STEPS:
+            if idle <= limit:
+                return interval
+        return IDLE_POLL_INTERVAL
+
+    def _decorate(self, response, name, tag):
+        response.set_etag(tag, weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Poll-Interval'] = str(self.poll_interval(name))
+        return response
+
+    def conditional(self, name, volatile=None):
+        """
+        装饰器：为列表类GET接口提供ETag/304支持。
+        volatile: 返回True时本次请求的结果不只取决于版本号（如按热度排序），不做缓存协商
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if volatile is not None and volatile():
+                    return view(*args, **kwargs)
+                # 先取版本号再生成内容，生成期间若有变更，下次请求自然不会命中
+                tag = self.etag(name, args=request.args)
+                if request.if_none_match.contains_weak(tag):
+                    return self._decorate(make_response('', 304), name, tag)
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200:
+                    self._decorate(response, name, tag)
+                return response
+            return wrapper
+        return decorator
+
+# 全局版本号实例，各API模块共用
+collection_versions = CollectionVersions()
@@ -28,4 +28,46 @@ apiClient.interceptors.response.use(
   }
 );
 
-export default apiClient; 
\ No newline at end of file
+export default apiClient;
+
+// 按URL缓存上一次的ETag和响应数据，用于条件请求
+const etagCache = new Map<string, { etag: string; data: any }>();
+// 增量同步的URL随版本号变化，限制缓存条数，超出时淘汰最早的
+const ETAG_CACHE_SIZE = 50;
+
+/**
+ * 发送带If-None-Match的GET请求，服务端返回304时复用上一次的数据
+ * @param url 请求地址
+ * @returns Promise<AxiosResponse>，304时data为缓存数据
+ */
+export async function getWithETag<T>(url: string) {
+  const cached = etagCache.get(url);
+  const response = await apiClient.get<T>(url, {
+    headers: cached ? { 'If-None-Match': cached.etag } : {},
+    validateStatus: (status) => (status >= 200 && status < 300) || status === 304
+  });
+  if (response.status === 304 && cached) {
+    response.data = cached.data;
+  } else {
+    const etag = response.headers['etag'];
+    if (etag) {
+      etagCache.delete(url);
+      etagCache.set(url, { etag, data: response.data });
+      if (etagCache.size > ETAG_CACHE_SIZE) {
+        etagCache.delete(etagCache.keys().next().value as string);
+      }
+    }
+  }
+  return response;
+}
+
+/**
+ * 读取服务端建议的轮询间隔（X-Poll-Interval，单位秒）
+ * @param response 接口响应
+ * @param fallback 未提供时使用的默认间隔（毫秒）
+ * @returns 轮询间隔（毫秒）
+ */
+export function pollIntervalOf(response: { headers: any }, fallback: number) {
+  const seconds = parseInt(response.headers?.['x-poll-interval'], 10);
+  return Number.isFinite(seconds) && seconds > 0 ? seconds * 1000 : fallback;
+}
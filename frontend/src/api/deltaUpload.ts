@@ -0,0 +1,126 @@
+// deltaUpload.ts
+// 增量上传（rsync风格）：获取服务端已有文件的分块签名，用滚动adler32在新文件中查找相同的块，
+// 只上传复制指令和变化的数据，服务端边接收边重建新文件
+
+import apiClient from './config';
+import { sha256, sha256Hex, toHex } from './sha256';
+
+interface Signature {
+  size: number;
+  block_size: number;
+  base_token: string;
+  blocks: [number, string][]; // [adler32, SHA-256前16字节的十六进制]
+}
+
+const MOD_ADLER = 65521;
+// 变化的数据超过新文件的该比例时，增量上传不划算，交给普通上传
+const MAX_LITERAL_RATIO = 0.7;
+// 单条数据指令的最大长度
+const MAX_LITERAL_CHUNK = 1024 * 1024;
+
+/**
+ * 计算增量指令：与旧文件相同的整块输出复制指令（连续块合并），其余作为新数据
+ * @returns 指令片段列表和新数据总字节数
+ */
+function computeDelta(data: Uint8Array, sig: Signature) {
+  const size = sig.block_size;
+  const table = new Map<number, [number, string][]>();
+  sig.blocks.forEach(([weak, strong], index) => {
+    const list = table.get(weak);
+    if (list) list.push([index, strong]); else table.set(weak, [[index, strong]]);
+  });
+
+  const parts: BlobPart[] = [];
+  let literalBytes = 0;
+  let copyStart = -1, copyCount = 0;
+  const flushCopy = () => {
+    if (copyCount === 0) return;
+    const rec = new DataView(new ArrayBuffer(9));
+    rec.setUint8(0, 0x43); // 'C'
+    rec.setUint32(1, copyStart);
+    rec.setUint32(5, copyCount);
+    parts.push(rec.buffer);
+    copyCount = 0;
+  };
+  const pushLiteral = (start: number, end: number) => {
+    for (let p = start; p < end; p += MAX_LITERAL_CHUNK) {
+      const chunk = data.subarray(p, Math.min(end, p + MAX_LITERAL_CHUNK));
+      flushCopy();
+      const head = new DataView(new ArrayBuffer(5));
+      head.setUint8(0, 0x44); // 'D'
+      head.setUint32(1, chunk.length);
+      parts.push(head.buffer, chunk);
+      literalBytes += chunk.length;
+    }
+  };
+
+  const n = data.length;
+  let pos = 0, literalStart = 0;
+  let a = 1, b = 0;
+  const init = (at: number) => {
+    a = 1; b = 0;
+    for (let i = at; i < at + size; i++) {
+      a = (a + data[i]) % MOD_ADLER;
+      b = (b + a) % MOD_ADLER;
+    }
+  };
+  if (n >= size) init(0);
+  while (pos + size <= n) {
+    const weak = ((b << 16) | a) >>> 0;
+    const candidates = table.get(weak);
+    let match = -1;
+    if (candidates) {
+      const strong = toHex(sha256(data.subarray(pos, pos + size)).subarray(0, 16));
+      const hit = candidates.find(([, s]) => s === strong);
+      if (hit) match = hit[0];
+    }
+    if (match >= 0) {
+      if (literalStart < pos) pushLiteral(literalStart, pos);
+      if (copyCount > 0 && copyStart + copyCount === match) {
+        copyCount++;
+      } else {
+        flushCopy();
+        copyStart = match;
+        copyCount = 1;
+      }
+      pos += size;
+      literalStart = pos;
+      if (pos + size <= n) init(pos);
+      continue;
+    }
+    if (pos + size >= n) break;
+    // 滚动更新：移出data[pos]，移入data[pos + size]
+    const out = data[pos], incoming = data[pos + size];
+    a = (a - out + incoming + MOD_ADLER) % MOD_ADLER;
+    b = (b - ((size * out) % MOD_ADLER) + a - 1 + 2 * MOD_ADLER) % MOD_ADLER;
+    pos++;
+  }
+  if (literalStart < n) pushLiteral(literalStart, n);
+  flushCopy();
+  parts.push(new Uint8Array([0x45])); // 'E'
+  return { parts, literalBytes };
+}
+
+/**
+ * 以服务端已有文件为基准增量上传新版本
+ * @param file 新文件
+ * @param baseName 服务端已有的同名（或旧版本）文件名
+ * @returns 上传结果；变化太大不划算时返回null，由调用方改用普通上传
+ */
+export async function uploadFileDelta(file: File, baseName: string) {
+  const sig = (await apiClient.get<Signature>(`/api/file/signature/${encodeURIComponent(baseName)}`)).data;
+  if (sig.blocks.length === 0) return null;
+  const data = new Uint8Array(await file.arrayBuffer());
+  const { parts, literalBytes } = computeDelta(data, sig);
+  if (literalBytes > data.length * MAX_LITERAL_RATIO) return null;
+  const params = new URLSearchParams({
+    name: file.name,
+    block_size: String(sig.block_size),
+    base_token: sig.base_token,
+    sha256: await sha256Hex(data)
+  });
+  return apiClient.post(`/api/file/delta/${encodeURIComponent(baseName)}?${params}`, new Blob(parts), {
+    headers: { 'Content-Type': 'application/octet-stream' },
+    timeout: 0
+  });
+}
@@ -2,35 +2,50 @@
 // 文件相关API封装，提供文件上传、列表、下载、预览、删除、最大数量设置等方法
 // 用于前端与后端文件API交互
 
-import apiClient from './config';
+import apiClient, { getWithETag } from './config';
+import { enqueueUpload } from './uploadQueue';
+import { rangeDownload, type DownloadProgress } from './rangeDownload';
+import { sinceQuery, listQuery, type ListQuery, type ListPage, type ListSyncResponse, type ListSyncState } from './listSync';
 
 export interface FileInfo {
   name: string;
   size: number;
   modified: number;
+  stored_size?: number; // 磁盘实际占用，压缩存储时小于size
+  compressed?: boolean;
 }
 
 /**
- * 上传文件
+ * 上传文件（经上传队列排队，服务端繁忙时自动重试）
  * @param file 文件对象
  * @returns Promise<AxiosResponse>
  */
 export function uploadFile(file: File) {
   const formData = new FormData();
   formData.append('file', file);
-  return apiClient.post('/api/file/upload', formData, {
+  return enqueueUpload(() => apiClient.post('/api/file/upload', formData, {
     headers: {
       'Content-Type': undefined // 让axios自动设置multipart/form-data
     }
-  });
+  }));
+}
+
+/**
+ * 获取文件列表（带ETag条件请求，列表未变化时服务端返回304）
+ * @param query 分页、排序、筛选条件（可选，不传时返回全部，按修改时间倒序）
+ * @returns Promise<AxiosResponse<{files: FileInfo[], total: number, next_cursor: string | null}>>
+ */
+export function listFiles(query?: ListQuery) {
+  return getWithETag<{files: FileInfo[]} & ListPage>('/api/file/list' + listQuery(query));
 }
 
 /**
- * 获取文件列表
- * @returns Promise<AxiosResponse<{files: any[]}>>
+ * 增量同步文件列表，只返回上次同步之后新增、更新、删除的文件
+ * @param state 同步状态（版本号为null时拉取全量）
+ * @returns Promise<AxiosResponse<ListSyncResponse<FileInfo>>>
  */
-export function listFiles() {
-  return apiClient.get<{files: FileInfo[]}>('/api/file/list');
+export function syncFiles(state: ListSyncState) {
+  return getWithETag<ListSyncResponse<FileInfo>>('/api/file/list' + sinceQuery(state));
 }
 
 /**
@@ -42,13 +57,83 @@ export function downloadFile(name: string) {
   return `/api/file/download/${encodeURIComponent(name)}`;
 }
 
+/**
+ * 分段并行下载文件（多个Range请求同时下载，拼接后用服务端提供的SHA-256校验），适合大文件
+ * @param name 文件名
+ * @param onProgress 进度回调（可选）
+ * @returns Promise<boolean>，服务端不支持分段下载时为false，需改用downloadFile的链接普通下载
+ */
+export function downloadFileAccelerated(name: string, onProgress?: (progress: DownloadProgress) => void) {
+  return rangeDownload(downloadFile(name), name, onProgress);
+}
+
 /**
  * 获取文件预览链接
  * @param name 文件名
+ * @param original 图片是否返回原图（默认返回服务端生成的网页缩小版本，尚未生成时为原图）
  * @returns 预览URL
  */
-export function previewFile(name: string) {
-  return `/api/file/preview/${encodeURIComponent(name)}`;
+export function previewFile(name: string, original = false) {
+  return `/api/file/preview/${encodeURIComponent(name)}` + (original ? '?original=1' : '');
+}
+
+export interface ArchiveEntry {
+  path: string;
+  size: number;
+  compressed_size: number;
+  is_dir: boolean;
+  modified: string;
+}
+
+/**
+ * 列出ZIP压缩包内的条目（服务端只读取中央目录，不解压）
+ * @param name 压缩包文件名
+ * @returns Promise<AxiosResponse<{entries: ArchiveEntry[], truncated: boolean}>>
+ */
+export function listArchive(name: string) {
+  return apiClient.get<{name: string, entries: ArchiveEntry[], truncated: boolean}>(`/api/file/archive/${encodeURIComponent(name)}`);
+}
+
+export interface TableColumn {
+  name: string;
+  type: 'integer' | 'number' | 'boolean' | 'date' | 'string' | 'empty';
+}
+
+export interface TablePreview {
+  name: string;
+  format: 'csv' | 'xlsx';
+  columns: TableColumn[];
+  rows: (string | number | boolean | null)[][];
+  start: number;
+  limit: number;
+  has_more: boolean;
+  total_rows: number | null;
+  sheet?: string;
+  sheets?: string[];
+}
+
+/**
+ * 表格预览：按行窗口读取CSV/XLSX（服务端流式读取，不加载整个文件）
+ * @param name 文件名
+ * @param start 起始数据行（从0开始）
+ * @param limit 行数（最多1000）
+ * @param sheet XLSX工作表名，默认第一个
+ * @returns Promise<AxiosResponse<TablePreview>>
+ */
+export function previewTable(name: string, start = 0, limit = 100, sheet?: string) {
+  return apiClient.get<TablePreview>(`/api/file/table/${encodeURIComponent(name)}`, {
+    params: { start, limit, sheet }
+  });
+}
+
+/**
+ * 获取压缩包内单个条目的下载链接（服务端边解压边传输）
+ * @param name 压缩包文件名
+ * @param path 条目在压缩包内的路径
+ * @returns 下载URL
+ */
+export function archiveEntryUrl(name: string, path: string) {
+  return `/api/file/archive/${encodeURIComponent(name)}/entry?path=${encodeURIComponent(path)}`;
 }
 
 /**
@@ -58,4 +143,34 @@ export function previewFile(name: string) {
  */
 export function deleteFile(name: string) {
   return apiClient.delete(`/api/file/delete/${encodeURIComponent(name)}`);
-} 
\ No newline at end of file
+}
+
+export type BatchOperation =
+  | { op: 'delete', name: string }
+  | { op: 'rename', name: string, new_name: string }
+  | { op: 'move', name: string, to: 'file' | 'video', new_name?: string };
+
+export interface BatchResult {
+  index: number;
+  op: string;
+  name: string;
+  status: number; // 200表示成功
+  error?: string;
+  new_name?: string;
+  to?: string;
+}
+
+export interface BatchResponse {
+  results: BatchResult[];
+  succeeded: number;
+  failed: number;
+}
+
+/**
+ * 批量删除、重命名文件，或移动到视频区（一次请求，逐项返回结果）
+ * @param operations 操作列表
+ * @returns Promise<AxiosResponse<BatchResponse>>
+ */
+export function batchFiles(operations: BatchOperation[]) {
+  return apiClient.post<BatchResponse>('/api/file/batch', { operations });
+}
@@ -0,0 +1,98 @@
+// listSync.ts
+// 列表增量同步：首次拉取全量，之后带 ?since=<版本号> 只拉取变化的条目并就地应用到列表
+
+export interface ListEntry {
+  name: string;
+  modified: number;
+}
+
+export interface ListSyncResponse<T> {
+  full: boolean;
+  version: number;
+  epoch: string;
+  added?: T[];
+  updated?: T[];
+  removed?: string[];
+  [key: string]: any;
+}
+
+export interface ListSyncState {
+  version: number | null;
+  epoch: string;
+}
+
+/**
+ * 构造增量同步的查询参数，尚未同步过时返回空串（拉取全量）
+ * @param state 当前同步状态
+ * @returns 查询字符串
+ */
+export function sinceQuery(state: ListSyncState) {
+  if (state.version === null) return '';
+  return `?since=${state.version}&epoch=${encodeURIComponent(state.epoch)}`;
+}
+
+/**
+ * 将服务端返回的全量或增量结果就地应用到列表，并更新同步状态
+ * @param list 当前列表（响应式数组，会被原地修改）
+ * @param data 服务端响应
+ * @param key 全量结果所在字段，如files、videos
+ * @param state 同步状态
+ */
+export function applyListSync<T extends ListEntry>(list: T[], data: ListSyncResponse<T>, key: string, state: ListSyncState) {
+  if (data.full !== false) {
+    list.splice(0, list.length, ...(data[key] || []));
+  } else {
+    const removed = new Set(data.removed || []);
+    const changed = new Map<string, T>();
+    for (const entry of [...(data.added || []), ...(data.updated || [])]) {
+      changed.set(entry.name, entry);
+    }
+    for (let i = list.length - 1; i >= 0; i--) {
+      const name = list[i].name;
+      if (removed.has(name)) {
+        list.splice(i, 1);
+      } else if (changed.has(name)) {
+        list[i] = changed.get(name) as T;
+        changed.delete(name);
+      }
+    }
+    if (changed.size > 0) {
+      list.push(...changed.values());
+      // 按修改时间排序，最新的在前
+      list.sort((a, b) => b.modified - a.modified);
+    }
+  }
+  if (typeof data.version === 'number') {
+    state.version = data.version;
+    state.epoch = data.epoch;
+  }
+}
+
+export interface ListQuery {
+  limit?: number; // 每页条数，最多1000；不传时返回全部
+  cursor?: string; // 上一页返回的next_cursor
+  sort?: 'mtime' | 'size' | 'name' | 'popularity'; // popularity按下载热度（最近访问次数按时间衰减）
+  order?: 'asc' | 'desc';
+  type?: string; // 文件分类：image/document/archive/audio/text，逗号分隔
+  ext?: string; // 扩展名，逗号分隔
+  ip?: string; // 上传IP
+}
+
+export interface ListPage {
+  total: number;
+  next_cursor: string | null;
+}
+
+/**
+ * 构造分页、排序、筛选的查询参数
+ * @param query 查询条件
+ * @returns 查询字符串（无条件时为空串）
+ */
+export function listQuery(query: ListQuery = {}) {
+  const params = new URLSearchParams();
+  for (const [key, value] of Object.entries(query)) {
+    if (value !== undefined && value !== null && value !== '') params.set(key, String(value));
+  }
+  const qs = params.toString();
+  return qs ? `?${qs}` : '';
+}
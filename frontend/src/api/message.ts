@@ -2,7 +2,7 @@
 // 消息相关API封装，提供发送消息、获取当前消息、获取历史消息等方法
 // 用于前端与后端消息API交互
 
-import apiClient from './config';
+import apiClient, { getWithETag } from './config';
 
 export interface MessageHistory {
   text: string;
@@ -19,17 +19,17 @@ export function sendMessage(text: string) {
 }
 
 /**
- * 获取当前最新消息
+ * 获取当前最新消息（带ETag条件请求）
  * @returns Promise<AxiosResponse<{text: string}>>
  */
 export function getMessage() {
-  return apiClient.get<{text: string}>('/api/message/');
+  return getWithETag<{text: string}>('/api/message/');
 }
 
 /**
- * 获取历史消息记录
+ * 获取历史消息记录（带ETag条件请求）
  * @returns Promise<AxiosResponse<{history: any[]}>>
  */
 export function getMessageHistory() {
-  return apiClient.get<{history: MessageHistory[]}>('/api/message/history');
+  return getWithETag<{history: MessageHistory[]}>('/api/message/history');
 } 
\ No newline at end of file
@@ -0,0 +1,98 @@
+// sha256.ts
+// SHA-256（纯JS实现，局域网HTTP下浏览器不提供crypto.subtle）
+// 支持分段输入，大文件可以边下载边计算，不必先拼成一整块内存
+
+const K = new Uint32Array([
+  0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+  0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+  0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+  0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+  0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+  0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+  0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+  0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2
+]);
+
+export class Sha256 {
+  private h = new Uint32Array([
+    0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19
+  ]);
+  private w = new Uint32Array(64);
+  // 不足一个64字节分组的剩余数据
+  private buffer = new Uint8Array(64);
+  private buffered = 0;
+  private total = 0;
+
+  update(data: Uint8Array) {
+    let pos = 0;
+    this.total += data.length;
+    if (this.buffered > 0) {
+      const take = Math.min(64 - this.buffered, data.length);
+      this.buffer.set(data.subarray(0, take), this.buffered);
+      this.buffered += take;
+      pos = take;
+      if (this.buffered < 64) return this;
+      this.block(new DataView(this.buffer.buffer), 0);
+      this.buffered = 0;
+    }
+    const view = new DataView(data.buffer, data.byteOffset, data.byteLength);
+    for (; pos + 64 <= data.length; pos += 64) this.block(view, pos);
+    this.buffer.set(data.subarray(pos));
+    this.buffered = data.length - pos;
+    return this;
+  }
+
+  digest(): Uint8Array {
+    const total = this.total;
+    const tail = new Uint8Array(this.buffered < 56 ? 64 : 128);
+    tail.set(this.buffer.subarray(0, this.buffered));
+    tail[this.buffered] = 0x80;
+    const view = new DataView(tail.buffer);
+    view.setUint32(tail.length - 8, Math.floor(total / 0x20000000));
+    view.setUint32(tail.length - 4, (total << 3) >>> 0);
+    for (let offset = 0; offset < tail.length; offset += 64) this.block(view, offset);
+    const out = new Uint8Array(32);
+    const outView = new DataView(out.buffer);
+    this.h.forEach((v, i) => outView.setUint32(i * 4, v));
+    return out;
+  }
+
+  private block(view: DataView, offset: number) {
+    const w = this.w, h = this.h;
+    for (let i = 0; i < 16; i++) w[i] = view.getUint32(offset + i * 4);
+    for (let i = 16; i < 64; i++) {
+      const x = w[i - 15], y = w[i - 2];
+      const s0 = ((x >>> 7) | (x << 25)) ^ ((x >>> 18) | (x << 14)) ^ (x >>> 3);
+      const s1 = ((y >>> 17) | (y << 15)) ^ ((y >>> 19) | (y << 13)) ^ (y >>> 10);
+      w[i] = (w[i - 16] + s0 + w[i - 7] + s1) >>> 0;
+    }
+    let a = h[0], b = h[1], c = h[2], d = h[3], e = h[4], f = h[5], g = h[6], k = h[7];
+    for (let i = 0; i < 64; i++) {
+      const S1 = ((e >>> 6) | (e << 26)) ^ ((e >>> 11) | (e << 21)) ^ ((e >>> 25) | (e << 7));
+      const t1 = (k + S1 + ((e & f) ^ (~e & g)) + K[i] + w[i]) >>> 0;
+      const S0 = ((a >>> 2) | (a << 30)) ^ ((a >>> 13) | (a << 19)) ^ ((a >>> 22) | (a << 10));
+      const t2 = (S0 + ((a & b) ^ (a & c) ^ (b & c))) >>> 0;
+      k = g; g = f; f = e; e = (d + t1) >>> 0;
+      d = c; c = b; b = a; a = (t1 + t2) >>> 0;
+    }
+    h[0] += a; h[1] += b; h[2] += c; h[3] += d; h[4] += e; h[5] += f; h[6] += g; h[7] += k;
+  }
+}
+
+export function sha256(data: Uint8Array): Uint8Array {
+  return new Sha256().update(data).digest();
+}
+
+export function toHex(bytes: Uint8Array) {
+  return Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+}
+
+/**
+ * 计算整块数据的SHA-256十六进制串，浏览器提供crypto.subtle时用原生实现
+ */
+export async function sha256Hex(data: Uint8Array) {
+  if (globalThis.crypto?.subtle) {
+    return toHex(new Uint8Array(await crypto.subtle.digest('SHA-256', data)));
+  }
+  return toHex(sha256(data));
+}
@@ -0,0 +1,70 @@
+// uploadQueue.ts
+// 上传队列，限制浏览器端同时进行的上传数量
+// 服务端准入控制返回429/503时，按Retry-After等待后自动重试
+
+const MAX_CONCURRENT_UPLOADS = 2
+const MAX_RETRIES = 5
+const DEFAULT_RETRY_AFTER = 5
+
+type UploadTask<T> = () => Promise<T>
+
+let running = 0
+const waiting: Array<() => void> = []
+
+/**
+ * 从错误中解析重试等待秒数，兼容axios错误和XHR封装的错误
+ * @param error 上传失败时抛出的错误
+ * @returns 需要等待的秒数，不可重试时返回null
+ */
+function retryDelayOf(error: any): number | null {
+  const status = error?.response?.status ?? error?.status
+  if (status !== 429 && status !== 503) return null
+  const header = error?.response?.headers?.['retry-after'] ?? error?.retryAfter
+  const seconds = parseInt(header, 10)
+  return Number.isFinite(seconds) && seconds > 0 ? seconds : DEFAULT_RETRY_AFTER
+}
+
+function sleep(seconds: number) {
+  return new Promise(resolve => setTimeout(resolve, seconds * 1000))
+}
+
+async function acquireSlot() {
+  if (running < MAX_CONCURRENT_UPLOADS) {
+    running++
+    return
+  }
+  await new Promise<void>(resolve => waiting.push(resolve))
+}
+
+function releaseSlot() {
+  const next = waiting.shift()
+  if (next) {
+    next()
+  } else {
+    running--
+  }
+}
+
+/**
+ * 将上传任务加入队列，排队执行，遇到服务端繁忙时自动重试
+ * @param task 实际执行上传的函数
+ * @param onWait 等待重试时的回调，参数为等待秒数
+ * @returns 上传任务的结果
+ */
+export async function enqueueUpload<T>(task: UploadTask<T>, onWait?: (seconds: number) => void): Promise<T> {
+  await acquireSlot()
+  try {
+    for (let attempt = 0; ; attempt++) {
+      try {
+        return await task()
+      } catch (error: any) {
+        const delay = retryDelayOf(error)
+        if (delay === null || attempt >= MAX_RETRIES) throw error
+        onWait?.(delay)
+        await sleep(delay)
+      }
+    }
+  } finally {
+    releaseSlot()
+  }
+}
@@ -2,31 +2,46 @@
 // 视频相关API封装，提供视频上传、列表、下载、预览、删除、最大数量设置等方法
 // 用于前端与后端视频API交互
 
-import apiClient from './config';
+import apiClient, { getWithETag } from './config';
+import { enqueueUpload } from './uploadQueue';
+import { rangeDownload, type DownloadProgress } from './rangeDownload';
+import { sinceQuery, listQuery, type ListQuery, type ListPage, type ListSyncResponse, type ListSyncState } from './listSync';
+import type { BatchOperation, BatchResponse } from './file';
 
 export interface VideoInfo {
   name: string;
   size: number;
   modified: number;
+  transcode?: 'ready' | 'pending' | null; // 浏览器无法直接播放的格式的转码状态
 }
 
 /**
- * 上传视频
+ * 上传视频（经上传队列排队，服务端繁忙时自动重试）
  * @param file 视频文件对象
  * @returns Promise<AxiosResponse>
  */
 export function uploadVideo(file: File) {
   const formData = new FormData();
   formData.append('file', file);
-  return apiClient.post('/api/video/upload', formData);
+  return enqueueUpload(() => apiClient.post('/api/video/upload', formData));
 }
 
 /**
- * 获取视频列表
- * @returns Promise<AxiosResponse<{videos: any[]}>>
+ * 获取视频列表（带ETag条件请求，列表未变化时服务端返回304）
+ * @param query 分页、排序、筛选条件（可选，不传时返回全部，按修改时间倒序）
+ * @returns Promise<AxiosResponse<{videos: VideoInfo[], total: number, next_cursor: string | null}>>
  */
-export function listVideos() {
-  return apiClient.get<{videos: VideoInfo[]}>('/api/video/list');
+export function listVideos(query?: ListQuery) {
+  return getWithETag<{videos: VideoInfo[]} & ListPage>('/api/video/list' + listQuery(query));
+}
+
+/**
+ * 增量同步视频列表，只返回上次同步之后新增、更新、删除的视频
+ * @param state 同步状态（版本号为null时拉取全量）
+ * @returns Promise<AxiosResponse<ListSyncResponse<VideoInfo>>>
+ */
+export function syncVideos(state: ListSyncState) {
+  return getWithETag<ListSyncResponse<VideoInfo>>('/api/video/list' + sinceQuery(state));
 }
 
 /**
@@ -38,6 +53,16 @@ export function downloadVideo(name: string) {
   return `/api/video/download/${encodeURIComponent(name)}`;
 }
 
+/**
+ * 分段并行下载视频（多个Range请求同时下载，拼接后用服务端提供的SHA-256校验），适合大文件
+ * @param name 视频文件名
+ * @param onProgress 进度回调（可选）
+ * @returns Promise<boolean>，服务端不支持分段下载时为false，需改用downloadVideo的链接普通下载
+ */
+export function downloadVideoAccelerated(name: string, onProgress?: (progress: DownloadProgress) => void) {
+  return rangeDownload(downloadVideo(name), name, onProgress);
+}
+
 /**
  * 获取视频预览链接
  * @param name 视频文件名
@@ -54,4 +79,13 @@ export function previewVideo(name: string) {
  */
 export function deleteVideo(name: string) {
   return apiClient.delete(`/api/video/delete/${encodeURIComponent(name)}`);
-} 
\ No newline at end of file
+}
+
+/**
+ * 批量删除、重命名视频，或移动到文件区（一次请求，逐项返回结果）
+ * @param operations 操作列表
+ * @returns Promise<AxiosResponse<BatchResponse>>
+ */
+export function batchVideos(operations: BatchOperation[]) {
+  return apiClient.post<BatchResponse>('/api/video/batch', { operations });
+}
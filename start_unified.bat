@@ -43,7 +43,8 @@ if errorlevel 1 (
 
 echo [3/3] 启动后端服务...
 cd /d %~dp0backend
-python app.py > ..\backend.log 2>&1
+rem 启动参数原样传给后端，如 start_unified.bat --workers 4 指定工作进程数（默认使用config.json中的server_workers）
+python app.py %* > ..\backend.log 2>&1
 if errorlevel 1 (
     echo 后端启动失败，请查看backend.log
     start notepad ..\backend.log